@@ -0,0 +1,383 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide a compiler of composite nodes into python modules.
+
+The generated module defines one function taking the inputs of the
+composite node and returning its outputs. The functions of the nodes are
+imported and called directly: the function does not use nodes, ports,
+listeners or evaluation algorithms::
+
+    from openalea.core.algo.dataflow_compiler import compile_dataflow
+    f = compile_dataflow(composite_node)
+    result = f(1, 2)
+
+    write_module(factory, 'my_dataflow.py')
+
+Nodes redefining eval (iterators, delays...) and lambda variables can not
+be compiled. Blocked nodes are replaced by their current outputs.
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import re
+import sys
+import keyword
+
+from openalea.core.node import Node, FuncNode
+from openalea.core.algo.dataflow_evaluation import ToScriptEvaluation
+from openalea.core.algo.dataflow_schedule import Schedule
+from openalea.core.algo.dataflow_utils import dataflow_name
+
+
+class CompilationError(Exception):
+    """ Exception raised when a dataflow can not be compiled """
+    pass
+
+
+module_template = '''# -*- python -*-
+"""Compiled from the dataflow %(dataflow)s.
+
+%(name)s(%(signature)s) computes the outputs of the dataflow.
+"""
+
+%(imports)s
+
+def _single(ret):
+    """ Output of a node with one output """
+    try:
+        if hasattr(ret, "__getitem__") and len(ret) == 1:
+            return ret[0]
+    except TypeError:
+        pass
+    return ret
+
+
+def _multiple(ret, previous):
+    """ Outputs of a node with several outputs, the missing ones keep
+    their previous value """
+    if not isinstance(ret, (tuple, list)):
+        ret = (ret,)
+    ret = tuple(ret[:len(previous)])
+    return ret + tuple(previous[len(ret):])
+%(instances)s
+
+%(functions)s'''
+
+
+def python_name(name):
+    """ Return a valid python identifier from name """
+    name = re.sub(r'\W', '_', str(name)).strip('_') or 'dataflow'
+    if name[0].isdigit() or keyword.iskeyword(name):
+        name = '_' + name
+    return name
+
+
+def import_path(obj):
+    """ Return (module, name) to import obj, or None if it can not be
+    imported (lambda, closure, class defined in __main__...) """
+    module = getattr(obj, '__module__', None)
+    name = getattr(obj, '__name__', None)
+    if not module or not name or module == '__main__':
+        return None
+    mod = sys.modules.get(module)
+    if mod is None or getattr(mod, name, None) is not obj:
+        return None
+    return module, name
+
+
+_literal_types = (int, long, bool, str, unicode, type(None))
+
+
+def is_literal(value):
+    """ Return True if repr(value) evaluates to an equal value """
+    if type(value) in _literal_types:
+        return True
+    if type(value) is float:
+        return value == value and value not in (float('inf'), -float('inf'))
+    if type(value) in (tuple, list):
+        return all(is_literal(v) for v in value)
+    if type(value) is dict:
+        return all(is_literal(k) and is_literal(v)
+                   for k, v in value.iteritems())
+    return False
+
+
+class DataflowCompiler(ToScriptEvaluation):
+    """ Compile a composite node into the source of a python module.
+
+    eval() returns the source. Values which can not be written in the
+    source (lambda functions, objects...) are bound by name: they are
+    given by get_namespace().
+    """
+
+    # create the instances of the Node subclasses in the module instead
+    # of binding the nodes (their state is lost)
+    instantiate_nodes = False
+
+    def __init__(self, dataflow, name=None):
+        """
+        :param dataflow: a CompositeNode or a CompositeNodeFactory
+        :param name: name of the generated function
+            (default: name of the dataflow)
+        """
+        from openalea.core.compositenode import CompositeNodeFactory
+        if isinstance(dataflow, CompositeNodeFactory):
+            dataflow = dataflow.instantiate()
+
+        ToScriptEvaluation.__init__(self, dataflow)
+        if name is None:
+            name = python_name(dataflow_name(dataflow))
+        self.name = name
+        self.clear()
+
+    def clear(self):
+        """ Reset the generated code """
+        self._names = set(['_single', '_multiple', self.name])
+        # (module, name) -> alias
+        self._imports = {}
+        # alias -> object which can not be imported
+        self._bound = {}
+        self._instances = []
+        self._functions = []
+
+    def new_name(self, base):
+        """ Return a unique module level name """
+        name = python_name(base)
+        if not name.startswith('_'):
+            name = '_' + name
+        new, i = name, 0
+        while new in self._names:
+            i += 1
+            new = '%s%d' % (name, i)
+        self._names.add(new)
+        return new
+
+    def reference(self, obj, base):
+        """ Return the name of obj in the module (imported or bound) """
+        path = import_path(obj)
+        if path is not None:
+            alias = self._imports.get(path)
+            if alias is None:
+                alias = self._imports[path] = self.new_name(path[1])
+            return alias
+        for alias, bound in self._bound.iteritems():
+            if bound is obj:
+                return alias
+        alias = self.new_name(base)
+        self._bound[alias] = obj
+        return alias
+
+    def constant(self, value, base):
+        """ Return the expression of a constant value """
+        if is_literal(value):
+            return repr(value)
+        return self.reference(value, base)
+
+    def node_call(self, actor, args, base):
+        """ Return the expression calling a node and True if it returns
+        the outputs as __call__ does (False for a compiled composite) """
+        from openalea.core.compositenode import CompositeNode
+        from openalea.core.system.systemnodes import LambdaVar
+
+        caption = actor.get_caption() or type(actor).__name__
+        if isinstance(actor, CompositeNode):
+            fname = self.new_name(caption)
+            self.compile_composite(actor, fname)
+            return '%s(%s)' % (fname, ', '.join(args)), False
+
+        if isinstance(actor, LambdaVar):
+            raise CompilationError("%s: lambda variables can not be compiled"
+                                   % caption)
+        if type(actor).eval.im_func is not Node.eval.im_func:
+            raise CompilationError("%s can not be compiled: it redefines eval"
+                                   % caption)
+
+        call = type(actor).__call__.im_func
+        if call is FuncNode.__call__.im_func:
+            if actor.func is None:
+                return 'None', True
+            func = self.reference(actor.func, caption)
+            return '%s(%s)' % (func, ', '.join(args)), True
+        if call is Node.__call__.im_func:
+            raise CompilationError("%s does not compute its outputs" % caption)
+
+        # a Node subclass: use the node itself, or create an instance
+        # in the module if the node must be written in the source
+        cls = type(actor)
+        if not self.instantiate_nodes or import_path(cls) is None:
+            alias = self.reference(actor, caption)
+        elif cls.__init__.im_func is not Node.__init__.im_func:
+            raise CompilationError("%s can not be instantiated in a module: "
+                                   "it redefines __init__" % caption)
+        else:
+            alias = self.new_name(caption)
+            desc = lambda ports: tuple(dict(name=port['name'])
+                                       for port in ports)
+            self._instances.append('%s = %s(%r, %r)' % (
+                alias, self.reference(cls, cls.__name__),
+                desc(actor.input_desc), desc(actor.output_desc)))
+        return '%s([%s])' % (alias, ', '.join(args)), True
+
+    def compile_composite(self, df, fname):
+        """ Add the function fname computing the outputs of df """
+        id_in = getattr(df, 'id_in', None)
+        id_out = getattr(df, 'id_out', None)
+        nb_in = df.get_nb_input()
+        nb_out = df.get_nb_output()
+
+        # parameters named by the input ports, with the current values
+        # as default
+        used = set(self._names)
+        params = []
+        signature = []
+        for i in range(nb_in):
+            name = python_name(df.input_desc[i]['name'])
+            while name in used or re.match(r'v\d+_\d+$', name):
+                name += '_'
+            used.add(name)
+            params.append(name)
+            signature.append('%s=%s' % (name, self.constant(
+                df.get_input(i), '%s_%s' % (fname, name))))
+
+        if id_out is not None and nb_out > 0 and df.has_vertex(id_out):
+            leaves = [id_out]
+        else:
+            leaves = [vid for vid in df.vertices() if df.nb_out_edges(vid) == 0]
+        schedule = Schedule(df, leaves)
+        active = schedule.active_vertices(lambda vid, actor: actor.block)
+
+        def output(nvid, nactor, out_index):
+            if nvid == id_in:
+                return params[out_index]
+            if nvid in active:
+                return 'v%d_%d' % (nvid, out_index)
+            # blocked node
+            return self.constant(nactor.get_output(out_index),
+                                 '%s_v%d_%d' % (fname, nvid, out_index))
+
+        body = []
+        returns = None
+        for vid, actor, inputs in schedule.steps:
+            if vid not in active or vid == id_in:
+                continue
+            if not isinstance(actor, Node):
+                raise CompilationError("vertex %s is not a node" % vid)
+
+            connected = dict(inputs)
+            args = []
+            for index in range(actor.get_nb_input()):
+                parents = connected.get(index)
+                if parents:
+                    exprs = [output(nvid, nactor, out_index)
+                             for npid, nvid, nactor, out_index in parents]
+                    if len(exprs) == 1:
+                        args.append(exprs[0])
+                    else:
+                        args.append('[%s]' % ', '.join(exprs))
+                else:
+                    args.append(self.constant(actor.get_input(index),
+                                              '%s_v%d_in%d' % (fname, vid,
+                                                               index)))
+
+            if vid == id_out:
+                returns = args
+                continue
+
+            call, raw = self.node_call(actor, args, '%s_%d' % (fname, vid))
+            targets = ['v%d_%d' % (vid, i)
+                       for i in range(actor.get_nb_output())]
+            if not targets:
+                body.append(call)
+            elif not raw:
+                body.append('%s = %s' % (', '.join(targets), call))
+            elif len(targets) == 1:
+                body.append('%s = _single(%s)' % (targets[0], call))
+            else:
+                # as Node.store_outputs
+                previous = self.constant(tuple(actor.outputs),
+                                         '%s_v%d_outputs' % (fname, vid))
+                body.append('%s = _multiple(%s, %s)' % (', '.join(targets),
+                                                        call, previous))
+
+        if returns:
+            if len(returns) == 1:
+                body.append('return %s' % returns[0])
+            else:
+                body.append('return %s' % ', '.join(returns))
+        if not body:
+            body.append('pass')
+
+        doc = dataflow_name(df).replace('"', "'")
+        if doc:
+            body.insert(0, '""" %s """' % doc)
+        self._functions.append('def %s(%s):\n    %s\n' % (
+            fname, ', '.join(signature), '\n    '.join(body)))
+        return params
+
+    def eval(self, *args, **kwds):
+        """ Return the source of the module """
+        self.clear()
+        params = self.compile_composite(self._dataflow, self.name)
+
+        imports = ['from %s import %s as %s' % (module, name, alias)
+                   for (module, name), alias in sorted(self._imports.items())]
+        instances = ''
+        if self._instances:
+            instances = '\n\n' + '\n'.join(self._instances) + '\n'
+        return module_template % dict(
+            dataflow=dataflow_name(self._dataflow) or self.name,
+            name=self.name,
+            signature=', '.join(params),
+            imports='\n'.join(imports),
+            instances=instances,
+            functions='\n\n'.join(self._functions))
+
+    def get_namespace(self):
+        """ Return the values bound by name in the last compiled source """
+        return dict(self._bound)
+
+
+def compile_dataflow(dataflow, name=None):
+    """ Return a python function computing the outputs of a composite
+    node (or of a CompositeNodeFactory) from its inputs """
+    compiler = DataflowCompiler(dataflow, name)
+    source = compiler.eval()
+    namespace = compiler.get_namespace()
+    code = compile(source, '<compiled %s>' % compiler.name, 'exec')
+    exec code in namespace
+    return namespace[compiler.name]
+
+
+def write_module(dataflow, filename, name=None):
+    """ Write the module compiled from a composite node (or from a
+    CompositeNodeFactory) in filename.
+
+    :raises CompilationError: if a value can not be written in the module
+    """
+    compiler = DataflowCompiler(dataflow, name)
+    compiler.instantiate_nodes = True
+    source = compiler.eval()
+    bound = compiler.get_namespace()
+    if bound:
+        raise CompilationError("values can not be written in a module: %s"
+                               % ', '.join(sorted(bound)))
+    f = open(filename, 'w')
+    try:
+        f.write(source)
+    finally:
+        f.close()
+    return compiler.name
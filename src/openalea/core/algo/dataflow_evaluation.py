@@ -19,13 +19,35 @@
 __license__ = "Cecill-C"
 __revision__ = " $Id$ "
 
+import os
 import sys
-from time import clock
+import cPickle
+from time import clock, time
+from datetime import datetime
 import traceback as tb
+from heapq import heappush, heappop
+from threading import Thread, Lock
+from Queue import Queue, Empty
+from functools import partial
 from openalea.core import ScriptLibrary
+from openalea.core import logger
 
-from openalea.core.dataflow import SubDataflow
+from openalea.core.dataflow import SubDataflow, DataFlow
 from openalea.core.interface import IFunction
+from openalea.core.algo.dataflow_schedule import Schedule, CycleSchedule
+from openalea.core.node import Node, headless_context, set_headless_context
+from openalea.core.algo.node_cache import get_node_cache, is_pure_node
+from openalea.core.algo.dataflow_profiler import get_profiler
+from openalea.core.algo.output_spill import get_output_spill
+from openalea.core.algo.node_timing import get_node_timing
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
 
 
 PROVENANCE = False
@@ -67,10 +89,35 @@ def db_create(cursor):
     cur.execute("CREATE TABLE IF NOT EXISTS Tag (CompositeNodeExecid INTEGER, createtime DATETIME, name varchar(25),userid INTEGER,PRIMARY KEY(CompositeNodeExecid),FOREIGN KEY(userid) references User)")
     return cur
 
+def db_create_indices(cursor):
+    cur = cursor
+    cur.execute("CREATE INDEX IF NOT EXISTS CompositeNode_name ON CompositeNode (name)")
+    cur.execute("CREATE INDEX IF NOT EXISTS Node_CompositeNodeid ON Node (CompositeNodeid, name)")
+    cur.execute("CREATE INDEX IF NOT EXISTS CompositeNodeExec_CompositeNodeid ON CompositeNodeExec (CompositeNodeid)")
+    cur.execute("CREATE INDEX IF NOT EXISTS NodeExec_CompositeNodeExecid ON NodeExec (CompositeNodeExecid)")
+    cur.execute("CREATE INDEX IF NOT EXISTS NodeExec_Nodeid ON NodeExec (Nodeid)")
+    return cur
+
 def get_database_name():
     db_fn = path(settings.get_openalea_home_dir())/'provenance.sq3'
     return db_fn
 
+def db_connect(db_name=None):
+    """ Return a connection to the provenance database.
+
+    The database is created if it does not exist and uses a write ahead log,
+    so it can be read while it is written.
+    """
+    if db_name is None:
+        db_name = get_database_name()
+    conn = sqlite3.connect(db_name)
+    conn.execute("PRAGMA journal_mode=WAL")
+    cur = conn.cursor()
+    db_create(cur)
+    db_create_indices(cur)
+    conn.commit()
+    return conn
+
 def db_connexion():
     """ Return a curso on the database.
 
@@ -78,15 +125,8 @@ def db_connexion():
     """
     global db_conn
     if db_conn is None:
-        db_fn = get_database_name()
-        if not db_fn.exists():
-            db_conn=sqlite3.connect(db_fn)
-            cur = db_conn.cursor()
-            cur = db_create(cur)
-            return cur
-    else:
-        cur = db_conn.cursor()
-        return cur
+        db_conn = db_connect()
+    return db_conn.cursor()
 
 class Provenance(object):
     def __init__(self, workflow):
@@ -124,6 +164,237 @@ class PrintProvenance(Provenance):
         provenance(vid, node, start_time, end_time)
 
 
+def get_datetime(t):
+    """ Return the sqlite DATETIME of a time in seconds """
+    return datetime.fromtimestamp(t).isoformat(' ')
+
+
+class ProvenanceWriter(Thread):
+    """ Write provenance records in the database from a background thread.
+
+    Records are queued by the evaluations and written in batches, one
+    transaction per batch.
+    """
+
+    # maximum number of records written in a transaction
+    batch_size = 1000
+
+    def __init__(self, db_name=None):
+        """
+        :param db_name: file name of the database
+            (default: provenance.sq3 in the openalea home directory)
+        """
+        Thread.__init__(self)
+        self.setDaemon(True)
+
+        if db_name is None:
+            db_name = get_database_name()
+        self.db_name = db_name
+        self.queue = Queue()
+
+        # CompositeNodeExecid of the running workflow executions
+        self._exec_ids = {}
+        self._composite_ids = {}
+        self._node_ids = {}
+
+        self.start()
+
+    def put(self, record):
+        """ Queue a record to write """
+        self.queue.put(record)
+
+    def flush(self):
+        """ Wait until all the queued records are written """
+        self.queue.join()
+
+    def close(self):
+        """ Write the queued records and stop the thread """
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        conn = db_connect(self.db_name)
+        stop = False
+        while not stop:
+            records = [self.queue.get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            stop = None in records
+            try:
+                self.write_batch(conn, [r for r in records if r is not None])
+            finally:
+                for record in records:
+                    self.queue.task_done()
+        conn.close()
+
+    def write_batch(self, conn, records):
+        """ Write records in one transaction. If it fails, the records
+        are written one by one and the invalid ones are dropped. """
+        try:
+            self.write_records(conn, records)
+        except Exception:
+            for record in records:
+                try:
+                    self.write_records(conn, [record])
+                except Exception, e:
+                    logger.error('Provenance: record %r dropped: %s'
+                                 % (record, e))
+
+    def write_records(self, conn, records):
+        """ Write records in one transaction, rolled back on error """
+        exec_ids = dict(self._exec_ids)
+        try:
+            cur = conn.cursor()
+            for record in records:
+                getattr(self, 'write_' + record[0])(cur, *record[1:])
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            # the rows created by the transaction do not exist anymore
+            self._exec_ids = exec_ids
+            self._composite_ids.clear()
+            self._node_ids.clear()
+            raise
+
+    def composite_id(self, cur, name):
+        """ Return the id of a composite node (created if needed) """
+        cid = self._composite_ids.get(name)
+        if cid is None:
+            cur.execute("SELECT CompositeNodeid FROM CompositeNode WHERE name=?",
+                        (name,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("INSERT INTO CompositeNode (creatime, name) VALUES (?, ?)",
+                            (get_datetime(time()), name))
+                cid = cur.lastrowid
+            else:
+                cid = row[0]
+            self._composite_ids[name] = cid
+        return cid
+
+    def node_id(self, cur, cid, name, factory):
+        """ Return the id of a node of a composite node (created if needed) """
+        key = (cid, name, factory)
+        nid = self._node_ids.get(key)
+        if nid is None:
+            cur.execute("SELECT Nodeid FROM Node WHERE CompositeNodeid=? AND name=? AND NodeFactory=?",
+                        key)
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("INSERT INTO Node (createtime, name, NodeFactory, CompositeNodeid) VALUES (?, ?, ?, ?)",
+                            (get_datetime(time()), name, factory, cid))
+                nid = cur.lastrowid
+            else:
+                nid = row[0]
+            self._node_ids[key] = nid
+        return nid
+
+    def write_workflow(self, cur, exec_key, name, start):
+        cid = self.composite_id(cur, name)
+        cur.execute("INSERT INTO CompositeNodeExec (createtime, CompositeNodeid) VALUES (?, ?)",
+                    (get_datetime(start), cid))
+        self._exec_ids[exec_key] = (cur.lastrowid, cid)
+
+    def write_workflow_end(self, cur, exec_key, end):
+        exec_id, cid = self._exec_ids.pop(exec_key)
+        cur.execute("UPDATE CompositeNodeExec SET endtime=? WHERE CompositeNodeExecid=?",
+                    (get_datetime(end), exec_id))
+
+    def write_node(self, cur, exec_key, name, factory, start, end):
+        exec_id, cid = self._exec_ids[exec_key]
+        nid = self.node_id(cur, cid, name, factory)
+        cur.execute("INSERT INTO NodeExec (createtime, endtime, Nodeid, CompositeNodeExecid) VALUES (?, ?, ?, ?)",
+                    (get_datetime(start), get_datetime(end), nid, exec_id))
+
+
+class DBProvenance(Provenance):
+    """ Record the executions in the provenance database.
+
+    Evaluations only queue the records, they are written by
+    a ProvenanceWriter.
+    """
+
+    def __init__(self, workflow, writer):
+        Provenance.__init__(self, workflow)
+        self.writer = writer
+        self._exec_key = None
+
+    def workflow_name(self):
+        cn = self.workflow
+        factory = getattr(cn, 'factory', None)
+        if factory is not None:
+            return factory.name
+        return cn.get_caption()
+
+    def workflow_exec(self, *args):
+        self._exec_key = object()
+        self.writer.put(('workflow', self._exec_key, self.workflow_name(),
+                         time()))
+
+    def end_time(self):
+        if self._exec_key is not None:
+            self.writer.put(('workflow_end', self._exec_key, time()))
+            self._exec_key = None
+
+    def node_exec(self, vid, node, start_time, end_time, *args):
+        # algorithms which do not report the workflow execution
+        if self._exec_key is None:
+            self.workflow_exec()
+
+        factory = getattr(node, 'factory', None)
+        if factory is not None and factory.package is not None:
+            factory_name = '%s:%s' % (factory.package.name, factory.name)
+        elif factory is not None:
+            factory_name = factory.name
+        else:
+            factory_name = ''
+
+        # start_time and end_time are processor times
+        end = time()
+        self.writer.put(('node', self._exec_key, node.get_caption(),
+                         factory_name, end - (end_time - start_time), end))
+
+
+_provenance_writer = None
+
+
+def get_provenance(workflow):
+    """ Return the provenance of a workflow evaluation """
+    if _provenance_writer is not None:
+        return DBProvenance(workflow, _provenance_writer)
+    return PrintProvenance(workflow)
+
+
+def enable_provenance(db_name=None):
+    """ Record the evaluations in the provenance database.
+
+    :param db_name: file name of the database
+        (default: provenance.sq3 in the openalea home directory)
+    :returns: the ProvenanceWriter
+    """
+    global PROVENANCE, _provenance_writer
+    disable_provenance()
+    _provenance_writer = ProvenanceWriter(db_name)
+    PROVENANCE = True
+    return _provenance_writer
+
+
+def disable_provenance():
+    """ Stop recording the evaluations, the queued records are written """
+    global PROVENANCE, _provenance_writer
+    PROVENANCE = False
+    if _provenance_writer is not None:
+        _provenance_writer.close()
+        _provenance_writer = None
+
+
 def provenance(vid, node, start_time, end_time):
     #from service import db
     #conn = db.connect()
@@ -198,13 +469,33 @@ def cmp_posx(x, y):
 
 class AbstractEvaluation(object):
 
+    # free the outputs of the nodes once they have been read by all
+    # their consumers (the outputs of the leaves are kept)
+    release_outputs = False
+
+    # the instance can be reused by the next evaluations of the dataflow
+    # (see CompositeNode.get_eval_algo)
+    reusable = False
+
     def __init__(self, dataflow):
         """
         :param dataflow: to be done
         """
         self._dataflow = dataflow
+        # precompiled schedules indexed by their leaves
+        self._schedules = {}
+        # consumers of the output ports, computed once per topology
+        self._consumers = None
+        # output port -> number of consumers not evaluated yet
+        # (None if the outputs are not released)
+        self._remaining = None
+        self._release_lock = Lock()
+        # size of the large outputs kept in memory (not spilled), total
+        # and by (node, output index)
+        self._resident_size = 0
+        self._resident = {}
         if PROVENANCE:
-            self.provenance = PrintProvenance(dataflow)
+            self.provenance = get_provenance(dataflow)
 
     def eval(self, *args):
         """todo"""
@@ -221,14 +512,18 @@ class AbstractEvaluation(object):
         """
 
         node = self._dataflow.actor(vid)
+        profiler = get_profiler()
 
         try:
             t0 = clock()
-            ret = node.eval()
+            if profiler is None:
+                ret = self.run_node(vid, node)
+            else:
+                ret = profiler.run(self._dataflow, vid, node, self.run_node)
             t1 = clock()
 
             if PROVENANCE:
-                self.provenance.node_exec(vid, node, t0,t1)
+                self.get_provenance().node_exec(vid, node, t0,t1)
                 #provenance(vid, node, t0,t1)
             
             # When an exception is raised, a flag is set.
@@ -236,7 +531,10 @@ class AbstractEvaluation(object):
             node.raise_exception = False
             # if hasattr(node, 'raise_exception'):
             #     del node.raise_exception
+            self.spill_outputs(node)
             node.notify_listeners(('data_modified', None, None))
+            if self._remaining is not None:
+                self.release_inputs(vid)
             return ret
 
         except EvaluationException, e:
@@ -254,30 +552,219 @@ class AbstractEvaluation(object):
             raise EvaluationException(vid, node, e, \
                 tb.format_tb(sys.exc_info()[2]))
 
+    def run_node(self, vid, node):
+        """ Run the evaluation of the node of vertex vid.
+
+        The outputs of side effect free nodes are read from the node
+        cache if it is enabled. The run time of the node is recorded by
+        the node timing only if its function is called (not for skipped
+        lazy or blocked nodes, nor for cache hits).
+        """
+        call = self.node_call(vid, node)
+
+        timing = get_node_timing()
+        runtimes = []
+        if timing is not None and (call is not None or
+                                   not self.redefines_eval(node)):
+            func = call if call is not None else node.__call__
+
+            def call(inputs):
+                start = time()
+                outputs = func(inputs)
+                runtimes.append(time() - start)
+                return outputs
+
+        cache = get_node_cache()
+        if cache is not None:
+            call = cache.cached_call(node, call)
+
+        if call is None:
+            ret = node.eval()
+        else:
+            ret = node.eval(call)
+        if runtimes:
+            timing.record(node, runtimes[0])
+        return ret
+
+    def redefines_eval(self, node):
+        """ Return True if node redefines eval (its function can not be
+        replaced by another call) """
+        eval_func = getattr(getattr(type(node), 'eval', None), 'im_func', None)
+        return eval_func is not Node.eval.im_func
+
+    def node_call(self, vid, node):
+        """ Return the function computing the outputs of the node from its
+        inputs, or None to use the node itself.
+
+        Overload this method to evaluate the node differently
+        (e.g. in another process).
+        """
+        return None
+
+    def get_schedule(self, leaves):
+        """ Return the schedule evaluating leaves (compiled if needed) """
+        leaves = tuple(leaves)
+        schedule = self._schedules.get(leaves)
+        if schedule is None or not schedule.is_valid():
+            if schedule is None and len(self._schedules) > 16:
+                self._schedules.clear()
+            schedule = self._schedules[leaves] = Schedule(self._dataflow,
+                                                          leaves)
+        return schedule
+
+    def is_volatile(self, actor):
+        """ Return True if the node is evaluated even if its inputs
+        have not changed (not lazy, with a delay or redefining eval) """
+        if not isinstance(actor, Node):
+            return True
+        eval_func = getattr(type(actor).eval, 'im_func', None)
+        if eval_func is not Node.eval.im_func:
+            return True
+        return not actor.lazy or actor.delay != 0
+
+    def set_schedule_inputs(self, actor, inputs):
+        """ Set the inputs of actor from a schedule step inputs """
+        for index, parents in inputs:
+            nb = len(parents)
+            if nb == 1:
+                npid, nvid, nactor, out_index = parents[0]
+                actor.set_input(index, nactor.get_output(out_index))
+            elif nb > 1:
+                actor.set_input(index, [nactor.get_output(out_index)
+                    for npid, nvid, nactor, out_index in parents])
 
     def get_parent_nodes(self, pid):
         """
         Return the list of parent node connected to pid
         The list contains tuples (port_pid, node_pid, actor)
         This list is sorted by the x value of the node
+        (see DataFlow.parent_ports)
         """
+        return [(npid, nvid, nactor) for npid, nvid, nactor, out_index
+                in self._dataflow.parent_ports(pid)]
+
+    def get_consumers(self):
+        """ Return the input ports connected to each output port and the
+        output ports read by each vertex.
 
+        :returns: (dict out pid -> list of in pids,
+                   dict vid -> list of out pids)
+        """
         df = self._dataflow
+        version = df.topology_version()
+        if self._consumers is None or self._consumers[0] != version:
+            consumers = {}
+            reads = {}
+            for vid in df.vertices():
+                npids = reads[vid] = []
+                for pid in df.in_ports(vid):
+                    for npid in df.connected_ports(pid):
+                        npids.append(npid)
+                        consumers.setdefault(npid, []).append(pid)
+            self._consumers = (version, consumers, reads)
+        return self._consumers[1:]
+
+    def init_evaluation(self):
+        """ Called at the beginning of an evaluation: start counting the
+        consumers of the outputs if release_outputs is set and the size
+        of the outputs kept in memory """
+        if self.release_outputs:
+            self._remaining = {}
+        else:
+            self._remaining = None
+        self._resident_size = 0
+        self._resident = {}
+
+    def spill_outputs(self, node):
+        """ Replace the large outputs of node by views on memory mapped
+        files if the output spill is enabled """
+        spill = get_output_spill()
+        if spill is None or isinstance(node, DataFlow):
+            return
+        outputs = node.outputs
+        for index, value in enumerate(outputs):
+            key = (id(node), index)
+            with self._release_lock:
+                # the previous value of the output is replaced
+                resident = self._resident_size - self._resident.pop(key, 0)
+                keep, self._resident_size = spill.keep(value, resident)
+                if self._resident_size > resident:
+                    self._resident[key] = self._resident_size - resident
+            if not keep:
+                outputs[index] = spill.spill(value)
+
+    def is_pinned(self, vid, actor):
+        """ Return True if the outputs of actor must be kept: inputs of
+        the composite node, blocked, composite, observed (e.g. by a
+        widget) or continuously evaluated """
+        if not isinstance(actor, Node) or isinstance(actor, DataFlow):
+            return True
+        if vid == getattr(self._dataflow, 'id_in', None):
+            return True
+        if actor.block or actor.user_application:
+            return True
+        return bool(actor.listeners or actor.continuous_eval.listeners)
 
-        # For each connected node
-        npids = [(npid, df.vertex(npid), df.actor(df.vertex(npid))) \
-                     for npid in df.connected_ports(pid)]
-        npids.sort(cmp=cmp_posx)
+    def release_inputs(self, vid):
+        """ Vertex vid has been evaluated: free the outputs it has read
+        which are not needed by another consumer.
 
-        return npids
+        A released node is marked as modified, so it will be evaluated
+        again by the next evaluation.
+        """
+        df = self._dataflow
+        consumers, reads = self.get_consumers()
+        remaining = self._remaining
+
+        released = []
+        with self._release_lock:
+            for npid in reads.get(vid, ()):
+                nb = remaining.get(npid, len(consumers[npid])) - 1
+                remaining[npid] = nb
+                if nb == 0:
+                    released.append(npid)
+
+        id_out = getattr(df, 'id_out', None)
+        for npid in released:
+            nvid = df.vertex(npid)
+            actor = df.actor(nvid)
+            if self.is_pinned(nvid, actor):
+                continue
+            index = df.local_id(npid)
+            actor.outputs[index] = None
+            actor.modified = True
+            with self._release_lock:
+                self._resident_size -= self._resident.pop((id(actor), index),
+                                                          0)
+            # the inputs of the consumers also reference the output
+            # (the inputs of __out__ are the outputs of the composite node)
+            for pid in consumers[npid]:
+                cvid = df.vertex(pid)
+                cactor = df.actor(cvid)
+                if cvid != id_out and not isinstance(cactor, DataFlow):
+                    cactor.inputs[df.local_id(pid)] = None
 
     def set_provenance(self, provenance):
         self.provenance = provenance
 
+    def get_provenance(self):
+        """ Return the provenance (created if provenance has been enabled
+        after the creation of the algorithm) """
+        provenance = getattr(self, 'provenance', None)
+        if (provenance is None or
+            (type(provenance) in (PrintProvenance, DBProvenance) and
+             getattr(provenance, 'writer', None) is not _provenance_writer)):
+            provenance = self.provenance = get_provenance(self._dataflow)
+        return provenance
+
 class BrutEvaluation(AbstractEvaluation):
     """ Basic evaluation algorithm """
     __evaluators__.append("BrutEvaluation")
 
+    # the state of an evaluation is reset by eval, the schedules and the
+    # consumers are kept between the evaluations
+    reusable = True
+
     def __init__(self, dataflow):
 
         AbstractEvaluation.__init__(self, dataflow)
@@ -316,11 +803,11 @@ class BrutEvaluation(AbstractEvaluation):
 
             cpt = 0
             # For each connected node
-            for npid, nvid, nactor in self.get_parent_nodes(pid):
+            for npid, nvid, nactor, out_index in df.parent_ports(pid):
                 if not self.is_stopped(nvid, nactor):
                     self.eval_vertex(nvid)
 
-                inputs.append(nactor.get_output(df.local_id(npid)))
+                inputs.append(nactor.get_output(out_index))
                 cpt += 1
 
             # set input as a list or a simple value
@@ -339,6 +826,7 @@ class BrutEvaluation(AbstractEvaluation):
 
         # Unvalidate all the nodes
         self._evaluated.clear()
+        self.init_evaluation()
 
         # Eval from the leaf
         for vid in (vid for vid in df.vertices() if df.nb_out_edges(vid)==0):
@@ -364,6 +852,7 @@ class PriorityEvaluation(BrutEvaluation):
             self._evaluated -= self._resolution_node
         else:
             self._evaluated.clear()
+            self.init_evaluation()
 
         if (vtx_id is not None):
             return self.eval_vertex(vtx_id, *args)
@@ -383,16 +872,641 @@ class PriorityEvaluation(BrutEvaluation):
             print "Evaluation time: %s"%(t1-t0)
 
 
+def cpu_count():
+    """ Return the number of cpus (1 if unknown) """
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+class ParallelEvaluation(PriorityEvaluation):
+    """ Evaluate independent branches of the dataflow on a pool of threads.
+
+    The vertices needed to compute the leaves are collected first.
+    A vertex is sent to the pool as soon as all its parents have been
+    evaluated, ready vertices being sent by decreasing priority.
+    Nodes which release the GIL (numpy, I/O, subprocess...) then run
+    concurrently.
+
+    Inputs of the nodes are set in the calling thread, only the node
+    evaluation is done by the workers.
+    """
+    __evaluators__.append("ParallelEvaluation")
+
+    # number of worker threads (None means one per cpu)
+    nb_workers = None
+
+    def __init__(self, dataflow, nb_workers=None):
+        PriorityEvaluation.__init__(self, dataflow)
+        if nb_workers is not None:
+            self.nb_workers = nb_workers
+
+    def get_nb_workers(self):
+        """ Return the number of worker threads to use """
+        if self.nb_workers is None:
+            return cpu_count()
+        return max(1, int(self.nb_workers))
+
+    def scan_graph(self, leaves):
+        """ Return the vertices to evaluate to compute the leaves.
+
+        :param leaves: list of vertex ids
+        :returns: a dict vid -> set of parent vids to evaluate before vid
+        """
+        df = self._dataflow
+
+        parents = {}
+        scan_list = list(leaves)
+        while scan_list:
+            vid = scan_list.pop()
+            if vid in parents:
+                continue
+
+            pvids = parents[vid] = set()
+            for pid in df.in_ports(vid):
+                for npid in df.connected_ports(pid):
+                    nvid = df.vertex(npid)
+                    if not self.is_stopped(nvid, df.actor(nvid)):
+                        pvids.add(nvid)
+                        scan_list.append(nvid)
+
+        return parents
+
+    def set_inputs(self, vid):
+        """ Set the inputs of the vertex vid from its parent outputs """
+        df = self._dataflow
+        actor = df.actor(vid)
+
+        for pid in df.in_ports(vid):
+            inputs = [nactor.get_output(out_index)
+                      for npid, nvid, nactor, out_index in df.parent_ports(pid)]
+
+            # set input as a list or a simple value
+            if (len(inputs) == 1):
+                actor.set_input(df.local_id(pid), inputs[0])
+            elif (len(inputs) > 1):
+                actor.set_input(df.local_id(pid), inputs)
+
+    def ready_key(self, vid):
+        """ Sort key of the ready vertices (higher priority first) """
+        actor = self._dataflow.actor(vid)
+        return (-actor.internal_data.get('priority', 0), vid)
+
+    def init_ready(self, parents):
+        """ Return the children of each vertex, the number of parents
+        each vertex is waiting for, and the heap of ready vertices.
+
+        :param parents: the dict returned by scan_graph
+        """
+        children = dict((vid, []) for vid in parents)
+        for vid, pvids in parents.iteritems():
+            for pvid in pvids:
+                children[pvid].append(vid)
+
+        waiting = dict((vid, len(pvids)) for vid, pvids in parents.iteritems())
+        ready = []
+        for vid, nb in waiting.iteritems():
+            if nb == 0:
+                heappush(ready, (self.ready_key(vid), vid))
+
+        return children, waiting, ready
+
+    def eval_vertex_code_in(self, context, vid):
+        """ Evaluate the vertex vid in the headless context of the thread
+        which started the evaluation """
+        previous = set_headless_context(context)
+        try:
+            return self.eval_vertex_code(vid)
+        finally:
+            set_headless_context(previous)
+
+    def worker(self, tasks, results, context=None):
+        """ Thread function: evaluate the vertices received in tasks
+        (in the headless context of the calling thread) """
+        set_headless_context(context)
+        while True:
+            vid = tasks.get()
+            if vid is None:
+                return
+            try:
+                self.eval_vertex_code(vid)
+                results.put((vid, None))
+            except Exception, e:
+                results.put((vid, e))
+
+    def eval_vertices(self, leaves):
+        """ Evaluate the leaves and all the vertices they depend on """
+        parents = self.scan_graph(leaves)
+        children, waiting, ready = self.init_ready(parents)
+
+        tasks = Queue()
+        results = Queue()
+        nb_workers = min(self.get_nb_workers(), len(parents))
+        context = headless_context()
+        workers = [Thread(target=self.worker,
+                          args=(tasks, results, context))
+                   for i in xrange(nb_workers)]
+        for t in workers:
+            t.setDaemon(True)
+            t.start()
+
+        running = 0
+        error = None
+        try:
+            while ready or running:
+                # Submit the ready vertices unless an error occured.
+                # Keep the others in the heap: a vertex becoming ready
+                # may have a higher priority.
+                while ready and error is None and running < nb_workers:
+                    key, vid = heappop(ready)
+                    self.set_inputs(vid)
+                    tasks.put(vid)
+                    running += 1
+
+                if not running:
+                    break
+
+                vid, e = results.get()
+                running -= 1
+                self._evaluated.add(vid)
+
+                if e is not None:
+                    # Wait for the running tasks and report the first error
+                    if error is None:
+                        error = e
+                    continue
+
+                for cvid in children[vid]:
+                    waiting[cvid] -= 1
+                    if waiting[cvid] == 0:
+                        heappush(ready, (self.ready_key(cvid), cvid))
+        finally:
+            for t in workers:
+                tasks.put(None)
+            for t in workers:
+                t.join()
+
+        if error is not None:
+            raise error
+
+        # Vertices belonging to a cycle are never ready.
+        # Evaluate them sequentially like the other algorithms.
+        for vid in leaves:
+            if vid not in self._evaluated:
+                PriorityEvaluation.eval_vertex(self, vid)
+
+    def eval_vertex(self, vid, *args):
+        """ Evaluate the vertex vid and its parents """
+        self.eval_vertices([vid])
+
+    def eval(self, vtx_id=None, *args, **kwds):
+        """ Evaluate the dataflow from vtx_id or from the leaves """
+        t0 = clock()
+
+        df = self._dataflow
+        # Unvalidate all the nodes
+        self._evaluated.clear()
+        self.init_evaluation()
+
+        if (vtx_id is not None):
+            leaves = [vtx_id]
+        else:
+            leaves = [(vid, df.actor(vid))
+                  for vid in df.vertices() if df.nb_out_edges(vid)==0]
+            leaves.sort(cmp_priority)
+            leaves = [vid for vid, actor in leaves]
+
+        self.eval_vertices(leaves)
+
+        t1 = clock()
+        if quantify:
+            print "Evaluation time: %s"%(t1-t0)
+
+
+class CriticalPathEvaluation(ParallelEvaluation):
+    """ Parallel evaluation sending first the ready vertices on the
+    critical path of the dataflow.
+
+    The rank of a vertex is the longest estimated run time from the
+    vertex to a leaf. Run times are the historical ones recorded by the
+    node timing (see node_timing.enable_node_timing): nodes never
+    evaluated cost the mean of the known run times. If the node timing
+    is disabled, each node costs 1 and the rank is the longest number of
+    nodes to a leaf.
+    """
+    __evaluators__.append("CriticalPathEvaluation")
+
+    def __init__(self, dataflow, nb_workers=None):
+        ParallelEvaluation.__init__(self, dataflow, nb_workers)
+        self._ranks = {}
+
+    def get_runtimes(self, vids):
+        """ Return the estimated run time of each vertex """
+        timing = get_node_timing()
+        if timing is None:
+            return dict((vid, 1.) for vid in vids)
+
+        df = self._dataflow
+        runtimes = dict((vid, timing.runtime(df.actor(vid))) for vid in vids)
+        known = [t for t in runtimes.itervalues() if t is not None]
+        default = sum(known) / len(known) if known else 1.
+        for vid, t in runtimes.iteritems():
+            if t is None:
+                runtimes[vid] = default
+        return runtimes
+
+    def compute_ranks(self, parents):
+        """ Return the rank of each vertex: its run time plus the
+        highest rank of its children.
+
+        :param parents: the dict returned by scan_graph
+        """
+        runtimes = self.get_runtimes(parents)
+        longest = dict((vid, 0.) for vid in parents)
+        ranks = {}
+
+        order = self._dataflow.topological_order(parents)
+        if order is not None:
+            # children are after their parents in the topological order
+            for vid in reversed(order):
+                rank = ranks[vid] = runtimes[vid] + longest[vid]
+                for pvid in parents[vid]:
+                    longest[pvid] = max(longest[pvid], rank)
+            return ranks
+
+        nb_children = dict((vid, 0) for vid in parents)
+        for pvids in parents.itervalues():
+            for pvid in pvids:
+                nb_children[pvid] += 1
+
+        # from the leaves to the roots
+        stack = [vid for vid, nb in nb_children.iteritems() if nb == 0]
+        while stack:
+            vid = stack.pop()
+            rank = ranks[vid] = runtimes[vid] + longest[vid]
+            for pvid in parents[vid]:
+                longest[pvid] = max(longest[pvid], rank)
+                nb_children[pvid] -= 1
+                if nb_children[pvid] == 0:
+                    stack.append(pvid)
+
+        # vertices of cycles
+        for vid in parents:
+            if vid not in ranks:
+                ranks[vid] = runtimes[vid] + longest[vid]
+        return ranks
+
+    def ready_key(self, vid):
+        """ Sort key of the ready vertices (higher rank first) """
+        return (-self._ranks.get(vid, 0.), vid)
+
+    def init_ready(self, parents):
+        self._ranks = self.compute_ranks(parents)
+        return ParallelEvaluation.init_ready(self, parents)
+
+    def eval(self, vtx_id=None, *args, **kwds):
+        """ Evaluate the dataflow and store the run times """
+        try:
+            ParallelEvaluation.eval(self, vtx_id, *args, **kwds)
+        finally:
+            self._ranks = {}
+            timing = get_node_timing()
+            if timing is not None:
+                timing.flush()
+
+
+# Pool of processes shared by the process evaluations.
+# Workers are forked from the current process, so they inherit
+# the packages already loaded by the PackageManager.
+_process_pool = None
+_process_pool_size = None
+
+# Nodes instantiated in a worker process, by factory id
+_worker_nodes = {}
+
+
+def get_process_pool(nb_processes=None):
+    """ Return the pool of worker processes (created on first call, and
+    created again if another number of processes is requested) """
+    global _process_pool, _process_pool_size
+    size = nb_processes or cpu_count()
+    if _process_pool is not None and size != _process_pool_size:
+        close_process_pool()
+    if _process_pool is None:
+        import multiprocessing
+        _process_pool = multiprocessing.Pool(size, initializer=init_worker)
+        _process_pool_size = size
+    return _process_pool
+
+
+def close_process_pool():
+    """ Terminate the worker processes.
+
+    The next process evaluation will fork new workers, aware of the
+    packages loaded in the meantime.
+    """
+    global _process_pool, _process_pool_size
+    if _process_pool is not None:
+        _process_pool.terminate()
+        _process_pool.join()
+        _process_pool = None
+        _process_pool_size = None
+
+
+def init_worker():
+    """ Worker initialisation: ensure that the package manager is loaded """
+    from openalea.core.pkgmanager import PackageManager
+    _worker_nodes.clear()
+    pm = PackageManager()
+    if len(pm) == 0:
+        pm.init(verbose=False)
+
+
+def remote_call(factory_id, inputs):
+    """ Worker function: call the node created by factory_id.
+
+    :param factory_id: tuple (package id, factory id)
+    :param inputs: pickled list of input values
+    :returns: the pickled result of the node call
+    """
+    node = _worker_nodes.get(factory_id)
+    if node is None:
+        from openalea.core.pkgmanager import PackageManager
+        node = PackageManager().get_node(*factory_id)
+        _worker_nodes[factory_id] = node
+
+    ret = node(cPickle.loads(inputs))
+    return cPickle.dumps(ret, cPickle.HIGHEST_PROTOCOL)
+
+
+class ProcessEvaluation(ParallelEvaluation):
+    """ Evaluate side effect free nodes in a pool of processes.
+
+    Pure python nodes hold the GIL, so they do not run concurrently
+    in threads. Nodes flagged as side_effect_free are sent to worker
+    processes with their pickled inputs; their outputs are copied back
+    into the node. The other nodes are evaluated in the current process.
+    """
+    __evaluators__.append("ProcessEvaluation")
+
+    # pool used by the current evaluation
+    _pool = None
+
+    def eval_vertices(self, leaves):
+        """ Get the pool before starting the worker threads: the
+        processes are not forked while other threads are running """
+        self._pool = get_process_pool(self.get_nb_workers())
+        ParallelEvaluation.eval_vertices(self, leaves)
+
+    def is_remote(self, node):
+        """ Return True if node can be evaluated in a worker process """
+        return is_pure_node(node)
+
+    def node_call(self, vid, node):
+        """ Run the node in a worker process if possible """
+        if not self.is_remote(node):
+            return None
+
+        try:
+            inputs = cPickle.dumps(list(node.inputs),
+                                   cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # inputs cannot be sent to another process
+            return None
+
+        factory_id = (node.factory.package.get_id(), node.factory.get_id())
+        pool = self._pool
+        if pool is None:
+            pool = get_process_pool(self.get_nb_workers())
+
+        def call(inputs_values):
+            return cPickle.loads(pool.apply(remote_call, (factory_id, inputs)))
+
+        return call
+
+
+def is_coroutine_node(node):
+    """ Return True if calling node returns a coroutine """
+    if asyncio is None:
+        return False
+    func = getattr(node, 'func', None)
+    if func is None:
+        func = type(node).__call__
+    return asyncio.iscoroutinefunction(func)
+
+
+class AsyncEvaluation(ParallelEvaluation):
+    """ Evaluate the dataflow on an asyncio event loop.
+
+    Nodes whose function is a coroutine are awaited on the loop, so
+    independent I/O bound nodes wait concurrently. The other nodes are
+    evaluated in the default executor of the loop.
+
+    Requires asyncio (or trollius).
+    """
+    if asyncio is not None:
+        __evaluators__.append("AsyncEvaluation")
+
+    def __init__(self, dataflow, loop=None):
+        """
+        :param loop: the event loop to use (default: the event loop of
+            the current thread)
+        """
+        ParallelEvaluation.__init__(self, dataflow)
+        self.loop = loop
+        # results of the coroutines, by vertex
+        self._calls = {}
+
+    def get_loop(self):
+        """ Return the event loop used to evaluate the dataflow """
+        if asyncio is None:
+            raise ImportError("AsyncEvaluation requires asyncio or trollius")
+        if self.loop is not None:
+            return self.loop
+        try:
+            return asyncio.get_event_loop()
+        except (RuntimeError, AssertionError):
+            # no event loop in this thread
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            return loop
+
+    def node_call(self, vid, node):
+        """ Return the result of the coroutine if vid has been awaited """
+        call = self._calls.pop(vid, None)
+        if call is not None:
+            return call
+        return ParallelEvaluation.node_call(self, vid, node)
+
+    def eval_vertex_async(self, vid, loop):
+        """ Start the evaluation of vertex vid.
+
+        :returns: a future done when vid has been evaluated
+        """
+        node = self._dataflow.actor(vid)
+        if not is_coroutine_node(node) or node.skip_eval():
+            return loop.run_in_executor(None, self.eval_vertex_code_in,
+                                        headless_context(), vid)
+
+        future = asyncio.Future(loop=loop)
+
+        def coroutine_done(coroutine):
+            if coroutine.exception() is not None:
+                exc = coroutine.exception()
+
+                def call(inputs):
+                    raise exc
+            else:
+                result = coroutine.result()
+
+                def call(inputs):
+                    return result
+
+            # store the outputs (or the error) in the loop thread
+            self._calls[vid] = call
+            try:
+                self.eval_vertex_code(vid)
+                future.set_result(None)
+            except Exception, e:
+                future.set_exception(e)
+            finally:
+                self._calls.pop(vid, None)
+
+        try:
+            coroutine = asyncio.ensure_future(node(list(node.inputs)),
+                                              loop=loop)
+        except Exception, e:
+            coroutine = asyncio.Future(loop=loop)
+            coroutine.set_exception(e)
+        coroutine.add_done_callback(coroutine_done)
+        return future
+
+    def eval_vertices(self, leaves):
+        """ Evaluate the leaves and all the vertices they depend on """
+        loop = self.get_loop()
+
+        parents = self.scan_graph(leaves)
+        children, waiting, ready = self.init_ready(parents)
+
+        status = dict(running=0, error=None)
+        finished = asyncio.Future(loop=loop)
+
+        def submit():
+            # Submit the ready vertices unless an error occured
+            while ready and status['error'] is None:
+                key, vid = heappop(ready)
+                self.set_inputs(vid)
+                future = self.eval_vertex_async(vid, loop)
+                future.add_done_callback(partial(vertex_done, vid))
+                status['running'] += 1
+
+            if not status['running'] and not finished.done():
+                finished.set_result(None)
+
+        def vertex_done(vid, future):
+            status['running'] -= 1
+            self._evaluated.add(vid)
+
+            if future.exception() is not None:
+                # Wait for the running vertices and report the first error
+                if status['error'] is None:
+                    status['error'] = future.exception()
+            else:
+                for cvid in children[vid]:
+                    waiting[cvid] -= 1
+                    if waiting[cvid] == 0:
+                        heappush(ready, (self.ready_key(cvid), cvid))
+            submit()
+
+        loop.call_soon(submit)
+        loop.run_until_complete(finished)
+
+        if status['error'] is not None:
+            raise status['error']
+
+        # Vertices belonging to a cycle are never ready.
+        for vid in leaves:
+            if vid not in self._evaluated:
+                PriorityEvaluation.eval_vertex(self, vid)
+
+
+class ScheduledEvaluation(PriorityEvaluation):
+    """ Evaluate the dataflow following a precompiled schedule.
+
+    The evaluation order, the parents of each port and the local port ids
+    are computed once and reused while the dataflow topology is not
+    modified. The evaluation is not recursive, so deep dataflows do not
+    reach the python recursion limit.
+    """
+    __evaluators__.append("ScheduledEvaluation")
+
+    def eval_schedule(self, schedule):
+        """ Evaluate the vertices of a schedule """
+        active = schedule.active_vertices(self.is_stopped)
+        evaluated = self._evaluated
+
+        for vid, actor, inputs in schedule.steps:
+            if vid not in active:
+                continue
+            evaluated.add(vid)
+            self.set_schedule_inputs(actor, inputs)
+            self.eval_vertex_code(vid)
+
+    def eval_vertex(self, vid, *args):
+        """ Evaluate the vertex vid and its parents """
+        self.eval_schedule(self.get_schedule([vid]))
+
+    def eval(self, vtx_id=None, *args, **kwds):
+        """ Evaluate the dataflow from vtx_id or from the leaves """
+        t0 = clock()
+
+        df = self._dataflow
+        # Unvalidate all the nodes
+        self._evaluated.clear()
+        self.init_evaluation()
+
+        if (vtx_id is not None):
+            leaves = [vtx_id]
+        else:
+            leaves = [(vid, df.actor(vid))
+                  for vid in df.vertices() if df.nb_out_edges(vid)==0]
+            leaves.sort(cmp_priority)
+            leaves = [vid for vid, actor in leaves]
+
+        self.eval_schedule(self.get_schedule(leaves))
+
+        t1 = clock()
+        if quantify:
+            print "Evaluation time: %s"%(t1-t0)
+
+
 class GeneratorEvaluation(AbstractEvaluation):
-    """ Evaluation algorithm with generator / priority and selection"""
+    """ Evaluation algorithm with generator / priority and selection
+
+    In streaming mode (disabled by default, see the streaming argument),
+    the first iteration evaluates all the vertices.
+    The next iterations only evaluate the generators (nodes which asked
+    for a reevaluation or are evaluated even if their inputs have not
+    changed, like IterNode) and the vertices downstream of them.
+    Otherwise, each iteration evaluates the whole dataflow again.
+    """
     __evaluators__.append("GeneratorEvaluation")
 
-    def __init__(self, dataflow):
+    # evaluate only downstream of the generators at each iteration
+    streaming = False
+
+    def __init__(self, dataflow, streaming=None):
 
         AbstractEvaluation.__init__(self, dataflow)
         # a property to specify if the node has already been evaluated
         self._evaluated = set()
         self.reeval = False # Flag to force reevaluation (for generator)
+        # vertices which asked for a reevaluation
+        self._generators = []
+        if streaming is not None:
+            self.streaming = streaming
 
     def is_stopped(self, vid, actor):
         """ Return True if evaluation must be stop at this vertex """
@@ -422,12 +1536,12 @@ class GeneratorEvaluation(AbstractEvaluation):
 
             cpt = 0
             # For each connected node
-            for npid, nvid, nactor in self.get_parent_nodes(pid):
+            for npid, nvid, nactor, out_index in df.parent_ports(pid):
                 # Do no reevaluate the same node
                 if not self.is_stopped(nvid, nactor):
                     self.eval_vertex(nvid)
 
-                inputs.append(nactor.get_output(df.local_id(npid)))
+                inputs.append(nactor.get_output(out_index))
                 cpt += 1
 
             # set input as a list or a simple value
@@ -443,6 +1557,34 @@ class GeneratorEvaluation(AbstractEvaluation):
         if (ret):
             self.reeval = ret
 
+    def eval_stream_step(self, step):
+        """ Evaluate a step of the streaming schedule """
+        vid, actor, inputs = step
+        self._evaluated.add(vid)
+        self.set_schedule_inputs(actor, inputs)
+
+        ret = self.eval_vertex_code(vid)
+
+        # Reevaluation flag
+        if (ret):
+            self.reeval = ret
+            self._generators.append(vid)
+        return True
+
+    def eval_stream(self, vid):
+        """ Evaluate the leaf vid until no node asks for a reevaluation """
+        self.clear()
+        cycle = CycleSchedule(self.get_schedule([vid]), self.is_stopped,
+                              self.is_volatile)
+        self._generators = []
+        cycle.run(self.eval_stream_step)
+
+        while(self.reeval):
+            generators = self._generators
+            self._generators = []
+            self.clear()
+            cycle.run(self.eval_stream_step, generators)
+
     def eval(self, vtx_id=None, step=False):
         t0 = clock()
 
@@ -461,6 +1603,10 @@ class GeneratorEvaluation(AbstractEvaluation):
         # Execute
         for vid, actor in leafs:
             if not self.is_stopped(vid, actor):
+                if self.streaming:
+                    self.eval_stream(vid)
+                    continue
+
                 self.reeval = True
                 while(self.reeval):
                     self.clear()
@@ -531,13 +1677,13 @@ class LambdaEvaluation(PriorityEvaluation):
             cpt = 0 # parent counter
 
             # For each connected node
-            for npid, nvid, nactor in self.get_parent_nodes(pid):
+            for npid, nvid, nactor, out_index in df.parent_ports(pid):
 
                 # Do no reevaluate the same node
                 if not self.is_stopped(nvid, nactor):
                     self.eval_vertex(nvid, transmit_cxt, transmit_lambda)
 
-                outval = nactor.get_output(df.local_id(npid))
+                outval = nactor.get_output(out_index)
                 # Lambda
 
                 # We must consider 3 cases
@@ -598,8 +1744,8 @@ class LambdaEvaluation(PriorityEvaluation):
         """
         t0 = clock()
         if PROVENANCE and (not is_subdataflow):
-            self.provenance.workflow_exec()
-            self.provenance.start_time()
+            self.get_provenance().workflow_exec()
+            self.get_provenance().start_time()
 
         self.lambda_value.clear()
 
@@ -611,8 +1757,8 @@ class LambdaEvaluation(PriorityEvaluation):
         PriorityEvaluation.eval(self, vtx_id, context, self.lambda_value, is_subdataflow=is_subdataflow)
         self.lambda_value.clear() # do not keep context in memory
         
-        if PROVENANCE:
-            self.provenance.end_time()
+        if PROVENANCE and (not is_subdataflow):
+            self.get_provenance().end_time()
 
         t1 = clock()
         if quantify:
@@ -621,6 +1767,142 @@ class LambdaEvaluation(PriorityEvaluation):
         if not is_subdataflow:
             self._resolution_node.clear()
 
+    def release_inputs(self, vid):
+        """ Resolution nodes are evaluated again by each call of the
+        lambda, so the outputs they read are kept """
+        if vid not in self._resolution_node:
+            PriorityEvaluation.release_inputs(self, vid)
+
+    def compile_subdataflow(self, vid, port_index):
+        """ Return a function evaluating the output port_index of vid
+        from the values of its lambda variables """
+        return CompiledLambda(self, vid, port_index)
+
+
+class CompiledLambda(object):
+    """ A SubDataflow compiled into a function of its lambda variables.
+
+    The subgraph is scanned once like a LambdaEvaluation resolution:
+    lambda variables get their position in the order they are
+    encountered. Each call only sets the inputs and evaluates the nodes
+    depending on lambda variables, in a precomputed order. The outputs of
+    the other nodes (constants, functions) are read without traversing
+    them again.
+    """
+
+    def __init__(self, algo, vid, port_index):
+        """
+        :param algo: the LambdaEvaluation which created the SubDataflow
+        :param vid: vertex id of the lambda node
+        :param port_index: output port index in vid
+        """
+        self.algo = algo
+        self.dataflow = algo._dataflow
+        self.vid = vid
+        self.port_index = port_index
+        self.version = self.dataflow.topology_version()
+
+        # list of (vid, actor, inputs), inputs are (input_index, sources),
+        # a source is (variable position, None, None) or
+        # (None, parent actor, output index)
+        self.steps = []
+        # lambda variables (SubDataflow) by position
+        self.variables = []
+        self.compile()
+
+    def is_valid(self):
+        """ Return True if the dataflow has not been modified """
+        return self.version == self.dataflow.topology_version()
+
+    def compile(self):
+        """ Scan the subgraph and compute the steps """
+        # vid -> True if the node depends on lambda variables
+        self._dependent = {}
+        self._variables = {}
+
+        # Stop on the same vertices than a subdataflow evaluation
+        evaluated = self.algo._evaluated
+        saved = set(evaluated)
+        evaluated -= self.algo._resolution_node
+        try:
+            self.scan(self.vid)
+        finally:
+            evaluated.clear()
+            evaluated.update(saved)
+            del self._dependent, self._variables
+
+    def scan(self, vid):
+        """ Scan vid after its parents, in the LambdaEvaluation order """
+        algo = self.algo
+        df = self.dataflow
+        actor = df.actor(vid)
+        dependent = self._dependent
+        variables = self._variables
+
+        dependent[vid] = False
+        is_dependent = False
+        inputs = []
+        for pid in df.in_ports(vid):
+            input_index = df.local_id(pid)
+            interface = actor.input_desc[input_index].get('interface', None)
+
+            sources = []
+            for npid, nvid, nactor, out_index in df.parent_ports(pid):
+                # Parents of a consumer (IFunction) port are not evaluated
+                # in resolution mode: they are constants.
+                if (nvid not in dependent and interface is not IFunction
+                    and not algo.is_stopped(nvid, nactor)):
+                    self.scan(nvid)
+
+                if dependent.get(nvid):
+                    sources.append((None, nactor, out_index))
+                    is_dependent = True
+                    continue
+
+                outval = nactor.get_output(out_index)
+                if (isinstance(outval, SubDataflow)
+                    and interface is not IFunction):
+                    # lambda variable
+                    if outval not in variables:
+                        variables[outval] = len(self.variables)
+                        self.variables.append(outval)
+                    sources.append((variables[outval], None, None))
+                    is_dependent = True
+                else:
+                    sources.append((None, nactor, out_index))
+
+            inputs.append((input_index, sources))
+
+        dependent[vid] = is_dependent
+        if is_dependent:
+            self.steps.append((vid, actor, inputs))
+
+    def __call__(self, *args):
+        """ Evaluate the lambda node with args as lambda variables """
+        df = self.dataflow
+        algo = self.algo
+
+        if len(args) < len(self.variables):
+            # let the evaluation algorithm handle the error
+            algo.eval(self.vid, list(args), is_subdataflow=True)
+            return df.actor(self.vid).get_output(self.port_index)
+
+        for vid, actor, inputs in self.steps:
+            for input_index, sources in inputs:
+                values = [args[pos] if nactor is None
+                          else nactor.get_output(out_index)
+                          for pos, nactor, out_index in sources]
+
+                # set input as a list or a simple value
+                if len(values) == 1:
+                    actor.set_input(input_index, values[0])
+                elif len(values) > 1:
+                    actor.set_input(input_index, values)
+
+            algo.eval_vertex_code(vid)
+
+        return df.actor(self.vid).get_output(self.port_index)
+
 
 DefaultEvaluation = LambdaEvaluation
 #DefaultEvaluation = GeneratorEvaluation
@@ -877,7 +2159,7 @@ class ToScriptEvaluation(AbstractEvaluation):
         # For each inputs
         for pid in df.in_ports(vid):
             # For each connected node
-            for npid, nvid, nactor in self.get_parent_nodes(pid):
+            for npid, nvid, nactor, out_index in df.parent_ports(pid):
                 if not self.is_stopped(nvid, nactor):
                     script += self.eval_vertex(nvid)
 
@@ -907,27 +2189,59 @@ class ToScriptEvaluation(AbstractEvaluation):
 # The objective is to take
 
 class DiscreteTimeEvaluation(AbstractEvaluation):
-    """ Evaluation algorithm with generator / priority and selection"""
+    """ Evaluation algorithm with generator / priority and selection
+
+    The first cycle evaluates all the vertices. Nodes returning a delay
+    are scheduled in a heap by the cycle they are due. The next cycles
+    only evaluate the due nodes, the nodes which are evaluated at each
+    cycle (not lazy, with a delay or redefining eval) and the vertices
+    downstream of the evaluated ones.
+
+    The simulation can be saved in a checkpoint file every
+    checkpoint_interval cycles (see set_checkpoint), and resumed from
+    the last checkpoint with eval(resume=True).
+    """
     __evaluators__.append("DiscreteTimeEvaluation")
 
-    def __init__(self, dataflow):
+    # the settings and the checkpoint are kept between the evaluations
+    reusable = True
 
+    # maximum number of cycles of a simulation (None means no limit)
+    max_cycles = 1000
+
+    # checkpoint file (None means no checkpoint) and number of cycles
+    # between two checkpoints
+    checkpoint_file = None
+    checkpoint_interval = 100
+
+    def __init__(self, dataflow, max_cycles=-1):
+        """
+        :param max_cycles: maximum number of cycles of a simulation
+            (default 1000, None means no limit)
+        """
         AbstractEvaluation.__init__(self, dataflow)
         # a property to specify if the node has already been evaluated
         self._evaluated = set()
         self.reeval = False # Flag to force reevaluation (for generator)
 
+        if max_cycles != -1:
+            self.max_cycles = max_cycles
+
         # CPL
         # At each evaluation of the dataflow, increase the current cycle of
         # one unit.
 
         self._current_cycle = 0
-        # timed nodes are a dict with vid, time >0
-        # when time is 0, remove the node from the dict
+        # timed nodes are a dict with vid, cycle when the node is due
+        # the heap contains (cycle, vid) and may contain outdated items
         self._timed_nodes = dict()
+        self._timed_heap = []
         self._stop = False
         self._nodes_to_reset = []
 
+        # vertices evaluated in the cycles of the current leaf
+        self._cycle = None
+
     def is_stopped(self, vid, actor):
         """ Return True if evaluation must be stop at this vertex """
         stopped = False
@@ -947,73 +2261,198 @@ class DiscreteTimeEvaluation(AbstractEvaluation):
         self._stop = False
         self._nodes_to_reset = []
 
+    def clear_timed_nodes(self):
+        """ Remove all the scheduled nodes """
+        self._timed_nodes.clear()
+        del self._timed_heap[:]
+
     def next_step(self):
         """ Update the scheduler of one step. """
         self._current_cycle += 1
-        for vid in self._timed_nodes:
-            self._timed_nodes[vid] -= 1
+
+    def schedule_node(self, vid, delay):
+        """ Evaluate vid again in delay cycles """
+        cycle = self._current_cycle + int(delay)
+        self._timed_nodes[vid] = cycle
+        heappush(self._timed_heap, (cycle, vid))
+
+    def due_nodes(self, vids):
+        """ Return the scheduled vertices of vids due at the current cycle
+
+        :param vids: a dict or a set of vertex ids
+        """
+        heap = self._timed_heap
+        timed_nodes = self._timed_nodes
+        due = []
+        others = []
+        while heap and heap[0][0] <= self._current_cycle:
+            cycle, vid = heappop(heap)
+            if timed_nodes.get(vid) == cycle:
+                if vid in vids:
+                    due.append(vid)
+                else:
+                    # evaluated from another leaf
+                    others.append((cycle, vid))
+        for item in others:
+            heappush(heap, item)
+        return due
 
     def eval_vertex(self, vid):
-        """ Evaluate the vertex vid """
+        """ Evaluate the vertex vid and all its parents for one cycle """
+        self.eval_cycle(vid, full=True)
 
-        #print "Step ", self._current_cycle
+    def set_checkpoint(self, filename, interval=100):
+        """ Save the simulation in filename every interval cycles
+
+        :param filename: checkpoint file (None to disable the checkpoints)
+        """
+        self.checkpoint_file = filename
+        self.checkpoint_interval = interval
 
+    def save_checkpoint(self, leaf, filename=None):
+        """ Save the current cycle, the scheduled nodes and the state of
+        the nodes (see Node.checkpoint_state) in filename.
+
+        :param leaf: the leaf being simulated
+        """
+        if filename is None:
+            filename = self.checkpoint_file
         df = self._dataflow
-        actor = df.actor(vid)
 
-        self._evaluated.add(vid)
+        nodes = {}
+        for vid in df.vertices():
+            get_state = getattr(df.actor(vid), 'checkpoint_state', None)
+            if get_state is None:
+                continue
+            try:
+                nodes[vid] = cPickle.dumps(get_state(),
+                                           cPickle.HIGHEST_PROTOCOL)
+            except Exception, e:
+                logger.warning("Checkpoint: state of vertex %s not saved: %s"
+                               % (vid, e))
+
+        checkpoint = dict(cycle=self._current_cycle,
+                          timed_nodes=dict(self._timed_nodes),
+                          leaf=leaf, nodes=nodes)
+
+        # write a new file, so the last checkpoint is kept on failure
+        tmp = filename + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            cPickle.dump(checkpoint, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
 
-        # For each inputs
-        # Compute the inputs of the node
-        for pid in df.in_ports(vid):
-            inputs = []
+    def load_checkpoint(self, filename=None):
+        """ Restore the simulation saved in filename.
 
-            cpt = 0
-            # For each connected node
-            for npid, nvid, nactor in self.get_parent_nodes(pid):
-                # Do no reevaluate the same node
-                if not self.is_stopped(nvid, nactor):
-                    self.eval_vertex(nvid)
+        :returns: the leaf being simulated, None if there is no checkpoint
+        """
+        if filename is None:
+            filename = self.checkpoint_file
+        if filename is None or not os.path.exists(filename):
+            return None
 
-                inputs.append(nactor.get_output(df.local_id(npid)))
-                cpt += 1
+        f = open(filename, 'rb')
+        try:
+            checkpoint = cPickle.load(f)
+        finally:
+            f.close()
 
-            # set input as a list or a simple value
-            if (cpt == 1):
-                inputs = inputs[0]
-            if (cpt > 0):
-                actor.set_input(df.local_id(pid), inputs)
+        df = self._dataflow
+        for vid, state in checkpoint['nodes'].iteritems():
+            if df.has_vertex(vid):
+                df.actor(vid).restore_checkpoint_state(cPickle.loads(state))
+
+        self.clear_timed_nodes()
+        self._current_cycle = checkpoint['cycle']
+        for vid, cycle in checkpoint['timed_nodes'].iteritems():
+            self._timed_nodes[vid] = cycle
+            heappush(self._timed_heap, (cycle, vid))
+
+        return checkpoint['leaf']
+
+    def remove_checkpoint(self):
+        """ Remove the checkpoint file """
+        filename = self.checkpoint_file
+        if filename is not None and os.path.exists(filename):
+            os.remove(filename)
+
+    def next_cycle(self, leaf):
+        """ Go to the next cycle and save a checkpoint if needed """
+        self.next_step()
+        interval = self.checkpoint_interval
+        if (self.checkpoint_file is not None and interval and
+            self._current_cycle % interval == 0):
+            self.save_checkpoint(leaf)
+
+    def eval_cycle(self, vid, full):
+        """ Evaluate one cycle of the simulation from the leaf vid.
+
+        :param full: if True evaluate all the vertices, otherwise only
+            the due and volatile ones, and their downstream vertices.
+        """
+        schedule = self.get_schedule([vid])
+
+        cycle = self._cycle
+        if full or cycle is None or cycle.schedule is not schedule:
+            cycle = self._cycle = CycleSchedule(schedule, self.is_stopped,
+                                                self.is_volatile)
+            self.due_nodes(cycle.index)
+            vids = None
+        else:
+            vids = self.due_nodes(cycle.index)
 
-        # Eval the node
-        delay = 0
+        cycle.run(self.eval_cycle_step, vids)
+
+        self.reeval = any(vid in cycle.index for vid in self._timed_nodes)
+
+    def eval_cycle_step(self, step):
+        """ Evaluate a step of the cycle schedule """
+        vid, actor, inputs = step
+        self._evaluated.add(vid)
+        self.set_schedule_inputs(actor, inputs)
+        return self.eval_timed_vertex(vid)
+
+    def eval_timed_vertex(self, vid):
+        """ Evaluate vid unless it is scheduled at a later cycle.
+
+        Return True if the node has been evaluated.
+        """
         # When a node return no delay, we stopped the simulation
         stop_when_finished = False
 
         if vid in self._timed_nodes:
-            delay = self._timed_nodes[vid]
-            if delay == 0:
-                del self._timed_nodes[vid]
-                stop_when_finished = True
-
-        if delay == 0:
-            delay = self.eval_vertex_code(vid)
+            if self._timed_nodes[vid] > self._current_cycle:
+                return False
+            del self._timed_nodes[vid]
+            stop_when_finished = True
 
+        delay = self.eval_vertex_code(vid)
 
-        # Reevaluation flag
-        # TODO: Add the node to the scheduler rather to execute
         if (delay):
-            self._timed_nodes[vid] = int(delay)
-            self.reeval = delay
+            self.schedule_node(vid, delay)
         elif stop_when_finished:
             self._stop = True
             self._nodes_to_reset.append(vid)
-        elif self._current_cycle > 1000:
+        elif (self.max_cycles is not None and
+              self._current_cycle > self.max_cycles):
             self._stop = True
+        return True
 
-    def eval(self, vtx_id=None, step=False):
+    def eval(self, vtx_id=None, step=False, resume=False):
+        """ Run the simulation
+
+        :param step: evaluate only one cycle
+        :param resume: restart from the checkpoint file if it exists
+        """
         t0 = clock()
 
         self.clear()
+        self._cycle = None
 
         df = self._dataflow
 
@@ -1027,31 +2466,56 @@ class DiscreteTimeEvaluation(AbstractEvaluation):
 
         leafs.sort(cmp_priority)
 
+        resumed = None
+        if resume:
+            resumed = self.load_checkpoint()
+            if resumed is not None and resumed not in dict(leafs):
+                raise ValueError("Checkpoint of an unknown leaf: %s"
+                                 % (resumed,))
+
         # Execute
         for vid, actor in leafs:
+            full = True
+            if resumed is not None:
+                # the leaves before have already been simulated
+                if vid != resumed:
+                    continue
+                # continue the cycles of the leaf
+                resumed = None
+                full = False
+                self._cycle = CycleSchedule(self.get_schedule([vid]),
+                                            self.is_stopped, self.is_volatile)
+
             if not self.is_stopped(vid, actor):
                 self.reeval = True
                 if not step:
                     while(self.reeval and not self._stop):
                         self.clear()
-                        self.eval_vertex(vid)
-                        self.next_step()
+                        self.eval_cycle(vid, full)
+                        self.next_cycle(vid)
+                        full = False
                 elif (self.reeval and not self._stop):
                     self.clear()
-                    self.eval_vertex(vid)
-                    self.next_step()
+                    self.eval_cycle(vid, full)
+                    self.next_cycle(vid)
 
         if self._stop:
             self._nodes_to_reset.extend(self._timed_nodes)
             for vid in self._nodes_to_reset:
                 df.actor(vid).reset()
+            self.clear_timed_nodes()
 
         #print 'Run %d times the dataflow'%(self._current_cycle,)
 
         # Reset the state
         if not step:
             self.clear()
+            self.clear_timed_nodes()
             self._current_cycle = 0
+            self.remove_checkpoint()
+        elif self._stop or not self.reeval:
+            # the last step of the simulation
+            self.remove_checkpoint()
 
         t1 = clock()
         if quantify:
@@ -1150,14 +2614,14 @@ class SciFlowareEvaluation(AbstractEvaluation):
             else:
                 cpt = 0
                 # For each connected node
-                for npid, nvid, nactor in self.get_parent_nodes(pid):
+                for npid, nvid, nactor, out_index in df.parent_ports(pid):
                     # Do no reevaluate the same node
                     
 
                     if not self.is_stopped(nvid, nactor):
                         self.eval_vertex(nvid)
 
-                    inputs.append(nactor.get_output(df.local_id(npid)))
+                    inputs.append(nactor.get_output(out_index))
                     cpt += 1
 
                 # set input as a list or a simple value
@@ -1193,3 +2657,18 @@ class SciFlowareEvaluation(AbstractEvaluation):
             print "Evaluation time: %s"%(t1-t0)
 
         return False
+
+
+class ClusterEvaluation(SciFlowareEvaluation):
+    """ Distributed evaluation on a local cluster of worker processes.
+
+    Operators are the map and reduce nodes of the local_cluster module.
+    The dataflow connected to their dataflow port is sent to the workers
+    by factory id and applied on partitions of the data.
+    """
+    __evaluators__.append("ClusterEvaluation")
+
+    @staticmethod
+    def is_operator(actor):
+        from openalea.core.algo.local_cluster import ClusterOperator
+        return isinstance(actor, ClusterOperator)
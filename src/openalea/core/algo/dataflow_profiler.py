@@ -0,0 +1,224 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide a profiler of the node evaluations.
+
+For each vertex, the profiler records the number of calls and exceptions,
+the wall and processor times and the size of the outputs. Nodes evaluated
+inside a composite node are attributed to the composite node.
+
+The profiler is disabled by default::
+
+    from openalea.core.algo.dataflow_profiler import enable_profiler
+    profiler = enable_profiler()
+    ...
+    profiler.print_stats()
+    profiler.write_chrome_trace('trace.json')   # chrome://tracing
+    profiler.dump_stats('nodes.prof')           # pstats.Stats('nodes.prof')
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import os
+import sys
+import json
+import marshal
+import pstats
+from time import clock, time
+from threading import Lock, local, current_thread
+
+from openalea.core.algo.dataflow_utils import dataflow_name
+
+
+def output_size(node):
+    """ Return the size in bytes of the outputs of a node """
+    size = 0
+    for value in getattr(node, 'outputs', ()):
+        try:
+            size += sys.getsizeof(value)
+        except TypeError:
+            pass
+    return size
+
+
+class NodeProfile(object):
+    """ Statistics of the evaluations of a vertex """
+
+    def __init__(self, label):
+        """
+        :param label: tuple (location, vid, caption)
+        """
+        self.label = label
+        self.calls = 0
+        self.errors = 0
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        # wall time without the nested nodes
+        self.own_time = 0.
+        self.output_size = 0
+        # label of parent -> [calls, own time, wall time]
+        self.callers = {}
+
+
+class Profiler(object):
+    """ Record the evaluation of nodes """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._local = local()
+        self.clear()
+
+    def clear(self):
+        """ Remove all the records """
+        self.nodes = {}
+        self.events = []
+        self._t0 = time()
+
+    def get_stack(self):
+        """ Return the frames of the nodes being evaluated in this thread """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def run(self, dataflow, vid, node, run_node):
+        """ Call run_node(vid, node) and record its evaluation """
+        stack = self.get_stack()
+        if stack:
+            parent = stack[-1]
+            location = '%s/%s' % (parent['label'][0], parent['label'][2])
+        else:
+            parent = None
+            location = dataflow_name(dataflow)
+        label = (location, vid, node.get_caption())
+
+        frame = dict(label=label, nested=0.)
+        stack.append(frame)
+        error = False
+        wall = time()
+        cpu = clock()
+        try:
+            return run_node(vid, node)
+        except:
+            error = True
+            raise
+        finally:
+            cpu = clock() - cpu
+            end = time()
+            stack.pop()
+            self.record(frame, parent, wall, end - wall, cpu, error, node)
+
+    def record(self, frame, parent, start, wall, cpu, error, node):
+        label = frame['label']
+        own = wall - frame['nested']
+        if parent is not None:
+            parent['nested'] += wall
+        size = output_size(node)
+
+        with self._lock:
+            profile = self.nodes.get(label)
+            if profile is None:
+                profile = self.nodes[label] = NodeProfile(label)
+            profile.calls += 1
+            profile.errors += int(error)
+            profile.wall_time += wall
+            profile.cpu_time += cpu
+            profile.own_time += own
+            profile.output_size = max(profile.output_size, size)
+            if parent is not None:
+                caller = profile.callers.setdefault(parent['label'],
+                                                    [0, 0., 0.])
+                caller[0] += 1
+                caller[1] += own
+                caller[2] += wall
+
+            self.events.append(dict(
+                name=label[2], cat='node', ph='X',
+                ts=(start - self._t0) * 1e6, dur=wall * 1e6,
+                pid=os.getpid(), tid=current_thread().ident,
+                args=dict(location=label[0], vid=label[1],
+                          cpu_time=cpu, output_size=size, error=error)))
+
+    def get_stats(self):
+        """ Return a list of NodeProfile sorted by decreasing own time """
+        return sorted(self.nodes.itervalues(), key=lambda p: -p.own_time)
+
+    def write_chrome_trace(self, filename):
+        """ Write the evaluations in the Chrome trace event format """
+        with self._lock:
+            events = list(self.events)
+        f = open(filename, 'w')
+        try:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+        finally:
+            f.close()
+
+    def create_stats(self):
+        """ Compute the stats in the format of the profile module,
+        vertices being functions labeled (location, vid, caption) """
+        stats = {}
+        with self._lock:
+            for label, profile in self.nodes.iteritems():
+                callers = dict((parent, (nc, nc, tt, ct))
+                               for parent, (nc, tt, ct)
+                               in profile.callers.iteritems())
+                stats[label] = (profile.calls, profile.calls,
+                                profile.own_time, profile.wall_time, callers)
+        self.stats = stats
+
+    def get_pstats(self):
+        """ Return a pstats.Stats of the evaluations """
+        return pstats.Stats(self)
+
+    def print_stats(self, sort='time'):
+        """ Print the stats of the evaluations """
+        self.get_pstats().sort_stats(sort).print_stats()
+
+    def dump_stats(self, filename):
+        """ Write the stats in a file readable by pstats.Stats """
+        self.create_stats()
+        f = open(filename, 'wb')
+        try:
+            marshal.dump(self.stats, f)
+        finally:
+            f.close()
+
+
+_profiler = None
+
+
+def get_profiler():
+    """ Return the profiler used by evaluations (None if disabled) """
+    return _profiler
+
+
+def enable_profiler(profiler=None):
+    """ Profile all the evaluations.
+
+    :param profiler: the Profiler to use (default: a new one)
+    :returns: the Profiler
+    """
+    global _profiler
+    if profiler is None:
+        profiler = Profiler()
+    _profiler = profiler
+    return _profiler
+
+
+def disable_profiler():
+    """ Stop profiling the evaluations """
+    global _profiler
+    _profiler = None
@@ -0,0 +1,179 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide a precompiled, non recursive, evaluation order of
+a dataflow"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+from heapq import heapify, heappop, heappush
+from itertools import chain
+
+
+class Schedule(object):
+    """ Flat evaluation order of a dataflow from a list of leaves.
+
+    Each step of the schedule is a tuple (vid, actor, inputs) where inputs
+    is a list of (input_index, parents). parents is the list of
+    (npid, nvid, nactor, out_index) connected to the input port.
+
+    Steps are in the order of the recursive evaluation (parents first).
+    A schedule stays valid while the topology of the dataflow
+    is not modified and the parent actors do not move.
+    """
+
+    def __init__(self, dataflow, leaves):
+        """
+        :param dataflow: the dataflow to schedule
+        :param leaves: list of vertex ids to evaluate (in this order)
+        """
+        self.dataflow = dataflow
+        self.leaves = tuple(leaves)
+        self.version = dataflow.parents_version()
+        self.steps = []
+        self.parent_vids = {}
+
+        self.compile()
+
+    def is_valid(self):
+        """ Return True if the dataflow has not been modified """
+        return self.version == self.dataflow.parents_version()
+
+    def compile(self):
+        """ Compute the steps of the schedule """
+        steps = {}
+        self.steps = []
+        self.parent_vids.clear()
+
+        visited = set()
+        for leaf in self.leaves:
+            if leaf in visited:
+                continue
+            visited.add(leaf)
+
+            # iterative depth first search (post order)
+            stack = [(leaf, iter(self.compile_vertex(leaf, steps)))]
+            while stack:
+                vid, parents = stack[-1]
+                for nvid in parents:
+                    if nvid not in visited:
+                        visited.add(nvid)
+                        nparents = self.compile_vertex(nvid, steps)
+                        stack.append((nvid, iter(nparents)))
+                        break
+                else:
+                    stack.pop()
+                    self.steps.append(steps[vid])
+
+    def compile_vertex(self, vid, steps):
+        """ Create the step of vid in steps and return its ordered
+        parent vids """
+        df = self.dataflow
+        actor = df.actor(vid)
+
+        inputs = []
+        ordered_vids = []
+        for pid in df.in_ports(vid):
+            parents = df.parent_ports(pid)
+            inputs.append((df.local_id(pid), parents))
+            ordered_vids.extend(p[1] for p in parents)
+
+        steps[vid] = (vid, actor, inputs)
+        self.parent_vids[vid] = frozenset(ordered_vids)
+        return ordered_vids
+
+    def active_vertices(self, is_stopped):
+        """ Return the set of vertices to evaluate.
+
+        Leaves are always evaluated. The parents of an evaluated vertex
+        are evaluated unless is_stopped(vid, actor) is True.
+        """
+        leaves = frozenset(self.leaves)
+        parent_vids = self.parent_vids
+
+        reached = set(leaves)
+        active = set()
+        for vid, actor, inputs in reversed(self.steps):
+            if vid not in reached:
+                continue
+            if vid in leaves or not is_stopped(vid, actor):
+                active.add(vid)
+                reached.update(parent_vids[vid])
+
+        return active
+
+
+class CycleSchedule(object):
+    """ Vertices of a schedule evaluated at each cycle of a simulation.
+
+    The first cycle evaluates all the vertices. The next cycles only
+    evaluate some vertices (e.g. generators, due or volatile ones) and
+    the vertices downstream of the evaluated ones, in the order of the
+    schedule.
+    """
+
+    def __init__(self, schedule, is_stopped, is_volatile):
+        """
+        :param schedule: a Schedule
+        :param is_stopped: function(vid, actor) returning True if the
+            evaluation must stop at this vertex (see Schedule.active_vertices)
+        :param is_volatile: function(actor) returning True if the vertex
+            must be evaluated at each cycle
+        """
+        active = schedule.active_vertices(is_stopped)
+
+        self.schedule = schedule
+        self.steps = [step for step in schedule.steps if step[0] in active]
+        self.index = dict((step[0], i) for i, step in enumerate(self.steps))
+
+        self.children = dict((vid, []) for vid in self.index)
+        for vid, actor, inputs in self.steps:
+            for pvid in schedule.parent_vids[vid]:
+                if pvid in self.children:
+                    self.children[pvid].append(vid)
+
+        self.volatile = [vid for vid, actor, inputs in self.steps
+                         if is_volatile(actor)]
+
+    def run(self, eval_step, vids=None):
+        """ Evaluate the steps in the schedule order.
+
+        :param eval_step: function(step) returning True if the vertex has
+            been evaluated. The vertices downstream are then evaluated.
+        :param vids: vertices to evaluate with the volatile ones
+            (None to evaluate all the vertices)
+        """
+        if vids is None:
+            for step in self.steps:
+                eval_step(step)
+            return
+
+        index = self.index
+        children = self.children
+        steps = self.steps
+
+        ready = list(set(index[vid] for vid in chain(self.volatile, vids)
+                         if vid in index))
+        heapify(ready)
+        pushed = set(ready)
+        while ready:
+            step = steps[heappop(ready)]
+            if eval_step(step):
+                for cvid in children[step[0]]:
+                    i = index[cvid]
+                    if i not in pushed:
+                        pushed.add(i)
+                        heappush(ready, i)
@@ -0,0 +1,30 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide helpers shared by the dataflow algorithms"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+
+def dataflow_name(dataflow):
+    """ Return the name of a dataflow (factory name or caption) """
+    factory = getattr(dataflow, 'factory', None)
+    if factory is not None:
+        return factory.name
+    get_caption = getattr(dataflow, 'get_caption', None)
+    if get_caption is not None:
+        return get_caption()
+    return type(dataflow).__name__
@@ -0,0 +1,395 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide a local cluster evaluating dataflows in worker
+processes.
+
+A coordinator sends tasks to N worker processes through pipes.
+A task refers to a dataflow (or any node) by its factory id and contains
+a partition of the data: the worker instantiates the node from its
+package manager and applies it on each item of the partition.
+
+The map and reduce operators are nodes evaluating the dataflow connected
+to their `dataflow` port on the cluster (see ClusterEvaluation)::
+
+    from openalea.core.algo.local_cluster import get_cluster
+    cluster = get_cluster(nb_workers=4)
+    cluster.map(('my package', 'my dataflow'), range(100))
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import traceback
+from threading import Thread, Condition
+from Queue import Queue
+
+from openalea.core.node import Node
+
+
+class ClusterException(Exception):
+    """ Exception raised by a node in a worker process """
+
+    def __init__(self, factory_id, exception, exc_info):
+        Exception.__init__(self, factory_id, exception)
+        self.factory_id = factory_id
+        self.exception = exception
+        self.exc_info = exc_info
+
+    def __str__(self):
+        return '%s:%s raised %r\n%s' % (self.factory_id + (self.exception,
+                                                           self.exc_info))
+
+
+def get_factory_id(name):
+    """ Return the factory id (package name, factory name) of a
+    'package:factory' name """
+    if isinstance(name, tuple):
+        return name
+    pkg_id, factory_id = name.rsplit(':', 1)
+    return pkg_id, factory_id
+
+
+def call_node(node, item):
+    """ Evaluate node with an item: a tuple for nodes with several inputs.
+
+    :returns: the value of the output, or a tuple if there are several
+    """
+    nb_input = node.get_nb_input()
+    if nb_input == 1:
+        node.set_input(0, item)
+    elif nb_input > 1:
+        for index, value in enumerate(item):
+            node.set_input(index, value)
+    # composite nodes do not compute their outputs in __call__
+    node.eval()
+
+    nb_output = node.get_nb_output()
+    if nb_output == 1:
+        return node.get_output(0)
+    return tuple(node.get_output(index) for index in range(nb_output))
+
+
+def map_items(node, items):
+    """ Return the list of the results of node on each item """
+    return [call_node(node, item) for item in items]
+
+
+def reduce_items(node, items):
+    """ Return the reduction of items by a node with two inputs """
+    items = iter(items)
+    result = items.next()
+    for item in items:
+        result = call_node(node, (result, item))
+    return result
+
+
+_operations = {'map': map_items, 'reduce': reduce_items}
+
+
+def worker_loop(conn):
+    """ Main function of the worker processes.
+
+    Evaluate the tasks (operation, factory id, items) received on conn
+    and send back (True, result) or (False, (exception, traceback)).
+    """
+    from openalea.core.pkgmanager import PackageManager
+
+    pm = PackageManager()
+    if len(pm) == 0:
+        pm.init(verbose=False)
+
+    nodes = {}
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, IOError):
+            break
+        if task is None:
+            break
+
+        operation, factory_id, items = task
+        try:
+            node = nodes.get(factory_id)
+            if node is None:
+                node = nodes[factory_id] = pm.get_node(*factory_id)
+            ret = (True, _operations[operation](node, items))
+        except Exception, e:
+            ret = (False, (e, traceback.format_exc()))
+
+        try:
+            conn.send(ret)
+        except Exception, e:
+            # unpicklable result or exception
+            conn.send((False, (ValueError(str(e)), traceback.format_exc())))
+
+
+class LocalCluster(object):
+    """ Coordinator of a pool of worker processes.
+
+    Workers are forked from the current process, so they know the
+    packages already loaded by the PackageManager.
+    """
+
+    # number of partitions of the data for each worker
+    partitions_per_worker = 4
+
+    def __init__(self, nb_workers=None):
+        """
+        :param nb_workers: number of worker processes (default: one per cpu)
+        """
+        if nb_workers is None:
+            from openalea.core.algo.dataflow_evaluation import cpu_count
+            nb_workers = cpu_count()
+        self.nb_workers = max(1, int(nb_workers))
+        # list of (process, connection)
+        self._workers = []
+        # workers not evaluating a task
+        self._idle = []
+        # protects the lists of workers, notified when a worker is idle
+        self._lock = Condition()
+
+    def _spawn(self):
+        """ Start a worker process (called with the lock held) """
+        import multiprocessing
+
+        conn, worker_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=worker_loop,
+                                          args=(worker_conn,))
+        process.daemon = True
+        process.start()
+        worker_conn.close()
+        worker = (process, conn)
+        self._workers.append(worker)
+        self._idle.append(worker)
+        self._lock.notify()
+
+    def _drop(self, worker):
+        """ Stop and forget a worker (called with the lock held) """
+        process, conn = worker
+        if process.is_alive():
+            process.terminate()
+        conn.close()
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if worker in self._idle:
+            self._idle.remove(worker)
+
+    def start(self):
+        """ Start the worker processes which are not running """
+        with self._lock:
+            for worker in list(self._workers):
+                if not worker[0].is_alive():
+                    self._drop(worker)
+            while len(self._workers) < self.nb_workers:
+                self._spawn()
+
+    def close(self):
+        """ Stop the worker processes """
+        with self._lock:
+            for process, conn in self._workers:
+                try:
+                    conn.send(None)
+                except IOError:
+                    pass
+            for process, conn in self._workers:
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+                conn.close()
+            self._workers = []
+            self._idle = []
+
+    def resize(self, nb_workers):
+        """ Change the number of worker processes.
+
+        Idle workers in excess are stopped at once, busy ones when
+        their task is done. Missing workers are started by the next run.
+        """
+        with self._lock:
+            self.nb_workers = max(1, int(nb_workers))
+            while len(self._workers) > self.nb_workers and self._idle:
+                self._drop(self._idle[-1])
+
+    def acquire_worker(self):
+        """ Wait for an idle worker and return it """
+        with self._lock:
+            while not self._idle:
+                self._lock.wait()
+            return self._idle.pop()
+
+    def release_worker(self, worker, failed=False):
+        """ Give back a worker, replaced by a new one if it failed """
+        with self._lock:
+            if worker not in self._workers:
+                # the cluster has been closed
+                worker[1].close()
+            elif failed or not worker[0].is_alive():
+                self._drop(worker)
+                if len(self._workers) < self.nb_workers:
+                    self._spawn()
+            elif len(self._workers) > self.nb_workers:
+                # the cluster has been resized
+                self._drop(worker)
+            else:
+                self._idle.append(worker)
+                self._lock.notify()
+
+    def partition(self, items):
+        """ Split items in contiguous partitions """
+        nb = self.nb_workers * self.partitions_per_worker
+        size = max(1, (len(items) + nb - 1) // nb)
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def run(self, operation, factory_id, partitions):
+        """ Evaluate an operation of a node on each partition.
+
+        :param operation: 'map' or 'reduce'
+        :param factory_id: (package name, factory name) of the node
+        :returns: the list of the results for each partition
+        """
+        self.start()
+
+        tasks = Queue()
+        for index, items in enumerate(partitions):
+            tasks.put((index, items))
+        results = [None] * len(partitions)
+        errors = []
+
+        def send_tasks():
+            """ Send tasks to idle workers until there is no more task """
+            while not errors:
+                try:
+                    index, items = tasks.get_nowait()
+                except Exception:
+                    return
+                worker = self.acquire_worker()
+                failed = False
+                try:
+                    conn = worker[1]
+                    conn.send((operation, factory_id, items))
+                    ok, ret = conn.recv()
+                except (EOFError, IOError), e:
+                    ok, ret = False, (e, 'worker process died')
+                    failed = True
+                except Exception, e:
+                    # e.g. unpicklable items, the pipe may be out of sync
+                    ok, ret = False, (e, traceback.format_exc())
+                    failed = True
+                finally:
+                    self.release_worker(worker, failed)
+                if ok:
+                    results[index] = ret
+                else:
+                    errors.append(ClusterException(factory_id, *ret))
+
+        # the workers are shared with the concurrent runs
+        nb = min(self.nb_workers, len(partitions))
+        threads = [Thread(target=send_tasks) for i in range(nb)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def map(self, factory_id, items):
+        """ Return the list of the results of the node on each item.
+
+        :param factory_id: (package name, factory name) or
+            'package:factory' name of the node
+        :param items: values of the input, or tuples of input values
+            for nodes with several inputs
+        """
+        factory_id = get_factory_id(factory_id)
+        items = list(items)
+        results = []
+        for ret in self.run('map', factory_id, self.partition(items)):
+            results.extend(ret)
+        return results
+
+    def reduce(self, factory_id, items):
+        """ Return the reduction of items by a node with two inputs.
+
+        Partitions are reduced concurrently, so the operation must be
+        associative. The order of the items is kept.
+        """
+        factory_id = get_factory_id(factory_id)
+        items = list(items)
+        if not items:
+            raise ValueError('reduce of an empty sequence')
+        while len(items) > 1:
+            partitions = self.partition(items)
+            if len(partitions) == len(items):
+                # one item per partition: reduce pairs
+                partitions = [items[i:i + 2] for i in range(0, len(items), 2)]
+            items = self.run('reduce', factory_id, partitions)
+        return items[0]
+
+
+_cluster = None
+
+
+def get_cluster(nb_workers=None):
+    """ Return the local cluster used by the operators
+    (created on first call, resized if nb_workers is given) """
+    global _cluster
+    if _cluster is None:
+        _cluster = LocalCluster(nb_workers)
+    elif nb_workers is not None and nb_workers != _cluster.nb_workers:
+        _cluster.resize(nb_workers)
+    return _cluster
+
+
+def close_cluster():
+    """ Stop the worker processes of the local cluster.
+
+    The next evaluation will fork new workers, aware of the packages
+    loaded in the meantime.
+    """
+    global _cluster
+    if _cluster is not None:
+        _cluster.close()
+        _cluster = None
+
+
+class ClusterOperator(Node):
+    """ Node evaluating the dataflow connected to its dataflow port
+    on the local cluster """
+
+    operation = None
+
+    def __init__(self, inputs=None, outputs=None):
+        if not inputs:
+            inputs = (dict(name='dataflow'), dict(name='data'))
+        if not outputs:
+            outputs = (dict(name='result'),)
+        Node.__init__(self, inputs, outputs)
+
+    def __call__(self, inputs=()):
+        dataflow, data = inputs[:2]
+        return getattr(get_cluster(), self.operation)(dataflow, data),
+
+
+class MapOperator(ClusterOperator):
+    """ Apply the dataflow on each item of data """
+    operation = 'map'
+
+
+class ReduceOperator(ClusterOperator):
+    """ Reduce data with a dataflow of two inputs """
+    operation = 'reduce'
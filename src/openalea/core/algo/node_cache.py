@@ -0,0 +1,309 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide a persistent cache of node outputs.
+
+Outputs are stored on disk, indexed by a digest of the node factory
+(package, name, version and source code) and of the node inputs.
+Only side effect free nodes are cached.
+
+The cache is disabled by default::
+
+    from openalea.core.algo.node_cache import enable_node_cache
+    cache = enable_node_cache()
+    ...
+    print cache.get_stats()
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import os
+import cPickle
+import hashlib
+import tempfile
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from openalea.core import settings
+from openalea.core.node import Node
+
+
+def is_pure_node(node):
+    """ Return True if the outputs of node only depend on its inputs.
+
+    The node must be created by a factory and flagged as side_effect_free.
+    Nodes redefining eval (e.g. iterators) keep a state and are excluded.
+    """
+    factory = getattr(node, 'factory', None)
+    if factory is None or not getattr(node, 'side_effect_free', False):
+        return False
+    eval_func = getattr(type(node).eval, 'im_func', None)
+    return eval_func is Node.eval.im_func
+
+
+def get_default_cache_dir():
+    """ Return the directory of the cache in the openalea home directory """
+    return os.path.join(settings.get_openalea_home_dir(), 'cache')
+
+
+class NodeCache(object):
+    """ Disk cache of node outputs with a least recently used eviction.
+
+    Each entry is a pickle file named by its key. The modification time
+    of a file is its last access time, so the eviction order is kept
+    between sessions.
+    """
+
+    extension = '.pkl'
+
+    def __init__(self, dirname=None, max_size=512 * 1024 * 1024):
+        """
+        :param dirname: directory of the cache
+            (default: cache in the openalea home directory)
+        :param max_size: maximum size in bytes of the cache on disk
+        """
+        if dirname is None:
+            dirname = get_default_cache_dir()
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.dirname = dirname
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._sources = WeakKeyDictionary()
+        # key -> [size, access time]
+        self._entries = {}
+        self._size = 0
+        self.scan()
+
+    def scan(self):
+        """ Read the entries stored in the cache directory """
+        ext = self.extension
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            for name in os.listdir(self.dirname):
+                if not name.endswith(ext):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.dirname, name))
+                except OSError:
+                    continue
+                self._entries[name[:-len(ext)]] = [st.st_size, st.st_mtime]
+                self._size += st.st_size
+
+    def filename(self, key):
+        return os.path.join(self.dirname, key + self.extension)
+
+    def source_digest(self, factory):
+        """ Return a digest of the source code of the factory's node """
+        src_cache = getattr(factory, 'src_cache', None)
+        cached = self._sources.get(factory)
+        if cached is not None and cached[0] == src_cache:
+            return cached[1]
+
+        try:
+            src = factory.get_node_src()
+        except Exception:
+            # builtin or compiled function
+            src = '%s.%s' % (getattr(factory, 'nodemodule_name', ''),
+                             getattr(factory, 'nodeclass_name', ''))
+        digest = hashlib.sha1(repr(src)).hexdigest()
+        self._sources[factory] = (src_cache, digest)
+        return digest
+
+    def get_key(self, node, inputs):
+        """ Return the key of node outputs for these inputs.
+
+        Return None if the inputs can not be pickled.
+        """
+        try:
+            data = cPickle.dumps(list(inputs), cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+
+        factory = node.factory
+        pkg = getattr(factory, 'package', None)
+        if pkg is not None:
+            pkg_id = (pkg.name, pkg.metainfo.get('version', ''))
+        else:
+            pkg_id = None
+
+        h = hashlib.sha1()
+        h.update(repr((pkg_id, factory.name, self.source_digest(factory))))
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """ Return (True, outputs) if key is in the cache,
+        (False, None) otherwise """
+        if key not in self._entries:
+            return False, None
+
+        fn = self.filename(key)
+        try:
+            f = open(fn, 'rb')
+            try:
+                outputs = cPickle.load(f)
+            finally:
+                f.close()
+            os.utime(fn, None)
+        except Exception:
+            # removed by another session or corrupted
+            self.remove(key)
+            return False, None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] = os.path.getmtime(fn)
+        return True, outputs
+
+    def set(self, key, outputs):
+        """ Store outputs in the cache. Unpicklable outputs are ignored """
+        try:
+            data = cPickle.dumps(outputs, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        if len(data) > self.max_size:
+            return
+
+        fn = self.filename(key)
+        fd, tmp = tempfile.mkstemp(dir=self.dirname)
+        try:
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            # rename does not replace existing files on windows
+            if os.name == 'nt' and os.path.exists(fn):
+                os.remove(fn)
+            os.rename(tmp, fn)
+        except OSError:
+            # written concurrently by another session
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._size -= old[0]
+            self._entries[key] = [len(data), os.path.getmtime(fn)]
+            self._size += len(data)
+
+        self.evict()
+
+    def remove(self, key):
+        """ Remove an entry from the cache """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self._size -= entry[0]
+        try:
+            os.remove(self.filename(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """ Remove the least recently used entries until the size of
+        the cache is lower than max_size """
+        if self._size <= self.max_size:
+            return
+
+        with self._lock:
+            lru = sorted(self._entries.iteritems(), key=lambda x: x[1][1])
+        for key, (size, atime) in lru:
+            if self._size <= self.max_size:
+                break
+            self.remove(key)
+
+    def clear(self):
+        """ Remove all the entries and reset statistics """
+        for key in self._entries.keys():
+            self.remove(key)
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """ Return a dict with the number of hits, misses,
+        entries and the size of the cache """
+        return dict(hits=self.hits, misses=self.misses,
+                    entries=len(self._entries), size=self._size)
+
+    def cached_call(self, node, call=None):
+        """ Return a function computing the outputs of node from its
+        inputs, looking for them in the cache first.
+
+        :param node: the node to evaluate
+        :param call: function computing the outputs (default node.__call__)
+        :returns: call unchanged if node can not be cached
+        """
+        if not is_pure_node(node):
+            return call
+        if call is None:
+            call = node.__call__
+
+        def cached(inputs):
+            key = self.get_key(node, inputs)
+            if key is None:
+                return call(inputs)
+
+            found, outputs = self.get(key)
+            with self._lock:
+                if found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if found:
+                return outputs
+
+            outputs = call(inputs)
+            self.set(key, outputs)
+            return outputs
+
+        return cached
+
+
+_node_cache = None
+
+
+def get_node_cache():
+    """ Return the node cache used by evaluations (None if disabled) """
+    return _node_cache
+
+
+def enable_node_cache(dirname=None, max_size=512 * 1024 * 1024):
+    """ Enable the cache of node outputs for all evaluations.
+
+    :param dirname: directory of the cache
+        (default: cache in the openalea home directory)
+    :param max_size: maximum size in bytes of the cache on disk
+    :returns: the NodeCache
+    """
+    global _node_cache
+    _node_cache = NodeCache(dirname, max_size)
+    return _node_cache
+
+
+def disable_node_cache():
+    """ Do not use the cache of node outputs anymore """
+    global _node_cache
+    _node_cache = None
@@ -0,0 +1,192 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide historical execution times of the nodes.
+
+For each factory, an exponentially weighted moving average of the run
+time and of the output size of its nodes is updated after each
+evaluation and stored in a sqlite database of the openalea home
+directory. The critical path evaluation uses these statistics to
+evaluate first the nodes on the longest path of the dataflow.
+
+The timing database is disabled by default::
+
+    from openalea.core.algo.node_timing import enable_node_timing
+    timing = enable_node_timing()
+    ...
+    timing.flush()
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import os
+import sqlite3
+from threading import Lock
+
+from openalea.core import settings
+from openalea.core.algo.dataflow_profiler import output_size
+
+
+def get_default_timing_db():
+    """ Return the timing database in the openalea home directory """
+    return os.path.join(settings.get_openalea_home_dir(), 'timing.sq3')
+
+
+def timing_key(node):
+    """ Return the key of the statistics of a node:
+    'package:factory' or the name of its function or class """
+    factory = getattr(node, 'factory', None)
+    if factory is not None:
+        pkg = getattr(factory, 'package', None)
+        pkg_name = pkg.name if pkg is not None else ''
+        return '%s:%s' % (pkg_name, factory.name)
+
+    func = getattr(node, 'func', None)
+    if func is not None:
+        obj = func
+    else:
+        obj = type(node)
+    return '%s.%s' % (getattr(obj, '__module__', ''),
+                      getattr(obj, '__name__', type(obj).__name__))
+
+
+class NodeTiming(object):
+    """ Moving averages of the run time and output size of the nodes,
+    by factory.
+
+    The statistics are read from the database when created and written
+    back by flush.
+    """
+
+    def __init__(self, db_name=None, alpha=0.3):
+        """
+        :param db_name: file of the sqlite database (default: timing.sq3
+            in the openalea home directory)
+        :param alpha: weight of the last evaluation in the averages
+        """
+        if db_name is None:
+            db_name = get_default_timing_db()
+        self.db_name = db_name
+        self.alpha = alpha
+        self._lock = Lock()
+        # key -> [run time, output size, number of evaluations]
+        self._stats = {}
+        self._modified = set()
+
+        conn = self.connect()
+        try:
+            for key, runtime, size, count in conn.execute(
+                    "SELECT key, runtime, output_size, count FROM NodeTiming"):
+                self._stats[key] = [runtime, size, count]
+        finally:
+            conn.close()
+
+    def connect(self):
+        """ Return a connection to the database (created if needed) """
+        conn = sqlite3.connect(self.db_name)
+        conn.execute("CREATE TABLE IF NOT EXISTS NodeTiming (key TEXT, runtime REAL, output_size REAL, count INTEGER, PRIMARY KEY(key))")
+        return conn
+
+    def update(self, key, runtime, size=0):
+        """ Add an evaluation of a node to the statistics of key """
+        alpha = self.alpha
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                self._stats[key] = [runtime, size, 1]
+            else:
+                stats[0] += alpha * (runtime - stats[0])
+                stats[1] += alpha * (size - stats[1])
+                stats[2] += 1
+            self._modified.add(key)
+
+    def record(self, node, runtime):
+        """ Add an evaluation of node which lasted runtime seconds """
+        self.update(timing_key(node), runtime, output_size(node))
+
+    def get(self, key):
+        """ Return (run time, output size, number of evaluations)
+        of key, or None if it has never been evaluated """
+        stats = self._stats.get(key)
+        if stats is None:
+            return None
+        return tuple(stats)
+
+    def runtime(self, node, default=None):
+        """ Return the average run time of node (default if unknown) """
+        stats = self._stats.get(timing_key(node))
+        if stats is None:
+            return default
+        return stats[0]
+
+    def flush(self):
+        """ Write the modified statistics in the database """
+        with self._lock:
+            rows = [(key,) + tuple(self._stats[key]) for key in self._modified]
+            self._modified.clear()
+        if not rows:
+            return
+
+        conn = self.connect()
+        try:
+            conn.executemany("INSERT OR REPLACE INTO NodeTiming (key, runtime, output_size, count) VALUES (?,?,?,?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def clear(self):
+        """ Remove all the statistics """
+        with self._lock:
+            self._stats.clear()
+            self._modified.clear()
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM NodeTiming")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+_node_timing = None
+
+
+def get_node_timing():
+    """ Return the timing statistics updated by evaluations
+    (None if disabled) """
+    return _node_timing
+
+
+def enable_node_timing(db_name=None, alpha=0.3):
+    """ Record the run time of the nodes of all the evaluations.
+
+    :param db_name: file of the sqlite database
+        (default: timing.sq3 in the openalea home directory)
+    :param alpha: weight of the last evaluation in the averages
+    :returns: the NodeTiming
+    """
+    global _node_timing
+    if _node_timing is not None:
+        _node_timing.flush()
+    _node_timing = NodeTiming(db_name, alpha)
+    return _node_timing
+
+
+def disable_node_timing():
+    """ Write the statistics and stop recording the run times """
+    global _node_timing
+    if _node_timing is not None:
+        _node_timing.flush()
+    _node_timing = None
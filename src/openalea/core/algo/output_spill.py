@@ -0,0 +1,189 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""This module provide a spill of large node outputs to memory mapped files.
+
+Large buffers (numpy arrays, bytearray, buffer objects) are written in
+the openalea temporary directory and replaced by a view on the mapped
+file: the data is read back from the disk only when it is accessed, so
+dataflows whose intermediate data exceed the physical memory can be run.
+
+Numpy arrays are replaced by a numpy.memmap, other buffers by a mmap.
+The views are copy on write, so nodes modifying their inputs in place do
+not modify the spilled data. str values are never spilled.
+
+The spill is disabled by default::
+
+    from openalea.core.algo.output_spill import enable_spill
+    enable_spill(threshold=64 * 1024 * 1024, budget=1024 * 1024 * 1024)
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import os
+import mmap
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from openalea.core import settings
+
+
+def get_default_spill_dir():
+    """ Return the spill directory in the openalea temporary directory """
+    return os.path.join(settings.get_openalea_tmp_dir(), 'spill')
+
+
+def get_size(value):
+    """ Return the size in bytes of a value which can be spilled,
+    None otherwise (e.g. already spilled) """
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        if value.dtype.hasobject or isinstance(value, numpy.memmap):
+            return None
+        return value.nbytes
+    if isinstance(value, (bytearray, buffer)):
+        return len(value)
+    return None
+
+
+class OutputSpill(object):
+    """ Write large values in memory mapped files.
+
+    Values larger than threshold are spilled once the size of the
+    values kept in memory during an evaluation exceeds the budget.
+    """
+
+    def __init__(self, dirname=None, threshold=64 * 1024 * 1024,
+                 budget=None):
+        """
+        :param dirname: directory of the mapped files
+            (default: spill in the openalea temporary directory)
+        :param threshold: minimum size in bytes of the spilled values
+        :param budget: size in bytes of the large values kept in memory
+            by an evaluation (None: spill all the large values)
+        """
+        if dirname is None:
+            dirname = get_default_spill_dir()
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.dirname = dirname
+        self.threshold = threshold
+        self.budget = budget
+        self.nb_spilled = 0
+        # files which can not be removed while mapped (windows)
+        self._files = []
+
+    def keep(self, value, resident=0):
+        """ Test wether value can be kept in memory: value is small or
+        fits in the budget.
+
+        :param resident: size of the values already kept in memory
+        :returns: (bool, updated resident size)
+        """
+        size = get_size(value)
+        if size is None or size < self.threshold:
+            return True, resident
+        if self.budget is not None and resident + size <= self.budget:
+            return True, resident + size
+        return False, resident
+
+    def store(self, value, resident=0):
+        """ Spill value if it is large and does not fit in the budget.
+
+        :param resident: size of the values already kept in memory
+        :returns: (value or its mapped view, updated resident size)
+        """
+        keep, resident = self.keep(value, resident)
+        if keep:
+            return value, resident
+        return self.spill(value), resident
+
+    def spill(self, value):
+        """ Write value in a file and return a copy on write view on it """
+        if not get_size(value):
+            return value
+
+        fd, fn = tempfile.mkstemp(suffix='.spill', dir=self.dirname)
+        try:
+            if numpy is not None and isinstance(value, numpy.ndarray):
+                os.close(fd)
+                fd = None
+                data = numpy.lib.format.open_memmap(
+                    fn, mode='w+', dtype=value.dtype, shape=value.shape)
+                data[...] = value
+                data.flush()
+                del data
+                view = numpy.load(fn, mmap_mode='c')
+            else:
+                os.write(fd, value)
+                view = mmap.mmap(fd, len(value), access=mmap.ACCESS_COPY)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+        # the data is freed with the view
+        try:
+            os.remove(fn)
+        except OSError:
+            self._files.append(fn)
+
+        self.nb_spilled += 1
+        return view
+
+    def clear(self):
+        """ Remove the files of the views not used anymore """
+        files = self._files
+        self._files = []
+        for fn in files:
+            try:
+                os.remove(fn)
+            except OSError:
+                self._files.append(fn)
+
+
+_output_spill = None
+
+
+def get_output_spill():
+    """ Return the spill used by evaluations (None if disabled) """
+    return _output_spill
+
+
+def enable_spill(dirname=None, threshold=64 * 1024 * 1024, budget=None):
+    """ Spill the large outputs of all the evaluations.
+
+    :param dirname: directory of the mapped files
+        (default: spill in the openalea temporary directory)
+    :param threshold: minimum size in bytes of the spilled values
+    :param budget: size in bytes of the large values kept in memory
+        by an evaluation (None: spill all the large values)
+    :returns: the OutputSpill
+    """
+    global _output_spill
+    _output_spill = OutputSpill(dirname, threshold, budget)
+    return _output_spill
+
+
+def disable_spill():
+    """ Do not spill the outputs anymore """
+    global _output_spill
+    if _output_spill is not None:
+        _output_spill.clear()
+    _output_spill = None
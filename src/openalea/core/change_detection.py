@@ -0,0 +1,153 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+###############################################################################
+"""Strategies used by lazy nodes to detect that an input has changed.
+
+A detector computes a signature of the input values, an input has changed
+if the signature of the new value differs from the signature of the
+previous one.
+
+The detector of an input port is given by the `change_detector` key of
+its description, or by the `__change_detector__` attribute of its
+interface, as a name or a ChangeDetector instance::
+
+    inputs = (dict(name='image', change_detector='identity'),)
+
+Otherwise it is chosen from the type of the value: numpy arrays are
+hashed, other values are compared.
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ChangeDetector(object):
+    """ Compare values with cmp (the default of lazy nodes) """
+
+    # True if the signature must be computed when the value is set:
+    # the value can be modified in place later.
+    cached = False
+
+    def signature(self, value):
+        """ Return the signature of a value """
+        return value
+
+    def changed(self, old_signature, new_signature):
+        """ Return True if the signatures are different """
+        try:
+            return cmp(old_signature, new_signature) != 0
+        except Exception:
+            # e.g. incomparable values
+            return True
+
+
+class ScalarDetector(ChangeDetector):
+    """ Compare immutable values and their types """
+
+    def changed(self, old_signature, new_signature):
+        if type(old_signature) is not type(new_signature):
+            return True
+        try:
+            return bool(old_signature != new_signature)
+        except Exception:
+            return True
+
+
+class IdentityDetector(ChangeDetector):
+    """ A value has changed if it is another object """
+
+    cached = True
+
+    def signature(self, value):
+        return id(value)
+
+    def changed(self, old_signature, new_signature):
+        return old_signature != new_signature
+
+
+class VersionDetector(IdentityDetector):
+    """ A value has changed if it is another object or if its version
+    counter has been incremented """
+
+    def __init__(self, attribute='version'):
+        """
+        :param attribute: name of the version counter of the values
+        """
+        self.attribute = attribute
+
+    def signature(self, value):
+        return id(value), getattr(value, self.attribute, None)
+
+
+class HashDetector(IdentityDetector):
+    """ A value has changed if its hash has changed.
+
+    Numpy arrays and buffers are hashed with a checksum of their data,
+    so modifications in place are detected.
+    """
+
+    def signature(self, value):
+        if numpy is not None and isinstance(value, numpy.ndarray):
+            if not value.dtype.hasobject:
+                data = numpy.ascontiguousarray(value)
+                return (value.shape, value.dtype.str,
+                        zlib.adler32(data.data) & 0xffffffff)
+        elif isinstance(value, (bytearray, buffer)):
+            return type(value), len(value), zlib.adler32(value) & 0xffffffff
+        try:
+            return type(value), hash(value)
+        except TypeError:
+            # unhashable: changed if another object
+            return id(value)
+
+
+_detectors = {
+    'equal': ChangeDetector(),
+    'scalar': ScalarDetector(),
+    'identity': IdentityDetector(),
+    'version': VersionDetector(),
+    'hash': HashDetector(),
+}
+
+_scalar_types = (int, long, float, complex, bool, str, unicode, type(None))
+
+
+def register_change_detector(name, detector):
+    """ Register a detector, usable by its name in port descriptions """
+    _detectors[name] = detector
+
+
+def get_change_detector(detector):
+    """ Return a ChangeDetector from a name or a ChangeDetector """
+    if isinstance(detector, basestring):
+        return _detectors[detector]
+    return detector
+
+
+def default_change_detector(value):
+    """ Return the detector for a value (hash for numpy arrays,
+    scalar for immutable scalars, cmp otherwise) """
+    if type(value) in _scalar_types:
+        return _detectors['scalar']
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        return _detectors['hash']
+    return _detectors['equal']
@@ -31,7 +31,7 @@ from openalea.core.node import AbstractFactory, AbstractPort, Node
 from openalea.core.node import RecursionError
 from openalea.core.pkgmanager import PackageManager, protected, UnknownPackageError
 from openalea.core.package import UnknownNodeError
-from openalea.core.dataflow import DataFlow, InvalidEdge, PortError
+from openalea.core.dataflow import DataFlow, InvalidEdge, PortError, CycleError
 from openalea.core.settings import Settings
 from openalea.core.metadatadict import MetaDataDict
 import logger
@@ -156,6 +156,7 @@ class CompositeNodeFactory(AbstractFactory):
         cont_eval = set() # continuous evaluated nodes
 
         # Instantiate the node with each factory
+        nodes = []
         for vid in self.elt_factory:
             try:
                 node = self.instantiate_node(vid, call_stack)
@@ -173,7 +174,9 @@ class CompositeNodeFactory(AbstractFactory):
                 node.raise_exception = True
                 node.notify_listeners(('data_modified', None, None ))
 
-            new_df.add_node(node, vid, False)
+            nodes.append((node, vid))
+
+        new_df.add_nodes(nodes, False)
 
         # Set IO internal data
         try:
@@ -187,6 +190,7 @@ class CompositeNodeFactory(AbstractFactory):
             pass
 
         # Create the connections
+        links = []
         for eid, link in self.connections.iteritems():
             (source_vid, source_port, target_vid, target_port) = link
 
@@ -196,7 +200,9 @@ class CompositeNodeFactory(AbstractFactory):
             if(target_vid == '__out__'):
                 target_vid = new_df.id_out
 
-            new_df.connect(source_vid, source_port, target_vid, target_port)
+            links.append((source_vid, source_port, target_vid, target_port))
+
+        new_df.connect_nodes(links)
 
         # Set continuous evaluation
         for vid in cont_eval:
@@ -420,10 +426,31 @@ class CompositeNode(Node, DataFlow):
         self.graph_modified = False
         self.evaluating = False
         self.eval_algo = None
+        # free the intermediate outputs during the evaluations
+        # (None: default of the evaluation algorithm)
+        self.release_outputs = None
+        # (eval_algo, evaluation algorithm instance)
+        self._eval_algo_cache = None
 
     def copy_to(self, other):
         raise NotImplementedError
 
+    def __getstate__(self):
+        """ Pickle function : do not save the evaluation algorithm,
+        the parent index and the topological order """
+        odict = Node.__getstate__(self)
+        odict['_eval_algo_cache'] = None
+        odict['_parents'] = {}
+        odict['_parents_version'] = None
+        odict['_position_listener'] = None
+        odict['_topo_order'] = None
+        odict['_topo_cyclic'] = False
+        return odict
+
+    def __setstate__(self, state):
+        Node.__setstate__(self, state)
+        self._update_old_state(state)
+
     def close(self):
         for vid in set(self.vertices()):
             node = self.actor(vid)
@@ -439,6 +466,23 @@ class CompositeNode(Node, DataFlow):
             node = self.actor(vid)
             node.reset()
 
+    def checkpoint_state(self):
+        """ Return the state of the composite node and of its nodes """
+        state = Node.checkpoint_state(self)
+        nodes = state['nodes'] = {}
+        for vid in self.vertices():
+            get_state = getattr(self.actor(vid), 'checkpoint_state', None)
+            if get_state is not None:
+                nodes[vid] = get_state()
+        return state
+
+    def restore_checkpoint_state(self, state):
+        """ Restore the state of the composite node and of its nodes """
+        Node.restore_checkpoint_state(self, state)
+        for vid, node_state in state.get('nodes', {}).iteritems():
+            if self.has_vertex(vid):
+                self.actor(vid).restore_checkpoint_state(node_state)
+
     def invalidate(self):
         """ Invalidate nodes """
 
@@ -499,7 +543,29 @@ class CompositeNode(Node, DataFlow):
         return self.node(self.id_out).set_output(index_key, val)
 
     def get_eval_algo(self):
-        """ Return the evaluation algo instance """
+        """ Return the evaluation algo instance
+
+        Reusable algorithms are kept for the next evaluations while
+        eval_algo is not changed, the others are created for each
+        evaluation.
+        """
+        cache = getattr(self, '_eval_algo_cache', None)
+        if cache is not None and cache[0] == self.eval_algo:
+            algo = cache[1]
+        else:
+            algo = self._create_eval_algo()
+            if getattr(algo, 'reusable', False):
+                self._eval_algo_cache = (self.eval_algo, algo)
+            else:
+                self._eval_algo_cache = None
+
+        release = getattr(self, 'release_outputs', None)
+        if release is not None:
+            algo.release_outputs = release
+        return algo
+
+    def _create_eval_algo(self):
+        """ Create the evaluation algo instance """
         try:
             algo_str = self.eval_algo
 
@@ -877,6 +943,45 @@ class CompositeNode(Node, DataFlow):
 
         return vid
 
+    def add_nodes(self, nodes, modify=True):
+        """
+        Add several nodes in the Graph. The notifications are sent
+        once all the nodes are added (and not at all if the graph has no
+        listener).
+
+        :param nodes: iterable of (node, vid), vid is None to autogenerate
+            an id
+        :param modify: if True, the graph is marked as modified
+
+        :return: the list of the ids
+        """
+        nodes = list(nodes)
+        vids = self.add_vertices([vid for node, vid in nodes])
+        nodes = [node for node, vid in nodes]
+
+        ports = []
+        for node, vid in zip(nodes, vids):
+            # -- NOOOOOO THE UGLY BACK REFERENCE --
+            node.set_compositenode(self)
+            ports.extend((vid, local_pid, False)
+                         for local_pid in xrange(node.get_nb_input()))
+            ports.extend((vid, local_pid, True)
+                         for local_pid in xrange(node.get_nb_output()))
+        self.add_ports(ports)
+
+        for node, vid in zip(nodes, vids):
+            self.set_actor(vid, node)
+
+        if self.listeners:
+            for node, vid in zip(nodes, vids):
+                self.notify_vertex_addition(node, vid)
+
+        if(modify):
+            self.notify_listeners(("graph_modified", ))
+            self.graph_modified = True
+
+        return vids
+
     def notify_vertex_addition(self, vertex, vid=None):
         vtype = "vertex"
         doNotify = True
@@ -988,6 +1093,77 @@ class CompositeNode(Node, DataFlow):
         nodeDst.set_port_hidden(port_dst, False)
         self.notify_listeners(("edge_added", edgedata))
 
+    def connect_nodes(self, connections):
+        """ Connect several pairs of elements. The notifications are sent
+        once all the edges are created (and not at all if the graph has
+        no listener).
+
+        :param connections: iterable of (src_id, port_src, dst_id, port_dst)
+        :return: the list of the eids (None for the connections which
+            could not be created)
+        """
+        pids = []
+        valid = []
+        for link in connections:
+            src_id, port_src, dst_id, port_dst = link
+            try:
+                pids.append((self.out_port(src_id, port_src),
+                             self.in_port(dst_id, port_dst)))
+                valid.append(link)
+            except Exception:
+                logger.error("Enable to create the edge %s %s %s %s %s" % (
+                    getattr(self.factory, 'name', None),
+                    src_id, port_src, dst_id, port_dst))
+                valid.append(None)
+
+        try:
+            connected = self.connect_ports(pids)
+        except CycleError:
+            # connect them one by one to reject only the connections
+            # closing a cycle, as connect does
+            connected = []
+            for source_pid, target_pid in pids:
+                try:
+                    connected.append(DataFlow.connect(self, source_pid,
+                                                      target_pid))
+                except CycleError, e:
+                    logger.error(str(e))
+                    connected.append(None)
+
+        new_eids = iter(connected)
+        eids = []
+        for i, link in enumerate(valid):
+            eid = None if link is None else new_eids.next()
+            if eid is None:
+                valid[i] = None
+            eids.append(eid)
+
+        notify = bool(self.listeners)
+        sources = set()
+        edges = []
+        for link, eid in zip(valid, eids):
+            if link is None:
+                continue
+            src_id, port_src, dst_id, port_dst = link
+            sources.add(src_id)
+            nodeDst = self.node(dst_id)
+            nodeDst.set_input_state(port_dst, "connected")
+            nodeDst.set_port_hidden(port_dst, False)
+            if notify:
+                edges.append(("default", eid,
+                              self.node(src_id).output_desc[port_src],
+                              nodeDst.input_desc[port_dst]))
+
+        for src_id in sources:
+            self.update_eval_listeners(src_id)
+
+        if sources:
+            self.graph_modified = True
+            self.notify_listeners(("connection_modified", ))
+            for edgedata in edges:
+                self.notify_listeners(("edge_added", edgedata))
+        return eids
+
     def disconnect(self, src_id, port_src, dst_id, port_dst):
         """ Deconnect 2 elements
 
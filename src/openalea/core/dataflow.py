@@ -22,13 +22,20 @@ __revision__ = " $Id$ "
 from openalea.core.graph.property_graph import PropertyGraph, InvalidVertex
 from openalea.core.graph.property_graph import InvalidEdge
 from openalea.core.graph.id_generator import IdGenerator
+from openalea.core.observer import AbstractListener
 from collections import deque
+from weakref import ref
 
 
 class PortError (Exception):
     pass
 
 
+class CycleError (PortError):
+    """ Raised when a connection would create a cycle """
+    pass
+
+
 class Port (object):
     """
     simple structure to maintain some port property
@@ -42,16 +49,59 @@ class Port (object):
         self._is_out_port = is_out_port
 
 
+class PositionListener(AbstractListener):
+    """ Invalidate the parent index of a dataflow when an actor moves """
+
+    def __init__(self, dataflow):
+        AbstractListener.__init__(self)
+        self.dataflow = ref(dataflow)
+
+    def notify(self, sender, event=None):
+        if event and event[0] == 'metadata_changed' and event[1] == 'position':
+            dataflow = self.dataflow()
+            if dataflow is not None:
+                dataflow._position_version += 1
+
+
+def actor_posx(actor):
+    """ Return the x position of an actor (0 if it has no position) """
+    try:
+        return actor.get_ad_hoc_dict().get_metadata('position')[0]
+    except Exception:
+        return 0
+
+
 class DataFlow(PropertyGraph):
     """
     Directed graph with connections between in_ports
     of vertices and out_port of vertices
     ports are typed
+
+    A topological order of the vertices is maintained incrementally
+    (Pearce-Kelly algorithm) while the dataflow has no cycle.
     """
 
+    # if False, the connections creating a cycle raise a CycleError
+    allow_cycles = True
+
     def __init__(self):
+        # incremented at each topological modification
+        self._topology_version = 0
+        # incremented when an actor of the parent index moves
+        self._position_version = 0
+        # in port -> ordered parents, valid for _parents_version
+        self._parents = {}
+        self._parents_version = None
+        self._position_listener = None
+        # vid -> rank in a topological order (None if not computed or cyclic)
+        self._topo_order = {}
+        self._topo_next = 0
+        # True if the dataflow had a cycle when the order was computed
+        self._topo_cyclic = False
         PropertyGraph.__init__(self)
         self._ports = {}
+        # pid -> set of the edges connected to the port
+        self._port_edges = {}
         self._pid_generator = IdGenerator()
 
         self.add_edge_property("_source_port")
@@ -177,17 +227,10 @@ class DataFlow(PropertyGraph):
         """
         iterate on all edges connected
         to this port
+        (edges can be removed during the iteration)
         :rtype: iter of eid
         """
-        vid = self.vertex(pid)
-        if self.is_out_port(pid):
-            for eid in self.out_edges(vid):
-                if self.source_port(eid)==pid:
-                    yield eid
-        else:
-            for eid in self.in_edges(vid):
-                if self.target_port(eid)==pid:
-                    yield eid
+        return iter(list(self._port_edges[pid]))
 
     def nb_connections(self, pid):
         """ Compute number of edges connected to a given port.
@@ -198,7 +241,244 @@ class DataFlow(PropertyGraph):
         return:
             - int
         """
-        return len(tuple(self.connected_edges(pid)))
+        return len(self._port_edges[pid])
+
+    def rebuild_port_edges(self):
+        """ Compute the index of the edges connected to each port
+        (e.g. for dataflows pickled without it) """
+        port_edges = dict((pid, set()) for pid in self._ports)
+        source_port = self.edge_property("_source_port")
+        target_port = self.edge_property("_target_port")
+        for eid in self.edges():
+            for pid in (source_port.get(eid), target_port.get(eid)):
+                if pid in port_edges:
+                    port_edges[pid].add(eid)
+        self._port_edges = port_edges
+
+    def topology_version(self):
+        """ Return a counter incremented each time vertices, ports,
+        edges or actors are added, removed or replaced.
+
+        Used by algorithms to know when cached structures are obsolete.
+        """
+        return self._topology_version
+
+    def parents_version(self):
+        """ Return a version of the parent index, which changes when the
+        topology is modified or when a parent actor moves """
+        return (self._topology_version, self._position_version)
+
+    def parent_ports(self, pid):
+        """ Return the ordered parents connected to in port pid.
+
+        The index is cached: it is computed again when the topology
+        is modified or when a parent actor moves.
+
+        :returns: tuple of (npid, nvid, nactor, out_index) sorted by the
+                  x position of the actors, then by port id
+        """
+        version = self.parents_version()
+        if self._parents_version != version:
+            self._parents = {}
+            self._parents_version = version
+
+        parents = self._parents.get(pid)
+        if parents is None:
+            listener = self._position_listener
+            if listener is None:
+                listener = self._position_listener = PositionListener(self)
+
+            parents = []
+            for npid in self.connected_ports(pid):
+                nvid = self.vertex(npid)
+                try:
+                    nactor = self.actor(nvid)
+                except KeyError:
+                    nactor = None
+                else:
+                    try:
+                        nactor.get_ad_hoc_dict().register_listener(listener)
+                    except AttributeError:
+                        pass
+                parents.append((actor_posx(nactor), npid,
+                                (npid, nvid, nactor, self.local_id(npid))))
+            parents.sort()
+            parents = self._parents[pid] = tuple(p[2] for p in parents)
+
+        return parents
+
+    def __getstate__(self):
+        """ Pickle function : do not save the parent index
+        and the topological order """
+        odict = self.__dict__.copy()
+        odict['_parents'] = {}
+        odict['_parents_version'] = None
+        odict['_position_listener'] = None
+        odict['_topo_order'] = None
+        odict['_topo_cyclic'] = False
+        return odict
+
+    def __setstate__(self, state):
+        """ Unpickle function : build the port index of old dataflows """
+        self.__dict__.update(state)
+        self._update_old_state(state)
+
+    def _update_old_state(self, state):
+        """ Set the indexes and the versions missing in the pickles of
+        old dataflows """
+        if '_port_edges' not in state:
+            self.rebuild_port_edges()
+        if '_topo_order' not in state:
+            self._topo_order = None
+            self._topo_next = 0
+            self._topo_cyclic = False
+        if '_topology_version' not in state:
+            self._topology_version = 0
+            self._position_version = 0
+        if '_parents' not in state:
+            self._parents = {}
+            self._parents_version = None
+            self._position_listener = None
+
+    ####################################################
+    #
+    #        topological order
+    #
+    ####################################################
+
+    def _topological_order(self):
+        """ Return the dict vid -> rank, computed if needed
+        (None if the dataflow has a cycle) """
+        order = self._topo_order
+        if order is None and not self._topo_cyclic:
+            order = self._topo_order = self.compute_topological_order()
+            self._topo_next = len(self)
+            self._topo_cyclic = order is None
+        return order
+
+    def compute_topological_order(self):
+        """ Compute a topological order of the vertices from scratch.
+
+        :returns: a dict vid -> rank or None if the dataflow has a cycle
+        """
+        waiting = dict((vid, self.nb_in_edges(vid)) for vid in self.vertices())
+        ready = deque(sorted(vid for vid, nb in waiting.iteritems() if nb == 0))
+        order = {}
+        while ready:
+            vid = ready.popleft()
+            order[vid] = len(order)
+            for eid in self.out_edges(vid):
+                tid = self.target(eid)
+                waiting[tid] -= 1
+                if waiting[tid] == 0:
+                    ready.append(tid)
+
+        if len(order) < len(waiting):
+            return None
+        return order
+
+    def is_acyclic(self):
+        """ Return True if the dataflow has no cycle """
+        return self._topological_order() is not None
+
+    def topological_index(self, vid):
+        """ Return the rank of vid in a topological order of the dataflow
+        (the source of an edge has a lower rank than its target).
+
+        Ranks are not contiguous. The lookup is done in constant time.
+
+        :returns: an int or None if the dataflow has a cycle
+        """
+        order = self._topological_order()
+        if order is None:
+            return None
+        try:
+            return order[vid]
+        except KeyError:
+            raise InvalidVertex(vid)
+
+    def topological_order(self, vids=None):
+        """ Return the list of vids (default all the vertices) sorted in
+        topological order, or None if the dataflow has a cycle """
+        order = self._topological_order()
+        if order is None:
+            return None
+        if vids is None:
+            vids = order
+        return sorted(vids, key=order.__getitem__)
+
+    def _reaches(self, source, target):
+        """ Return True if there is a path from source to target """
+        visited = set([source])
+        stack = [source]
+        while stack:
+            vid = stack.pop()
+            if vid == target:
+                return True
+            for nvid in self.out_neighbors(vid):
+                if nvid not in visited:
+                    visited.add(nvid)
+                    stack.append(nvid)
+        return False
+
+    def _order_edge(self, source, target):
+        """ Update the topological order before the creation of an edge
+        from source to target (Pearce-Kelly algorithm).
+
+        :raises CycleError: if the edge creates a cycle and cycles
+            are not allowed
+        """
+        order = self._topological_order()
+        if order is None:
+            # the dataflow already has a cycle
+            if not self.allow_cycles and self._reaches(target, source):
+                raise CycleError("edge %s -> %s creates a cycle"
+                                 % (source, target))
+            return
+
+        lower, upper = order[target], order[source]
+        if lower > upper:
+            return
+
+        # vertices reached from target which are not after source
+        forward = set([target])
+        stack = [target]
+        while stack:
+            vid = stack.pop()
+            if vid == source:
+                if not self.allow_cycles:
+                    raise CycleError("edge %s -> %s creates a cycle"
+                                     % (source, target))
+                self._topo_order = None
+                self._topo_cyclic = True
+                return
+            for nvid in self.out_neighbors(vid):
+                if nvid not in forward and order[nvid] <= upper:
+                    forward.add(nvid)
+                    stack.append(nvid)
+
+        # vertices reaching source which are after target
+        backward = set([source])
+        stack = [source]
+        while stack:
+            vid = stack.pop()
+            for nvid in self.in_neighbors(vid):
+                if nvid not in backward and order[nvid] > lower:
+                    backward.add(nvid)
+                    stack.append(nvid)
+
+        # move the backward vertices before the forward ones, reusing
+        # their ranks
+        moved = (sorted(backward, key=order.__getitem__) +
+                 sorted(forward, key=order.__getitem__))
+        ranks = sorted(order[vid] for vid in moved)
+        for vid, rank in zip(moved, ranks):
+            order[vid] = rank
+
+    def _order_changed(self):
+        """ Edges or vertices have been removed: a cycle may be broken """
+        if self._topo_order is None:
+            self._topo_cyclic = False
 
     ####################################################
     #
@@ -258,6 +538,7 @@ class DataFlow(PropertyGraph):
         try : actor.set_id(vid)
         except Exception, e: print e
         self.vertex_property("_actor")[vid] = actor
+        self._topology_version += 1
 
     def actor(self, vid):
         """
@@ -299,7 +580,9 @@ class DataFlow(PropertyGraph):
         """
         pid = self._pid_generator.get_id(pid)
         self._ports[pid] = Port(vid, local_pid, False)
+        self._port_edges[pid] = set()
         self.vertex_property("_ports")[vid].add(pid)
+        self._topology_version += 1
         return pid
 
     def add_out_port(self, vid, local_pid, pid=None):
@@ -314,9 +597,31 @@ class DataFlow(PropertyGraph):
         """
         pid = self._pid_generator.get_id(pid)
         self._ports[pid] = Port(vid, local_pid, True)
+        self._port_edges[pid] = set()
         self.vertex_property("_ports")[vid].add(pid)
+        self._topology_version += 1
         return pid
 
+    def add_ports(self, ports):
+        """
+        add several ports at once
+
+        :param ports: iterable of (vid, local_pid, is_out_port)
+        :returns: the list of the pids used
+        :rtype: list of pid
+        """
+        get_id = self._pid_generator.get_id
+        vertex_ports = self.vertex_property("_ports")
+        pids = []
+        for vid, local_pid, is_out_port in ports:
+            pid = get_id()
+            self._ports[pid] = Port(vid, local_pid, is_out_port)
+            self._port_edges[pid] = set()
+            vertex_ports[vid].add(pid)
+            pids.append(pid)
+        self._topology_version += 1
+        return pids
+
     def remove_port(self, pid):
         """
         remove the specified port
@@ -327,6 +632,8 @@ class DataFlow(PropertyGraph):
         self.vertex_property("_ports")[self.vertex(pid)].remove(pid)
         self._pid_generator.release_id(pid)
         del self._ports[pid]
+        del self._port_edges[pid]
+        self._topology_version += 1
 
     def connect(self, source_pid, target_pid, eid=None):
         """
@@ -350,17 +657,73 @@ class DataFlow(PropertyGraph):
             self.vertex(target_pid)), eid)
         self.edge_property("_source_port")[eid] = source_pid
         self.edge_property("_target_port")[eid] = target_pid
+        self._port_edges[source_pid].add(eid)
+        self._port_edges[target_pid].add(eid)
+        self._topology_version += 1
 
         return eid
 
+    def connect_ports(self, connections):
+        """
+        connect several pairs of ports at once
+        (nothing is connected if one of them is not valid)
+
+        :param connections: iterable of (source_pid, target_pid)
+        :returns: the list of the eids used
+        :rtype: list of eid
+        """
+        connections = list(connections)
+        edges = []
+        for source_pid, target_pid in connections:
+            if not self.is_out_port(source_pid):
+                raise PortError("source_pid %s is not an output port" % \
+                    str(source_pid))
+            if not self.is_in_port(target_pid):
+                raise PortError("target_pid %s is not an input port" % \
+                    str(target_pid))
+            edges.append((self.vertex(source_pid), self.vertex(target_pid)))
+
+        eids = self.add_edges(edges)
+        source_port = self.edge_property("_source_port")
+        target_port = self.edge_property("_target_port")
+        port_edges = self._port_edges
+        for eid, (source_pid, target_pid) in zip(eids, connections):
+            source_port[eid] = source_pid
+            target_port[eid] = target_pid
+            port_edges[source_pid].add(eid)
+            port_edges[target_pid].add(eid)
+        self._topology_version += 1
+
+        return eids
+
     def add_vertex(self, vid=None):
         """todo"""
         vid = PropertyGraph.add_vertex(self, vid)
         self.vertex_property("_ports")[vid] = set()
+        order = self._topo_order
+        if order is not None:
+            order[vid] = self._topo_next
+            self._topo_next += 1
+        self._topology_version += 1
         return vid
 
     add_vertex.__doc__ = PropertyGraph.add_vertex.__doc__
 
+    def add_vertices(self, vids):
+        """todo"""
+        vids = PropertyGraph.add_vertices(self, vids)
+        vertex_ports = self.vertex_property("_ports")
+        order = self._topo_order
+        for vid in vids:
+            vertex_ports[vid] = set()
+            if order is not None:
+                order[vid] = self._topo_next
+                self._topo_next += 1
+        self._topology_version += 1
+        return vids
+
+    add_vertices.__doc__ = PropertyGraph.add_vertices.__doc__
+
     def remove_vertex(self, vid):
         """todo"""
         for pid in list(self.ports(vid)):
@@ -369,17 +732,91 @@ class DataFlow(PropertyGraph):
             except:
                 pass
         PropertyGraph.remove_vertex(self, vid)
+        if self._topo_order is not None:
+            del self._topo_order[vid]
+        self._topology_version += 1
 
     remove_vertex.__doc__ = PropertyGraph.remove_vertex.__doc__
 
+    def remove_edge(self, eid):
+        """todo"""
+        for pid in (self.edge_property("_source_port").get(eid),
+                    self.edge_property("_target_port").get(eid)):
+            edges = self._port_edges.get(pid)
+            if edges is not None:
+                edges.discard(eid)
+        PropertyGraph.remove_edge(self, eid)
+        self._order_changed()
+        self._topology_version += 1
+
+    remove_edge.__doc__ = PropertyGraph.remove_edge.__doc__
+
+    def add_edge(self, edge=(None, None), eid=None):
+        """todo"""
+        source, target = edge
+        if source in self and target in self:
+            self._order_edge(source, target)
+        return PropertyGraph.add_edge(self, edge, eid)
+
+    add_edge.__doc__ = PropertyGraph.add_edge.__doc__
+
+    def add_edges(self, edges):
+        """todo"""
+        edges = list(edges)
+        # nothing is added if a vertex is not valid
+        for edge in edges:
+            for vid in edge:
+                if vid not in self:
+                    raise InvalidVertex(vid)
+
+        if self._topological_order() is None:
+            # the dataflow already has a cycle: check the edges one by one
+            eids = []
+            try:
+                for edge in edges:
+                    eids.append(self.add_edge(edge))
+            except:
+                for eid in eids:
+                    PropertyGraph.remove_edge(self, eid)
+                raise
+            return eids
+
+        # compute the order again once all the edges are added
+        self._topo_order = None
+        self._topo_cyclic = False
+        eids = PropertyGraph.add_edges(self, edges)
+        if not self.allow_cycles and self._topological_order() is None:
+            for eid in eids:
+                PropertyGraph.remove_edge(self, eid)
+            self._order_changed()
+            raise CycleError("the edges create a cycle")
+        return eids
+
+    add_edges.__doc__ = PropertyGraph.add_edges.__doc__
+
     def clear(self):
         """todo"""
         self._ports.clear()
+        self._port_edges.clear()
         self._pid_generator = IdGenerator()
         PropertyGraph.clear(self)
+        self._topo_order = {}
+        self._topo_next = 0
+        self._topo_cyclic = False
+        self._topology_version += 1
 
     clear.__doc__ = PropertyGraph.clear.__doc__
 
+    def clear_edges(self):
+        """todo"""
+        for edges in self._port_edges.itervalues():
+            edges.clear()
+        PropertyGraph.clear_edges(self)
+        self._order_changed()
+        self._topology_version += 1
+
+    clear_edges.__doc__ = PropertyGraph.clear_edges.__doc__
+
     def get_all_parent_nodes(self, vid):
         """ Return an iterator of vextex id corresponding to all the
         parent node of vid"""
@@ -426,6 +863,24 @@ class SubDataflow(object):
         self.algo = algo
         self.node_id = node_id
         self.port_index = port_index
+        self._function = None
+
+    def get_function(self):
+        """ Return the compiled form of the SubDataflow.
+
+        Return None if the algorithm does not compile SubDataflows.
+        The function is compiled at the first call and recompiled
+        when the dataflow is modified.
+        """
+        compile_subdataflow = getattr(self.algo, 'compile_subdataflow', None)
+        if compile_subdataflow is None:
+            return None
+
+        function = self._function
+        if function is None or not function.is_valid():
+            function = compile_subdataflow(self.node_id, self.port_index)
+            self._function = function
+        return function
 
     def __call__(self, *args):
         """ Consider the Subdataflow as a function """
@@ -436,6 +891,10 @@ class SubDataflow(object):
             #if(len(args)==1): return args[0]
             #else: return args
 
+        function = self.get_function()
+        if function is not None:
+            return function(*args)
+
         self.algo.eval(self.node_id, list(args),is_subdataflow=True )
         ret = self.dataflow.actor(self.node_id).get_output(self.port_index)
         return ret
@@ -14,11 +14,20 @@
 #
 ###############################################################################
 """ This module provide algorithms to evaluate a dataflow
+
+Algorithms do not store the data of an evaluation, they are stored
+in a DataflowState. Several threads can evaluate the same dataflow
+with a shared algorithm, each one with its own state (e.g. a fork of
+a common state), as long as the dataflow and the actors are not
+modified by the evaluation.
 """
 
 __license__ = "Cecill-C"
 __revision__ = " $Id$ "
 
+from threading import Lock, local
+from weakref import WeakKeyDictionary
+
 
 # class EvaluationException(Exception):
 #
@@ -67,7 +76,18 @@ class BruteEvaluation(AbstractEvaluation):
     def __init__(self, dataflow):
         AbstractEvaluation.__init__(self, dataflow)
 
-        self._evaluated = set()
+        # evaluations of different threads are independent
+        self._local = local()
+
+    @property
+    def _evaluated(self):
+        """ Vertices evaluated by the current evaluation of this thread
+        """
+        try:
+            return self._local.evaluated
+        except AttributeError:
+            evaluated = self._local.evaluated = set()
+            return evaluated
 
     def clear(self):
         AbstractEvaluation.clear(self)
@@ -135,16 +155,113 @@ class BruteEvaluation(AbstractEvaluation):
             raise UserWarning("mismatch nb out port vs. function result")
 
 
-# class LazyEvaluation(BruteEvaluation):
-#     """ For each evaluation reevaluate a node of the dataflow
-#     only if its inputs have changed or if it is tagged
-#     as not lazy.
-#     """
-#     def __init__(self, dataflow):
-#         BruteEvaluation.__init__(self, dataflow)
-#
-#         self._modified = {}
-#
-#     def clear(self):
-#         BruteEvaluation.clear(self)
-#         self._modified.clear()
\ No newline at end of file
+class LazyEvaluation(BruteEvaluation):
+    """ For each evaluation reevaluate a node of the dataflow
+    only if its inputs have changed or if it is tagged
+    as not lazy.
+
+    Changes are read from the ports modified in the state
+    since the last evaluation. Since each evaluated node
+    modifies its outputs, only the downstream cone of
+    modified nodes is reevaluated.
+
+    The nodes not evaluated yet are recorded for each state.
+    A forked state starts from the record of its parent, so only
+    the nodes depending on the data set on the fork are evaluated.
+    """
+    def __init__(self, dataflow):
+        BruteEvaluation.__init__(self, dataflow)
+
+        # state -> (topology version, set of vertices not evaluated)
+        self._records = WeakKeyDictionary()
+        self._lock = Lock()
+
+    def clear(self):
+        BruteEvaluation.clear(self)
+        with self._lock:
+            self._records.clear()
+
+    def get_modified(self, state):
+        """ Return the set of vertices of the dataflow which have
+        not been evaluated with this state.
+
+        All the vertices if the topology of the dataflow changed
+        since the last evaluation.
+        """
+        version = self._dataflow.topology_version()
+        with self._lock:
+            record = self._records.get(state)
+            if record is None or record[0] != version:
+                parent = state.parent()
+                record = self._records.get(parent) if parent else None
+                if record is None or record[0] != version:
+                    modified = set(self._dataflow.vertices())
+                else:
+                    modified = set(record[1])
+                record = self._records[state] = (version, modified)
+
+        return record[1]
+
+    @property
+    def _modified(self):
+        """ Vertices not evaluated with the state of the current
+        evaluation of this thread """
+        return self._local.modified
+
+    def eval(self, env, state, vid=None):
+        self._local.modified = self.get_modified(state)
+        self._evaluated.clear()
+        try:
+            BruteEvaluation.eval(self, env, state, vid)
+            self._modified.difference_update(self._evaluated)
+        finally:
+            del self._local.modified
+        self.clear_changes(state)
+
+    def requires_evaluation(self, state, vid):
+        """ Test wether a node needs to be evaluated.
+
+        True if the node is not lazy, if one of its inputs
+        changed or if some of its outputs have not been computed.
+        """
+        df = self._dataflow
+
+        if vid in self._modified or not df.actor(vid).lazy:
+            return True
+
+        if any(state.is_changed(pid) for pid in df.in_ports(vid)):
+            return True
+
+        return not all(state.has_data(pid) for pid in df.out_ports(vid))
+
+    def eval_node(self, env, state, vid):
+        if self.requires_evaluation(state, vid):
+            BruteEvaluation.eval_node(self, env, state, vid)
+
+    def clear_changes(self, state):
+        """ Forget changes on ports that have been taken into
+        account by this evaluation.
+
+        Output ports are kept as changed as long as some nodes
+        downstream have not been evaluated.
+        """
+        df = self._dataflow
+        evaluated = self._evaluated
+
+        pids = []
+        for pid in state.changed_ports():
+            try:
+                is_in_port = df.is_in_port(pid)
+            except KeyError:  # port removed from the dataflow
+                pids.append(pid)
+                continue
+
+            if is_in_port:
+                vids = [df.vertex(pid)]
+            else:
+                vids = [df.vertex(npid) for npid in df.connected_ports(pid)]
+
+            if all(nid in evaluated for nid in vids):
+                pids.append(pid)
+
+        state.clear_changes(pids)
@@ -20,23 +20,56 @@ to store data exchanged between nodes of a dataflow.
 __license__ = "Cecill-C"
 __revision__ = " $Id$ "
 
+from openalea.core.algo.output_spill import get_output_spill
+
 
 class DataflowState(object):
     """ Store outputs of node and provide a way to access them
+
+    A state can be forked: the forked state shares the data of its
+    parent and stores its own data without modifying the parent.
+    Several threads can then evaluate the same dataflow, each one
+    with its own fork of a common evaluated state.
     """
-    def __init__(self, dataflow):
+    def __init__(self, dataflow, parent=None):
         """ constructor
 
         args:
             - dataflow (Dataflow)
+            - parent (DataflowState): state whose data are shared,
+                                      must not be modified anymore
         """
         self._dataflow = dataflow
+        self._parent = parent
         self._state = {}
+        self._changed = set()
+        # size of the large data kept in memory (not spilled), total
+        # and by port
+        self._resident_size = 0
+        self._resident = {}
+
+    def parent(self):
+        """ Return the state whose data are shared by this state (or None)
+        """
+        return self._parent
+
+    def fork(self):
+        """ Return a new state sharing the data of this one.
+
+        Data set on the new state are not visible from this state.
+        This state must not be modified while it has forks.
+        """
+        return DataflowState(self._dataflow, self)
 
     def clear(self):
         """Clear state
+
+        Data of the parent state are still visible.
         """
         self._state.clear()
+        self._changed.clear()
+        self._resident_size = 0
+        self._resident.clear()
 
     def reinit(self):
         """ Remove all data stored except for the one
@@ -53,6 +86,7 @@ class DataflowState(object):
 
         # resume state
         self._state.update(save)
+        self._changed.update(save)
 
     def is_ready_for_evaluation(self):
         """ Test wether the state contains enough information
@@ -62,22 +96,20 @@ class DataflowState(object):
         some data attached to it.
         """
         df = self._dataflow
-        state = self._state
 
-        return all([pid in state for pid in df.in_ports()
+        return all([self.has_data(pid) for pid in df.in_ports()
                     if df.nb_connections(pid) == 0])
 
     def is_valid(self):
         """ Test wether all data have been computed
         """
         df = self._dataflow
-        state = self._state
 
         if not self.is_ready_for_evaluation():
             return False
 
         # check that all nodes have been evaluated
-        if not all([pid in state for pid in df.out_ports()]):
+        if not all([self.has_data(pid) for pid in df.out_ports()]):
             return False
 
         return True
@@ -108,6 +140,22 @@ class DataflowState(object):
 
         return cmp(pid1, pid2)
 
+    def has_data(self, pid):
+        """ Test wether some data is stored on this port.
+
+        Do not look for data on ports connected to pid.
+
+        args:
+            - pid (pid): id of port either in or out
+        """
+        state = self
+        while state is not None:
+            if pid in state._state:
+                return True
+            state = state._parent
+
+        return False
+
     def get_data(self, pid):
         """ Retrieve data associated with a port.
 
@@ -120,29 +168,79 @@ class DataflowState(object):
             - pid (pid): id of port either in or out
         """
         df = self._dataflow
-        state = self._state
 
-        if pid in state:  # either out_port or lonely in_port
-            return state[pid]
-        elif df.is_out_port(pid):
+        state = self
+        while state is not None:
+            if pid in state._state:  # either out_port or lonely in_port
+                return state._state[pid]
+            state = state._parent
+
+        if df.is_out_port(pid):
             raise KeyError("value not set for this port")
         else:
-            npids = list(df.connected_ports(pid))
-            if len(npids) == 0:
+            parents = df.parent_ports(pid)
+            if len(parents) == 0:
                 raise KeyError("lonely in_port not set")
-            elif len(npids) == 1:
-                return self.get_data(npids[0])
+            elif len(parents) == 1:
+                return self.get_data(parents[0][0])
             else:
-                npids.sort(self.cmp_port_priority)
-                return [self.get_data(pid) for pid in npids]
+                return [self.get_data(npid) for npid, nvid, nactor, out_index
+                        in parents]
 
     def set_data(self, pid, data):
         """ Store data on a port.
 
-        This function does not test that the port is an output port
+        This function does not test that the port is an output port.
+        Large data are replaced by a view on a memory mapped file
+        if the output spill is enabled.
 
         args:
             - pid (pid): id of port
             - data (any)
         """
+        spill = get_output_spill()
+        if spill is not None:
+            # the previous data of the port is replaced
+            resident = self._resident_size - self._resident.pop(pid, 0)
+            data, self._resident_size = spill.store(data, resident)
+            if self._resident_size > resident:
+                self._resident[pid] = self._resident_size - resident
         self._state[pid] = data
+        self._changed.add(pid)
+
+    def is_changed(self, pid):
+        """ Test wether data on a port changed since the last call
+        to clear_changes.
+
+        if pid is an input port, also test all output ports
+        connected to it.
+
+        args:
+            - pid (pid): id of port either in or out
+        """
+        df = self._dataflow
+        changed = self._changed
+
+        if pid in changed:
+            return True
+        elif df.is_in_port(pid):
+            return any(npid in changed for npid in df.connected_ports(pid))
+        else:
+            return False
+
+    def changed_ports(self):
+        """ Iterate on all ports whose data changed since the last
+        call to clear_changes.
+        """
+        return iter(self._changed)
+
+    def clear_changes(self, pids=None):
+        """ Forget changes on some ports.
+
+        args:
+            - pids (list of pid): if None, forget all changes
+        """
+        if pids is None:
+            self._changed.clear()
+        else:
+            self._changed.difference_update(pids)
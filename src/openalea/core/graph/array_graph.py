@@ -0,0 +1,337 @@
+# -*- python -*-
+#
+#       OpenAlea.Core
+#
+#       Copyright 2006-2009 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.prada@cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+############################################################################
+"""This module provide a compact implementation of the graph interface
+for very large graphs.
+
+The topology is stored in arrays of integers indexed by the ids of the
+vertices and of the edges instead of python sets and tuples. The in and
+out edges of each vertex are linked lists threaded through the edge
+arrays, so edges are added and removed in constant time.
+"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+from array import array
+from itertools import compress, repeat
+
+from interface.graph import InvalidEdge, InvalidVertex, IGraph, \
+                    IVertexListGraph, IEdgeListGraph, \
+                    IMutableVertexGraph, IMutableEdgeGraph
+from graph import Graph
+from property_graph import PropertyGraph
+from id_generator import IdGenerator
+
+
+class ArrayGraph(Graph):
+    """Directed graph with multiple links stored in arrays:
+        - vertices are the heads of the linked lists of their in
+          and out edges
+        - edges are source, target and the next and previous edges
+          in the lists of their source and target
+    """
+
+    def __init__(self, graph=None):
+        """
+        if graph is not none make a copy of the topological structure of graph
+        (i.e. don't use the same id)
+
+        :param graph: the graph to copy, default=None
+        :type graph: Graph
+        """
+        self._init_vertices()
+        self._init_edges()
+        if graph is not None:
+            dummy = self.extend(graph)
+
+    def _init_vertices(self):
+        self._vid_generator = IdGenerator()
+        self._nb_vertices = 0
+        self._vused = bytearray()
+        self._first_in = array('i')
+        self._first_out = array('i')
+        self._nb_in = array('i')
+        self._nb_out = array('i')
+
+    def _init_edges(self):
+        self._eid_generator = IdGenerator()
+        self._nb_edges = 0
+        self._eused = bytearray()
+        self._source = array('i')
+        self._target = array('i')
+        self._next_in = array('i')
+        self._prev_in = array('i')
+        self._next_out = array('i')
+        self._prev_out = array('i')
+
+    def _resize_vertices(self, size):
+        """ Grow the vertex arrays to contain size vertices """
+        nb = size - len(self._vused)
+        if nb > 0:
+            self._vused.extend(repeat(0, nb))
+            self._first_in.extend(repeat(-1, nb))
+            self._first_out.extend(repeat(-1, nb))
+            self._nb_in.extend(repeat(0, nb))
+            self._nb_out.extend(repeat(0, nb))
+
+    def _resize_edges(self, size):
+        """ Grow the edge arrays to contain size edges """
+        nb = size - len(self._eused)
+        if nb > 0:
+            self._eused.extend(repeat(0, nb))
+            for arr in (self._source, self._target,
+                        self._next_in, self._prev_in,
+                        self._next_out, self._prev_out):
+                arr.extend(repeat(-1, nb))
+
+    # ##########################################################
+    #
+    # Graph concept
+    #
+    # ##########################################################
+
+    def source(self, eid):
+        if not self.has_edge(eid):
+            raise InvalidEdge(eid)
+        return self._source[eid]
+    source.__doc__=IGraph.source.__doc__
+
+    def target(self, eid):
+        if not self.has_edge(eid):
+            raise InvalidEdge(eid)
+        return self._target[eid]
+    target.__doc__=IGraph.target.__doc__
+
+    def has_vertex(self, vid):
+        try:
+            return 0 <= vid < len(self._vused) and self._vused[vid] == 1
+        except TypeError:
+            return False
+    has_vertex.__doc__=IGraph.has_vertex.__doc__
+
+    def has_edge(self, eid):
+        try:
+            return 0 <= eid < len(self._eused) and self._eused[eid] == 1
+        except TypeError:
+            return False
+    has_edge.__doc__=IGraph.has_edge.__doc__
+
+    # ##########################################################
+    #
+    # Vertex List Graph Concept
+    #
+    # ##########################################################
+
+    def vertices(self):
+        return compress(xrange(len(self._vused)), self._vused)
+    vertices.__doc__=IVertexListGraph.vertices.__doc__
+
+    def __iter__(self):
+        return self.vertices()
+    __iter__.__doc__=IVertexListGraph.__iter__.__doc__
+
+    def nb_vertices(self):
+        return self._nb_vertices
+    nb_vertices.__doc__=IVertexListGraph.nb_vertices.__doc__
+
+    def in_neighbors(self, vid):
+        source = self._source
+        return iter(set(source[eid] for eid in self.in_edges(vid)))
+    in_neighbors.__doc__=IVertexListGraph.in_neighbors.__doc__
+
+    def out_neighbors(self, vid):
+        target = self._target
+        return iter(set(target[eid] for eid in self.out_edges(vid)))
+    out_neighbors.__doc__=IVertexListGraph.out_neighbors.__doc__
+
+    # ##########################################################
+    #
+    # Edge List Graph Concept
+    #
+    # ##########################################################
+
+    def _iteredges(self, vid):
+        """
+        internal function that perform 'edges' with vid not None
+        """
+        for eid in self.in_edges(vid):
+            yield eid
+        for eid in self.out_edges(vid):
+            yield eid
+
+    def edges(self, vid=None):
+        if vid is None:
+            return compress(xrange(len(self._eused)), self._eused)
+        if vid not in self:
+            raise InvalidVertex(vid)
+        return self._iteredges(vid)
+    edges.__doc__ = IEdgeListGraph.edges.__doc__
+
+    def nb_edges(self, vid=None):
+        if vid is None:
+            return self._nb_edges
+        if vid not in self:
+            raise InvalidVertex(vid)
+        return self._nb_in[vid] + self._nb_out[vid]
+    nb_edges.__doc__ = IEdgeListGraph.nb_edges.__doc__
+
+    def in_edges(self, vid):
+        if vid not in self:
+            raise InvalidVertex(vid)
+        return self._iterlist(self._first_in[vid], self._next_in)
+    in_edges.__doc__=IEdgeListGraph.in_edges.__doc__
+
+    def out_edges(self, vid):
+        if vid not in self:
+            raise InvalidVertex(vid)
+        return self._iterlist(self._first_out[vid], self._next_out)
+    out_edges.__doc__=IEdgeListGraph.out_edges.__doc__
+
+    def _iterlist(self, eid, next):
+        """ Iterate on a linked list of edges """
+        while eid >= 0:
+            yield eid
+            eid = next[eid]
+
+    def nb_in_edges(self, vid):
+        if vid not in self:
+            raise InvalidVertex(vid)
+        return self._nb_in[vid]
+    nb_in_edges.__doc__=IEdgeListGraph.nb_in_edges.__doc__
+
+    def nb_out_edges(self, vid):
+        if vid not in self:
+            raise InvalidVertex(vid)
+        return self._nb_out[vid]
+    nb_out_edges.__doc__=IEdgeListGraph.nb_out_edges.__doc__
+
+    # ##########################################################
+    #
+    # Mutable Vertex Graph concept
+    #
+    # ##########################################################
+
+    def add_vertex(self, vid=None):
+        vid=self._vid_generator.get_id(vid)
+        self._resize_vertices(vid + 1)
+        self._vused[vid] = 1
+        self._nb_vertices += 1
+        return vid
+    add_vertex.__doc__=IMutableVertexGraph.add_vertex.__doc__
+
+    def add_vertices(self, vids):
+        return [ArrayGraph.add_vertex(self, vid) for vid in vids]
+    add_vertices.__doc__=Graph.add_vertices.__doc__
+
+    def remove_vertex(self, vid):
+        if vid not in self:
+            raise InvalidVertex(vid)
+        # a loop is both an in and an out edge
+        for edge in set(self._iteredges(vid)):
+            self.remove_edge(edge)
+        self._vused[vid] = 0
+        self._nb_vertices -= 1
+        self._vid_generator.release_id(vid)
+    remove_vertex.__doc__=IMutableVertexGraph.remove_vertex.__doc__
+
+    def clear(self):
+        self._init_vertices()
+        self._init_edges()
+    clear.__doc__=IMutableVertexGraph.clear.__doc__
+
+    # ##########################################################
+    #
+    # Mutable Edge Graph concept
+    #
+    # ##########################################################
+
+    def add_edge(self, edge=(None, None), eid=None):
+        vs, vt=edge
+        if vs not in self:
+            raise InvalidVertex(vs)
+        if vt not in self:
+            raise InvalidVertex(vt)
+        eid = self._eid_generator.get_id(eid)
+        self._resize_edges(eid + 1)
+        self._eused[eid] = 1
+        self._nb_edges += 1
+        self._source[eid] = vs
+        self._target[eid] = vt
+
+        # insert the edge at the head of the lists of its vertices
+        self._prev_out[eid] = -1
+        first = self._next_out[eid] = self._first_out[vs]
+        if first >= 0:
+            self._prev_out[first] = eid
+        self._first_out[vs] = eid
+        self._nb_out[vs] += 1
+
+        self._prev_in[eid] = -1
+        first = self._next_in[eid] = self._first_in[vt]
+        if first >= 0:
+            self._prev_in[first] = eid
+        self._first_in[vt] = eid
+        self._nb_in[vt] += 1
+        return eid
+    add_edge.__doc__=IMutableEdgeGraph.add_edge.__doc__
+
+    def add_edges(self, edges):
+        return [ArrayGraph.add_edge(self, edge) for edge in edges]
+    add_edges.__doc__=Graph.add_edges.__doc__
+
+    def remove_edge(self, eid):
+        if not self.has_edge(eid):
+            raise InvalidEdge(eid)
+        vs = self._source[eid]
+        prev, next = self._prev_out[eid], self._next_out[eid]
+        if prev >= 0:
+            self._next_out[prev] = next
+        else:
+            self._first_out[vs] = next
+        if next >= 0:
+            self._prev_out[next] = prev
+        self._nb_out[vs] -= 1
+
+        vt = self._target[eid]
+        prev, next = self._prev_in[eid], self._next_in[eid]
+        if prev >= 0:
+            self._next_in[prev] = next
+        else:
+            self._first_in[vt] = next
+        if next >= 0:
+            self._prev_in[next] = prev
+        self._nb_in[vt] -= 1
+
+        self._eused[eid] = 0
+        self._nb_edges -= 1
+        self._eid_generator.release_id(eid)
+    remove_edge.__doc__=IMutableEdgeGraph.remove_edge.__doc__
+
+    def clear_edges(self):
+        self._init_edges()
+        nb = len(self._vused)
+        self._first_in = array('i', repeat(-1, nb))
+        self._first_out = array('i', repeat(-1, nb))
+        self._nb_in = array('i', repeat(0, nb))
+        self._nb_out = array('i', repeat(0, nb))
+    clear_edges.__doc__=IMutableEdgeGraph.clear_edges.__doc__
+
+
+class ArrayPropertyGraph(PropertyGraph, ArrayGraph):
+    """
+    PropertyGraph storing its topology in arrays (see ArrayGraph)
+    """
+    pass
@@ -216,6 +216,22 @@ class Graph (IGraph,
         return vid
     add_vertex.__doc__=IMutableVertexGraph.add_vertex.__doc__
 
+    def add_vertices(self, vids):
+        """
+        add several vertices at once
+
+        :param vids: iterable of vertex ids (None to create a new id)
+        :returns: the list of the ids used
+        """
+        get_id=self._vid_generator.get_id
+        vertices=self._vertices
+        ret=[]
+        for vid in vids:
+            vid=get_id(vid)
+            vertices[vid]=(set(), set())
+            ret.append(vid)
+        return ret
+
     def remove_vertex(self, vid):
         if vid not in self:
             raise InvalidVertex(vid)
@@ -254,6 +270,28 @@ class Graph (IGraph,
         return eid
     add_edge.__doc__=IMutableEdgeGraph.add_edge.__doc__
 
+    def add_edges(self, edges):
+        """
+        add several edges at once
+
+        :param edges: iterable of (source, target)
+        :returns: the list of the eids used
+        """
+        get_id=self._eid_generator.get_id
+        vertices=self._vertices
+        ret=[]
+        for vs, vt in edges:
+            if vs not in vertices:
+                raise InvalidVertex(vs)
+            if vt not in vertices:
+                raise InvalidVertex(vt)
+            eid=get_id()
+            self._edges[eid]=(vs, vt)
+            vertices[vs][1].add(eid)
+            vertices[vt][0].add(eid)
+            ret.append(eid)
+        return ret
+
     def remove_edge(self, eid):
         if not self.has_edge(eid):
             raise InvalidEdge(eid)
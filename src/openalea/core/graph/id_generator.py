@@ -23,37 +23,88 @@ __license__= "Cecill-C"
 __revision__=" $Id$ "
 
 
+from bisect import bisect_right
+
+
 class IdGenerator(object):
+    """ Generator of unique ids.
+
+    Released ids are reused first, the last released first. The ids
+    skipped by get_id(id) are kept as ranges, so all the operations
+    are done in constant time (logarithmic in the number of ranges
+    for ids in a range).
+    """
 
     def __init__(self):
         self._id_max=0
-        self._id_list=[]
+        # free ids lower than _id_max, which are not in a range
+        self._free=set()
+        # stack of the released ids (may contain ids used since)
+        self._released=[]
+        # sorted list of the (start, stop) ranges of skipped ids
+        self._ranges=[]
+
+    def __setstate__(self, state):
+        """ Convert generators pickled with a list of free ids """
+        if '_id_list' in state:
+            id_list=state.pop('_id_list')
+            state['_free']=set(id_list)
+            state['_released']=list(id_list)
+            state['_ranges']=[]
+        self.__dict__.update(state)
+
+    def _find_range(self, id):
+        """ Return the index of the range containing id or -1 """
+        ranges=self._ranges
+        i=bisect_right(ranges, (id, id))-1
+        if i>=0 and ranges[i][0]<=id<ranges[i][1]:
+            return i
+        # (id, id) is sorted after (id, stop) if stop < id
+        i+=1
+        if i<len(ranges) and ranges[i][0]<=id<ranges[i][1]:
+            return i
+        return -1
 
     def get_id(self, id=None):
         if id is None:
-            if len(self._id_list)==0:
-                ret=self._id_max
-                self._id_max+=1
-                return ret
-            else:
-                return self._id_list.pop()
+            released=self._released
+            free=self._free
+            while released:
+                ret=released.pop()
+                if ret in free:
+                    free.remove(ret)
+                    return ret
+            if self._ranges:
+                start, stop=self._ranges.pop()
+                if stop-1>start:
+                    self._ranges.append((start, stop-1))
+                return stop-1
+            ret=self._id_max
+            self._id_max+=1
+            return ret
         else:
             if id>=self._id_max:
-                self._id_list.extend(range(self._id_max, id))
+                if id>self._id_max:
+                    self._ranges.append((self._id_max, id))
                 self._id_max=id+1
                 return id
+            elif id in self._free:
+                self._free.remove(id)
+                return id
             else:
-                try:
-                    ind=self._id_list.index(id)
-                    del self._id_list[ind]
-                    return id
-                except ValueError:
+                i=self._find_range(id)
+                if i<0:
                     raise IndexError("id %d already used" % id)
+                start, stop=self._ranges[i]
+                self._ranges[i:i+1]=[r for r in ((start, id), (id+1, stop))
+                                     if r[0]<r[1]]
+                return id
 
     def release_id(self, id):
         if id>self._id_max:
             raise IndexError("id out of range")
-        elif id in self._id_list:
+        elif id in self._free or self._find_range(id)>=0:
             raise IndexError("id already not used")
         else:
-            self._id_list.append(id)
+            self._free.add(id)
+            self._released.append(id)
@@ -31,7 +31,7 @@ class PropertyGraph(IPropertyGraph, Graph):
     def __init__(self, graph=None):
         self._vertex_property = {}
         self._edge_property = {}
-        Graph.__init__(self, graph)
+        super(PropertyGraph, self).__init__(graph)
     
     def vertex_property_names(self):
         """todo"""
@@ -99,7 +99,7 @@ class PropertyGraph(IPropertyGraph, Graph):
         """todo"""
         for prop in self._vertex_property.itervalues():
             prop.pop(vid, None)
-        Graph.remove_vertex(self, vid)
+        super(PropertyGraph, self).remove_vertex(vid)
     remove_vertex.__doc__ = Graph.remove_vertex.__doc__
     
     def clear(self):
@@ -108,26 +108,26 @@ class PropertyGraph(IPropertyGraph, Graph):
             prop.clear()
         for prop in self._edge_property.itervalues():
             prop.clear()
-        Graph.clear(self)
+        super(PropertyGraph, self).clear()
     clear.__doc__ = Graph.clear.__doc__
     
     def remove_edge(self, eid):
         """todo"""
         for prop in self._edge_property.itervalues():
             prop.pop(eid, None)
-        Graph.remove_edge(self, eid)
+        super(PropertyGraph, self).remove_edge(eid)
     remove_edge.__doc__ = Graph.remove_edge.__doc__
     
     def clear_edges(self):
         """todo"""
         for prop in self._edge_property.itervalues():
             prop.clear()
-        Graph.clear_edges(self)
+        super(PropertyGraph, self).clear_edges()
     clear_edges.__doc__ = Graph.clear_edges.__doc__
     
     def extend(self, graph):
         """todo"""
-        trans_vid, trans_eid = Graph.extend(self,graph)
+        trans_vid, trans_eid = super(PropertyGraph, self).extend(graph)
         #mise a jour des proprietes sur les vertices
         for prop_name in graph.vertex_property_names():
             if prop_name not in self._vertex_property:
@@ -112,6 +112,8 @@ class IInterface(object):
     __metaclass__ = IInterfaceMetaClass
     __pytype__ = None
     __color__ = None
+    # ChangeDetector (or its name) of the ports with this interface
+    __change_detector__ = None
 
     @classmethod
     def default(cls):
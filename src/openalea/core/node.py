@@ -32,6 +32,7 @@ import string
 import types
 from copy import copy, deepcopy
 from weakref import ref, proxy
+from threading import Lock, local
 
 # from signature import get_parameters
 import signature as sgn
@@ -39,6 +40,7 @@ from observer import Observed, AbstractListener
 from actor import IActor
 from metadatadict import MetaDataDict, HasAdHoc
 from interface import TypeNameInterfaceMap
+from change_detection import get_change_detector, default_change_detector
 # Exceptions
 class RecursionError (Exception):
     """todo"""
@@ -50,6 +52,110 @@ class InstantiationError(Exception):
     pass
 
 
+##################
+# Headless mode  #
+##################
+
+# Context recording the notifications of the nodes, by thread
+# (context attribute, None: notify)
+_headless = local()
+
+
+class headless(object):
+    """ Context manager in which the nodes do not notify their listeners
+    in the current thread (and in the worker threads of the evaluations
+    started in the context).
+
+    It is used to evaluate dataflows without a GUI (batch, server).
+    The notifications of each node are recorded and coalesced, only the
+    last event of each kind (event name and key or index) is kept.
+    When leaving the context, each node having listeners sends one event
+    ('notifications_coalesced', events) with the list of kept events.
+
+    Contexts can be nested, the events are sent by the outermost one::
+
+        with headless():
+            cnode.eval_as_expression()
+    """
+
+    def __init__(self, summary=True):
+        """
+        :param summary: if False, notifications are dropped
+        """
+        self.summary = summary
+        # id of node -> (node, list of events, dict key -> index in list)
+        self._events = {}
+        self._lock = Lock()
+        self._outer = False
+
+    def __enter__(self):
+        if headless_context() is None:
+            _headless.context = self
+            self._outer = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self._outer:
+            return False
+        _headless.context = None
+        self._outer = False
+        self.send_summary()
+        return False
+
+    def record(self, node, event):
+        """ Record a notification of node """
+        if not self.summary or not node.listeners:
+            return
+        if isinstance(event, tuple):
+            key = event[:2]
+        else:
+            key = event
+
+        with self._lock:
+            record = self._events.get(id(node))
+            if record is None:
+                record = self._events[id(node)] = (node, [], {})
+            node, events, keys = record
+            index = keys.get(key)
+            if index is None:
+                keys[key] = len(events)
+                events.append(event)
+            else:
+                events[index] = event
+
+    def send_summary(self):
+        """ Send the coalesced notifications of each node """
+        with self._lock:
+            records = self._events.values()
+            self._events = {}
+        for node, events, keys in records:
+            Observed.notify_listeners(node,
+                                      ('notifications_coalesced', events))
+
+
+def headless_context():
+    """ Return the headless context of the current thread
+    (None if the nodes notify their listeners) """
+    return getattr(_headless, 'context', None)
+
+
+def set_headless_context(context):
+    """ Use a headless context (or None) in the current thread, e.g. the
+    context of the thread starting an evaluation in its workers.
+
+    :returns: the previous context of the thread
+    """
+    previous = headless_context()
+    _headless.context = context
+    return previous
+
+
+def is_headless():
+    """ Return True if the notifications of the nodes are turned off
+    in the current thread """
+    return headless_context() is not None
+
+
 ########################
 # Node related classes #
 ########################
@@ -255,6 +361,9 @@ class Node(AbstractNode):
     Inputs and Outpus are indexed by their position or by a name (str)
     """
 
+    # internal attributes saved in simulation checkpoints
+    __checkpoint_attributes__ = ()
+
     @staticmethod
     def is_deprecated_event(event):
         evLen = len(event)
@@ -306,6 +415,11 @@ class Node(AbstractNode):
         self.continuous_eval = Observed()
 
     def notify_listeners(self, event):
+        context = headless_context()
+        if context is not None:
+            context.record(self, event)
+            return
+
         txt, trevent = Node.is_deprecated_event(event)
         if txt:
             Observed.notify_listeners(self, trevent)
@@ -404,6 +518,18 @@ class Node(AbstractNode):
 
     user_application = property(get_user_application, set_user_application)
 
+    def get_side_effect_free(self):
+        """todo"""
+        return self.internal_data.get("side_effect_free", False)
+
+    def set_side_effect_free(self, data):
+        """todo"""
+        self.internal_data["side_effect_free"] = data
+        self.notify_listeners(("internal_data_changed", "side_effect_free", data))
+
+    # The outputs only depend on the inputs (the node can be run elsewhere)
+    side_effect_free = property(get_side_effect_free, set_side_effect_free)
+
     def set_caption(self, newcaption):
         """ Define the node caption """
         self.internal_data['caption'] = newcaption
@@ -497,6 +623,8 @@ class Node(AbstractNode):
         self.map_index_in = {}
         # Input states : "connected", "hidden"
         self.input_states = []
+        # index -> (id of the input, detector, signature)
+        self._input_signatures = {}
         self.notify_listeners(("cleared_input_ports",))
 
     def clear_outputs(self):
@@ -577,15 +705,50 @@ class Node(AbstractNode):
         changed = True
         if(self.lazy):
             # Test if the inputs has changed
-            try:
-                changed = (cmp(self.inputs[index], val) != 0)
-            except:
-                pass
+            changed = self.input_changed(index, val)
 
         if(changed):
             self.inputs[index] = val
             self.unvalidate_input(index, notify)
 
+    def get_change_detector(self, index, val=None):
+        """ Return the ChangeDetector of the input index: given by the
+        port description, by its interface or by the type of val """
+        port = self.input_desc[index]
+        detector = port.get('change_detector')
+        if detector is None:
+            interface = port.get_interface()
+            detector = getattr(interface, '__change_detector__', None)
+        if detector is None:
+            return default_change_detector(val)
+        return get_change_detector(detector)
+
+    def input_changed(self, index, val):
+        """ Return True if val differs from the value of the input index """
+        old = self.inputs[index]
+        try:
+            detector = self.get_change_detector(index, val)
+            signature = detector.signature(val)
+
+            if not detector.cached:
+                return detector.changed(detector.signature(old), signature)
+
+            # signature of the input when it has been set
+            cached = self._input_signatures.get(index)
+            if cached is not None and cached[0] == id(old):
+                if cached[1] is not detector:
+                    changed = True
+                else:
+                    changed = detector.changed(cached[2], signature)
+            else:
+                changed = detector.changed(detector.signature(old), signature)
+        except Exception:
+            return True
+
+        if changed:
+            self._input_signatures[index] = (id(val), detector, signature)
+        return changed
+
     def set_output(self, key, val):
         """
         Define the input value for the specified index/key
@@ -629,24 +792,48 @@ class Node(AbstractNode):
 
     # Functions used by the node evaluator
 
-    def eval(self):
+    def eval(self, call=None):
         """
         Evaluate the node by calling __call__
         Return True if the node needs a reevaluation
         and a timed delay if the node needs a reevaluation at a later time.
+
+        :param call: function to use instead of __call__ to compute
+            the outputs from the inputs (e.g. to run the node in another
+            process).
         """
-        # lazy evaluation
-        if self.block and self.get_nb_output() != 0 and self.output(0) is not None:
-            return False
-        if (self.delay == 0 and self.lazy) and not self.modified:
+        if self.skip_eval():
             return False
 
         self.notify_listeners(("start_eval",))
 
         # Run the node
-        outlist = self.__call__(self.inputs)
+        if call is None:
+            call = self.__call__
+        outlist = call(self.inputs)
 
-        # Copy outputs
+        self.store_outputs(outlist)
+
+        # Set State
+        self.modified = False
+        self.notify_listeners(("stop_eval",))
+
+        if self.delay == 0:
+            return False
+        return self.delay
+
+    def skip_eval(self):
+        """ Return True if eval does not need to call the node
+        (blocked or lazy node not modified) """
+        # lazy evaluation
+        if self.block and self.get_nb_output() != 0 and self.output(0) is not None:
+            return True
+        if (self.delay == 0 and self.lazy) and not self.modified:
+            return True
+        return False
+
+    def store_outputs(self, outlist):
+        """ Copy the result of __call__ into the outputs """
         # only one output
         if len(self.outputs) == 1:
             try:
@@ -657,7 +844,8 @@ class Node(AbstractNode):
             except TypeError:
                 self.outputs[0] = outlist
 
-            self.output_desc[0].notify_listeners(("tooltip_modified",))
+            if headless_context() is None:
+                self.output_desc[0].notify_listeners(("tooltip_modified",))
 
         else: # multi output
             if(not isinstance(outlist, tuple) and
@@ -665,17 +853,10 @@ class Node(AbstractNode):
                 outlist = (outlist,)
 
             for i in range(min(len(outlist), len(self.outputs))):
-                self.output_desc[i].notify_listeners(("tooltip_modified",))
+                if headless_context() is None:
+                    self.output_desc[i].notify_listeners(("tooltip_modified",))
                 self.outputs[i] = outlist[i]
 
-        # Set State
-        self.modified = False
-        self.notify_listeners(("stop_eval",))
-
-        if self.delay == 0:
-            return False
-        return self.delay
-
     def __getstate__(self):
         """ Pickle function : remove not saved data"""
 
@@ -750,6 +931,27 @@ class Node(AbstractNode):
         if(i > 0):
             self.invalidate()
 
+    def checkpoint_state(self):
+        """ Return the state of the node saved in the checkpoints of a
+        simulation: the inputs, outputs and internal attributes listed
+        in __checkpoint_attributes__ """
+        state = dict(inputs=list(self.inputs), outputs=list(self.outputs))
+        for name in self.__checkpoint_attributes__:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def restore_checkpoint_state(self, state):
+        """ Restore a state returned by checkpoint_state """
+        for i, value in enumerate(state['inputs'][:len(self.inputs)]):
+            self.inputs[i] = value
+        for i, value in enumerate(state['outputs'][:len(self.outputs)]):
+            self.outputs[i] = value
+        for name in self.__checkpoint_attributes__:
+            if name in state:
+                setattr(self, name, state[name])
+        self.modified = False
+
     def invalidate(self):
         """ Invalidate node """
 
@@ -816,6 +1018,7 @@ class AbstractFactory(Observed):
                  view=None,
                  alias=None,
                  authors=None,
+                 side_effect_free=False,
                  **kargs):
         """
         Create a factory.
@@ -829,6 +1032,8 @@ class AbstractFactory(Observed):
         :param view: custom view (default = None)
         :param alias: list of alias name
         :param authors: authors of the node. If Node, it should be replaced by the package authors.
+        :param side_effect_free: the node outputs only depend on its inputs
+            (default = False)
 
         .. note:: inputs and outputs parameters are list of dictionnary such
 
@@ -853,6 +1058,7 @@ class AbstractFactory(Observed):
         self.delay = delay
         self.alias = alias
         self.authors = authors
+        self.side_effect_free = side_effect_free
     # Package property
 
     def set_pkg(self, port):
@@ -1171,6 +1377,8 @@ class NodeFactory(AbstractFactory):
                 node.set_caption(self.name)
 
             node.delay = self.delay
+            if getattr(self, 'side_effect_free', False):
+                node.side_effect_free = True
         except:
             pass
 
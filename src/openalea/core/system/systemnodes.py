@@ -50,13 +50,42 @@ class IterNode(Node):
 
         Node.__init__(self, *args)
         self.iterable = "Empty"
+        # number of items read from the iterator
+        self.position = 0
 
     def reset(self):
         """ Reset to the intial state """
         self.iterable = "Empty"
+        self.position = 0
         if hasattr(self, 'nextval'):
             del self.nextval
 
+    def next_item(self):
+        """ Return the next item of the iterator """
+        item = self.iterable.next()
+        self.position = getattr(self, 'position', 0) + 1
+        return item
+
+    def checkpoint_state(self):
+        """ Save the position of the iterator instead of the iterator """
+        state = Node.checkpoint_state(self)
+        if self.iterable != "Empty":
+            state['position'] = self.position
+            if hasattr(self, 'nextval'):
+                state['nextval'] = self.nextval
+        return state
+
+    def restore_checkpoint_state(self, state):
+        """ Iterate again on the input up to the saved position """
+        Node.restore_checkpoint_state(self, state)
+        self.reset()
+        if 'position' in state:
+            self.iterable = iter(self.inputs[0])
+            for i in xrange(state['position']):
+                self.next_item()
+            if 'nextval' in state:
+                self.nextval = state['nextval']
+
     def eval(self):
         """
         Return True if the node need a reevaluation
@@ -64,13 +93,14 @@ class IterNode(Node):
         try:
             if self.iterable == "Empty":
                 self.iterable = iter(self.inputs[0])
+                self.position = 0
 
             if(hasattr(self, "nextval")):
                 self.outputs[0] = self.nextval
             else:
-                self.outputs[0] = self.iterable.next()
+                self.outputs[0] = self.next_item()
 
-            self.nextval = self.iterable.next()
+            self.nextval = self.next_item()
             return True
 
         except TypeError, e:
@@ -94,13 +124,14 @@ class IterWithDelayNode(IterNode):
         try:
             if self.iterable == "Empty":
                 self.iterable = iter(self.inputs[0])
+                self.position = 0
 
             if(hasattr(self, "nextval")):
                 self.outputs[0] = self.nextval
             else:
-                self.outputs[0] = self.iterable.next()
+                self.outputs[0] = self.next_item()
 
-            self.nextval = self.iterable.next()
+            self.nextval = self.next_item()
             return self.inputs[1]
 
         except TypeError, e:
@@ -117,6 +148,8 @@ class IterWithDelayNode(IterNode):
 class StopSimulation(Node):
     """ Iteration Node """
 
+    __checkpoint_attributes__ = ('_nb_cycles',)
+
     def __init__(self, *args):
         """ Constructor """
 
@@ -142,6 +175,8 @@ class StopSimulation(Node):
 class Counter(Node):
     """ Loop a number of cycle, then stop """
 
+    __checkpoint_attributes__ = ('_current_cycle',)
+
     def __init__(self, *args):
         """ Constructor """
 
@@ -266,6 +301,8 @@ class InitNode(Node):
     If state is true, return In0, else return In1
     state is set to false in the first execution.
     """
+
+    __checkpoint_attributes__ = ('state',)
     def __init__(self, inputs, outputs):
 
         Node.__init__(self, inputs, outputs)
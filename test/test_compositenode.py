@@ -325,3 +325,70 @@ class TestClass:
         sg()
         res = sg.get_output(0)
         assert ''.join(eval(res)) == "toto"
+
+
+def test_bulk_construction():
+    """ add and connect several nodes at once """
+    from openalea.core.node import FuncNode
+    from openalea.core.observer import AbstractListener
+
+    class Recorder(AbstractListener):
+        def __init__(self):
+            AbstractListener.__init__(self)
+            self.events = []
+
+        def notify(self, sender, event=None):
+            self.events.append(event[0])
+
+    def desc(*names):
+        return tuple(dict(name=name) for name in names)
+
+    sg = CompositeNode(desc('x'), desc('y'))
+    recorder = Recorder()
+    sg.register_listener(recorder)
+
+    nodes = [FuncNode(desc('a', 'b'), desc('out'), max) for i in range(3)]
+    vids = sg.add_nodes([(nodes[0], None), (nodes[1], 10), (nodes[2], None)])
+    assert vids[1] == 10
+    assert [sg.node(vid) for vid in vids] == nodes
+    assert [len(list(sg.ports(vid))) for vid in vids] == [3, 3, 3]
+    assert recorder.events == ['vertex_added'] * 3 + ['graph_modified']
+
+    del recorder.events[:]
+    eids = sg.connect_nodes([(sg.id_in, 0, vids[0], 0),
+                             (vids[0], 0, vids[1], 1),
+                             (vids[0], 5, vids[2], 0),
+                             (vids[1], 0, sg.id_out, 0)])
+    assert eids[2] is None
+    assert sg.nb_edges() == 3
+    assert sg.source_port(eids[1]) == sg.out_port(vids[0], 0)
+    assert sg.node(vids[1]).input_states[1] == "connected"
+    assert recorder.events == ['connection_modified'] + ['edge_added'] * 3
+
+    sg.set_input(0, 3)
+    nodes[0].set_input(1, 1)
+    nodes[1].set_input(0, 2)
+    sg()
+    assert sg.get_output(0) == 3
+
+    # same graph as one by one
+    d = {}
+    execfile(pj(test_dir(), 'catalog.py'), globals(), d)
+    pm = PackageManager()
+    pm.add_package(d['pkg'])
+    sg = CompositeNode()
+    addid = sg.add_node(d['pkg']['plus'].instantiate())
+    val1id = sg.add_node(d['pkg']['float'].instantiate())
+    val2id = sg.add_node(d['pkg']['float'].instantiate())
+    sg.connect(val1id, 0, addid, 0)
+    sg.connect(val2id, 0, addid, 1)
+    sgfactory = CompositeNodeFactory("addition")
+    sg.to_factory(sgfactory)
+    sg2 = sgfactory.instantiate()
+    assert sorted(sg2.vertices()) == sorted(sg.vertices())
+    assert sorted(sg2._ports) == sorted(sg._ports)
+    assert (sorted((sg2.source_port(eid), sg2.target_port(eid))
+                   for eid in sg2.edges()) ==
+            sorted((sg.source_port(eid), sg.target_port(eid))
+                   for eid in sg.edges()))
+    assert not sg2.graph_modified
@@ -56,3 +56,171 @@ def test_dataflow():
     except PortError:
         test=True
     assert test
+
+
+def test_port_edges():
+    """ test the index of the edges connected to the ports """
+    import cPickle
+
+    df = DataFlow()
+    vid = df.add_vertex()
+    pin = df.add_in_port(vid, "in")
+    pout = df.add_out_port(vid, "out")
+    sources = []
+    for i in range(5):
+        v = df.add_vertex()
+        sources.append(df.add_out_port(v, "out"))
+    eids = [df.connect(pid, pin) for pid in sources]
+
+    assert df.nb_connections(pin) == 5
+    assert set(df.connected_ports(pin)) == set(sources)
+    assert df.nb_connections(pout) == 0
+    assert list(df.connected_edges(sources[0])) == [eids[0]]
+
+    # edges can be removed while iterating
+    for eid in df.connected_edges(pin):
+        if df.source_port(eid) in sources[:2]:
+            df.remove_edge(eid)
+    assert df.nb_connections(pin) == 3
+    assert df.nb_connections(sources[0]) == 0
+
+    df.remove_vertex(df.vertex(sources[2]))
+    assert set(df.connected_ports(pin)) == set(sources[3:])
+
+    # dataflows pickled without the index
+    state = df.__getstate__()
+    del state['_port_edges']
+    df2 = DataFlow.__new__(DataFlow)
+    df2.__setstate__(cPickle.loads(cPickle.dumps(state)))
+    assert set(df2.connected_ports(pin)) == set(sources[3:])
+
+    # and without the versions and the parent index
+    for key in ('_topology_version', '_position_version', '_parents',
+                '_parents_version', '_position_listener'):
+        del state[key]
+    df2 = DataFlow.__new__(DataFlow)
+    df2.__setstate__(cPickle.loads(cPickle.dumps(state)))
+    assert len(df2.parent_ports(pin)) == 2
+    vid = df2.add_vertex()
+    df2.connect(df2.add_out_port(vid, "out"), pin)
+    assert len(df2.parent_ports(pin)) == 3
+
+    df.remove_port(pin)
+    assert df.nb_connections(sources[3]) == 0
+
+
+def test_bulk_construction():
+    """ test the creation of several vertices, ports and edges at once """
+    df = DataFlow()
+    vids = df.add_vertices([None, 5, None])
+    assert vids[1] == 5 and len(set(vids)) == 3
+    pids = df.add_ports([(vids[0], "out", True),
+                         (vids[1], "in", False),
+                         (vids[1], "out", True),
+                         (vids[2], "in", False)])
+    assert df.out_port(vids[1], "out") == pids[2]
+    assert df.in_port(vids[2], "in") == pids[3]
+
+    eids = df.connect_ports([(pids[0], pids[1]), (pids[2], pids[3])])
+    assert df.source_port(eids[1]) == pids[2]
+    assert set(df.connected_ports(pids[1])) == set([pids[0]])
+    assert set(df.out_neighbors(vids[1])) == set([vids[2]])
+
+    # nothing is connected if one connection is not valid
+    try:
+        df.connect_ports([(pids[0], pids[3]), (pids[1], pids[3])])
+        assert False
+    except PortError:
+        pass
+    assert df.nb_edges() == 2
+
+
+def check_order(df):
+    for eid in df.edges():
+        assert (df.topological_index(df.source(eid)) <
+                df.topological_index(df.target(eid)))
+
+
+def test_topological_order():
+    """ test the incremental topological order and the cycle detection """
+    import random
+    import cPickle
+    from openalea.core.dataflow import CycleError
+
+    rnd = random.Random(0)
+    df = DataFlow()
+    df.allow_cycles = False
+    vids = []
+    for i in range(30):
+        vid = df.add_vertex()
+        vids.append((vid, df.add_in_port(vid, "in"),
+                     df.add_out_port(vid, "out")))
+
+    nb_rejected = 0
+    for i in range(150):
+        (v1, in1, out1), (v2, in2, out2) = rnd.sample(vids, 2)
+        try:
+            df.connect(out1, in2)
+        except CycleError:
+            nb_rejected += 1
+        check_order(df)
+    assert nb_rejected > 0
+    assert df.is_acyclic()
+    assert df.nb_edges() == 150 - nb_rejected
+
+    # self loop
+    try:
+        df.connect(vids[0][2], vids[0][1])
+        assert False
+    except CycleError:
+        pass
+
+    order = df.topological_order()
+    assert len(order) == 30
+    assert [df.topological_index(vid) for vid in order] == \
+           sorted(df.topological_index(vid) for vid in order)
+
+    # a batch of connections closing a cycle is rejected
+    (v1, in1, out1), (v2, in2, out2) = vids[:2]
+    nb = df.nb_edges()
+    try:
+        df.connect_ports([(out1, in2), (out2, in1)])
+        assert False
+    except CycleError:
+        pass
+    assert df.nb_edges() == nb
+    assert df.is_acyclic()
+
+    df2 = cPickle.loads(cPickle.dumps(df))
+    check_order(df2)
+
+    # cycles are allowed by default
+    df = DataFlow()
+    a, b = df.add_vertex(), df.add_vertex()
+    pa, pb = df.add_out_port(a, "out"), df.add_out_port(b, "out")
+    ia, ib = df.add_in_port(a, "in"), df.add_in_port(b, "in")
+    df.connect(pa, ib)
+    assert df.topological_index(a) < df.topological_index(b)
+    eid = df.connect(pb, ia)
+    assert not df.is_acyclic()
+    assert df.topological_index(a) is None
+    assert df.topological_order() is None
+    df.remove_edge(eid)
+    assert df.is_acyclic()
+    assert df.topological_order() == [a, b]
+
+
+def test_add_edges_invalid_vertex():
+    """ no edge is added if a vertex of the batch is not valid """
+    from openalea.core.graph.interface.graph import InvalidVertex
+
+    df = DataFlow()
+    a, b = df.add_vertex(), df.add_vertex()
+    df.connect(df.add_out_port(a, "out"), df.add_in_port(b, "in"))
+    try:
+        df.add_edges([(b, a), (a, 99)])
+        assert False
+    except InvalidVertex:
+        pass
+    assert df.nb_edges() == 1
+    assert df.topological_order() == [a, b]
@@ -0,0 +1,170 @@
+"""Dataflow compiler tests"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import os
+import imp
+import tempfile
+
+from openalea.core.compositenode import CompositeNode
+from openalea.core.node import Node, FuncNode
+from openalea.core.algo.dataflow_compiler import (compile_dataflow,
+                                                  write_module,
+                                                  DataflowCompiler,
+                                                  CompilationError)
+from openalea.core.system.systemnodes import IterNode
+
+
+def add(a, b):
+    return a + b
+
+
+def divmod_(a, b):
+    return divmod(a, b)
+
+
+class Negate(Node):
+
+    def __call__(self, inputs):
+        return -inputs[0],
+
+
+class Shift(Node):
+
+    def __init__(self):
+        Node.__init__(self, (dict(name='x'),), (dict(name='y'),))
+        self.offset = 0
+
+    def __call__(self, inputs):
+        return inputs[0] + self.offset,
+
+
+def composite(calls):
+    """ (a, b) -> (-(a + b) * 10, a // b, a % b) with a nested composite
+    node computing the sum """
+    inner = CompositeNode((dict(name='x'), dict(name='y')),
+                          (dict(name='s'),))
+    vid = inner.add_node(FuncNode((dict(name='a'), dict(name='b')),
+                                  (dict(name='out'),), add))
+    inner.connect(inner.id_in, 0, vid, 0)
+    inner.connect(inner.id_in, 1, vid, 1)
+    inner.connect(vid, 0, inner.id_out, 0)
+
+    def scale(x, factor):
+        calls.append(x)
+        return x * factor
+
+    df = CompositeNode((dict(name='a'), dict(name='b', value=3)),
+                       (dict(name='r'), dict(name='q'), dict(name='m')))
+    df.set_input(1, 3)
+    sub = df.add_node(inner)
+    neg = df.add_node(Negate((dict(name='x'),), (dict(name='y'),)))
+    mul = df.add_node(FuncNode((dict(name='x'), dict(name='factor')),
+                               (dict(name='out'),), scale))
+    df.node(mul).set_input(1, 10)
+    dm = df.add_node(FuncNode((dict(name='a'), dict(name='b')),
+                              (dict(name='q'), dict(name='m')), divmod_))
+    df.connect(df.id_in, 0, sub, 0)
+    df.connect(df.id_in, 1, sub, 1)
+    df.connect(sub, 0, neg, 0)
+    df.connect(neg, 0, mul, 0)
+    df.connect(mul, 0, df.id_out, 0)
+    df.connect(df.id_in, 0, dm, 0)
+    df.connect(df.id_in, 1, dm, 1)
+    df.connect(dm, 0, df.id_out, 1)
+    df.connect(dm, 1, df.id_out, 2)
+    return df
+
+
+def test_compile_dataflow():
+    calls = []
+    df = composite(calls)
+    f = compile_dataflow(df, name='compute')
+    assert f(7, 2) == (-90, 3, 1)
+    # default values are the current inputs of the composite node
+    assert f(7) == (-100, 2, 1)
+    assert calls == [-9, -10]
+
+    # same results as the evaluation of the composite node
+    df.set_input(0, 7)
+    df.set_input(1, 2)
+    df.eval()
+    assert [df.get_output(i) for i in range(3)] == [-90, 3, 1]
+
+    # missing outputs keep their previous value
+    df = CompositeNode((dict(name='a'),), (dict(name='x'), dict(name='y')))
+    vid = df.add_node(FuncNode((dict(name='a'),),
+                               (dict(name='x'), dict(name='y')), abs))
+    df.connect(df.id_in, 0, vid, 0)
+    df.connect(vid, 0, df.id_out, 0)
+    df.connect(vid, 1, df.id_out, 1)
+    df.node(vid).outputs[1] = 'y'
+    assert compile_dataflow(df)(-2) == (2, 'y')
+    df.set_input(0, -2)
+    df.eval()
+    assert [df.get_output(i) for i in range(2)] == [2, 'y']
+
+
+def test_compile_dataflow_module():
+    df = composite([])
+    compiler = DataflowCompiler(df, name='compute')
+    compiler.eval()
+    # the node is bound, not instantiated
+    assert [v for v in compiler.get_namespace().values()
+            if isinstance(v, Negate)]
+    compiler.instantiate_nodes = True
+    source = compiler.eval()
+    assert 'import add' in source and 'import Negate' in source
+    assert 'compositenode' not in source
+
+    # the local function scale can not be imported
+    fn = tempfile.mktemp(suffix='.py')
+    try:
+        write_module(df, fn)
+        assert False
+    except CompilationError:
+        assert not os.path.exists(fn)
+
+    mul = [vid for vid in df.vertices()
+           if getattr(df.actor(vid), 'func', None) not in (None, add,
+                                                           divmod_)][0]
+    df.actor(mul).func = add
+    name = write_module(df, fn, name='compute')
+    try:
+        module = imp.load_source('compiled_dataflow', fn)
+        assert getattr(module, name)(7, 2) == (1, 3, 1)
+    finally:
+        for f in (fn, fn + 'c'):
+            if os.path.exists(f):
+                os.remove(f)
+
+
+def test_compile_dataflow_node_state():
+    """ Nodes with their own constructor and state are bound """
+    df = CompositeNode((dict(name='x'),), (dict(name='y'),))
+    node = Shift()
+    node.offset = 5
+    vid = df.add_node(node)
+    df.connect(df.id_in, 0, vid, 0)
+    df.connect(vid, 0, df.id_out, 0)
+    assert compile_dataflow(df)(1) == 6
+
+    fn = tempfile.mktemp(suffix='.py')
+    try:
+        write_module(df, fn)
+        assert False
+    except CompilationError:
+        assert not os.path.exists(fn)
+
+
+def test_compile_dataflow_error():
+    df = CompositeNode((dict(name='seq'),), (dict(name='item'),))
+    vid = df.add_node(IterNode((dict(name='seq'),), (dict(name='out'),)))
+    df.connect(df.id_in, 0, vid, 0)
+    df.connect(vid, 0, df.id_out, 0)
+    try:
+        compile_dataflow(df)
+        assert False
+    except CompilationError:
+        pass
@@ -4,7 +4,8 @@ import operator
 from openalea.core.dataflow import DataFlow
 from openalea.core.dataflow_state import DataflowState
 from openalea.core.dataflow_evaluation import (AbstractEvaluation,
-                                               BruteEvaluation)
+                                               BruteEvaluation,
+                                               LazyEvaluation)
 from openalea.core.node import Node, FuncNode
 
 
@@ -190,3 +191,130 @@ def test_dataflow_evaluation_no_input_two_outputs():
     dfs.reinit()
     pid2 = df.add_out_port(vid, "out3")
     assert_raises(UserWarning, lambda: algo.eval(env, dfs, vid))
+
+
+def test_dataflow_evaluation_lazy():
+    df, (pid_in, pid_out) = get_dataflow()
+    vid1 = df.vertex(pid_in)
+    vid2, = [vid for vid in df.vertices() if df.nb_in_edges(vid) == 0
+             and vid != vid1]
+    vid3, = df.out_neighbors(vid1)
+
+    calls = []
+
+    def counter(vid, func):
+        def wrapped(*args):
+            calls.append(vid)
+            return func(*args)
+        return wrapped
+
+    df.set_actor(vid1, FuncNode({}, {}, counter(vid1, int)))
+    df.set_actor(vid2, FuncNode({}, {}, counter(vid2, fixed_function)))
+    df.set_actor(vid3, FuncNode({}, {}, counter(vid3, operator.add)))
+
+    algo = LazyEvaluation(df)
+    env = 0
+    dfs = DataflowState(df)
+    dfs.set_data(pid_in, 1)
+
+    algo.eval(env, dfs)
+    assert dfs.is_valid()
+    assert sorted(calls) == sorted([vid1, vid2, vid3])
+
+    # nothing changed
+    del calls[:]
+    algo.eval(env, dfs)
+    assert calls == []
+
+    # only downstream cone of modified input
+    dfs.set_data(pid_in, 2)
+    algo.eval(env, dfs)
+    assert calls == [vid1, vid3]
+    assert dfs.get_data(df.out_ports(vid3).next()) == 7
+
+    # non lazy nodes are always reevaluated
+    del calls[:]
+    df.actor(vid2).lazy = False
+    algo.eval(env, dfs)
+    assert calls == [vid2, vid3]
+
+
+def test_dataflow_evaluation_lazy_partial():
+    df, (pid_in, pid_out) = get_dataflow()
+    vid1 = df.vertex(pid_in)
+    vid3, = df.out_neighbors(vid1)
+    vid4 = df.vertex(pid_out)
+
+    algo = LazyEvaluation(df)
+    env = 0
+    dfs = DataflowState(df)
+    dfs.set_data(pid_in, 1)
+    algo.eval(env, dfs)
+
+    # evaluate upstream part only, change is kept for downstream nodes
+    dfs.set_data(pid_in, 2)
+    algo.eval(env, dfs, vid1)
+    assert dfs.is_changed(df.in_ports(vid3).next())
+    algo.eval(env, dfs, vid3)
+    assert dfs.get_data(df.out_ports(vid3).next()) == 7
+    assert dfs.is_changed(df.in_ports(vid4).next())
+
+    # topology modification
+    algo.eval(env, dfs)
+    assert len(tuple(dfs.changed_ports())) == 0
+    df.connect(df.out_ports(vid1).next(), df.in_ports(vid4).next())
+    dfs.set_data(pid_out, 'a')
+    dfs.clear_changes()
+    algo.eval(env, dfs)
+    assert dfs.get_data(pid_out) is None
+
+
+def test_dataflow_evaluation_concurrent():
+    from threading import Thread
+
+    df, (pid_in, pid_out) = get_dataflow()
+    vid1 = df.vertex(pid_in)
+    vid2, = [vid for vid in df.vertices() if df.nb_in_edges(vid) == 0
+             and vid != vid1]
+    vid3, = df.out_neighbors(vid1)
+    df.set_actor(df.vertex(pid_out), FuncNode({}, {}, lambda x: x))
+    pid3 = df.out_ports(vid3).next()
+
+    calls = []
+
+    def counter(vid, func):
+        def wrapped(*args):
+            calls.append(vid)
+            return func(*args)
+        return wrapped
+
+    df.set_actor(vid2, FuncNode({}, {}, counter(vid2, fixed_function)))
+
+    algo = LazyEvaluation(df)
+    env = 0
+    dfs = DataflowState(df)
+    dfs.set_data(pid_in, 0)
+    algo.eval(env, dfs)
+    assert calls == [vid2]
+
+    # each thread evaluates a fork of the evaluated state
+    results = {}
+
+    def run(i):
+        fork = dfs.fork()
+        for j in range(50):
+            fork.set_data(pid_in, i * 100 + j)
+            algo.eval(env, fork)
+            results.setdefault(i, []).append(fork.get_data(pid_out))
+
+    threads = [Thread(target=run, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i in range(4):
+        assert results[i] == [i * 100 + j + 5 for j in range(50)]
+    # shared upstream node not evaluated again
+    assert calls == [vid2]
+    assert dfs.get_data(pid3) == 5
@@ -190,3 +190,70 @@ def test_dataflow_state_get_data():
     n2.get_ad_hoc_dict().set_metadata('position', [10, 0])
     n5.get_ad_hoc_dict().set_metadata('position', [0, 0])
     assert tuple(dfs.get_data(pid32)) == (3, 1)
+
+
+def test_dataflow_state_changes():
+    df = DataFlow()
+    vid1 = df.add_vertex()
+    pid10 = df.add_in_port(vid1, "in")
+    pid11 = df.add_out_port(vid1, "out")
+    vid2 = df.add_vertex()
+    pid21 = df.add_in_port(vid2, "in")
+
+    df.connect(pid11, pid21)
+
+    dfs = DataflowState(df)
+    assert not dfs.has_data(pid10)
+    assert len(tuple(dfs.changed_ports())) == 0
+
+    dfs.set_data(pid10, 'a')
+    assert dfs.has_data(pid10)
+    assert dfs.is_changed(pid10)
+    assert not dfs.is_changed(pid21)
+
+    dfs.set_data(pid11, 'b')
+    assert dfs.is_changed(pid21)
+    assert not dfs.has_data(pid21)
+
+    dfs.clear_changes([pid11])
+    assert dfs.is_changed(pid10)
+    assert not dfs.is_changed(pid21)
+
+    dfs.clear_changes()
+    assert not dfs.is_changed(pid10)
+    assert dfs.get_data(pid10) == 'a'
+
+
+def test_dataflow_state_fork():
+    df = DataFlow()
+    vid1 = df.add_vertex()
+    pid10 = df.add_in_port(vid1, "in")
+    pid11 = df.add_out_port(vid1, "out")
+    vid2 = df.add_vertex()
+    pid20 = df.add_in_port(vid2, "in")
+    pid21 = df.add_out_port(vid2, "out")
+    df.connect(pid11, pid20)
+
+    dfs = DataflowState(df)
+    dfs.set_data(pid10, 1)
+    dfs.set_data(pid11, 2)
+    dfs.clear_changes()
+
+    fork = dfs.fork()
+    assert fork.parent() is dfs
+    assert fork.is_ready_for_evaluation()
+    assert fork.has_data(pid11)
+    assert fork.get_data(pid20) == 2
+    assert not fork.is_changed(pid20)
+
+    # copy on write
+    fork.set_data(pid11, 3)
+    fork.set_data(pid21, 4)
+    assert fork.get_data(pid20) == 3
+    assert fork.is_changed(pid20)
+    assert fork.is_valid()
+    assert dfs.get_data(pid20) == 2
+    assert not dfs.has_data(pid21)
+
+    fork.clear()
+    assert fork.get_data(pid20) == 2
@@ -78,3 +78,922 @@ def test_diamond_after_map():
 
 
 #see test_compositenode.py
+
+
+def parallel_dataflow(func1, func2):
+    """ Return a composite node computing func1() + func2() """
+    import operator
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+
+    df = CompositeNode()
+    n1 = FuncNode((), (dict(name='out'),), func1)
+    n2 = FuncNode((), (dict(name='out'),), func2)
+    add = FuncNode((dict(name='a'), dict(name='b')), (dict(name='out'),),
+                   operator.add)
+    vid1 = df.add_node(n1)
+    vid2 = df.add_node(n2)
+    vid3 = df.add_node(add)
+    df.connect(vid1, 0, vid3, 0)
+    df.connect(vid2, 0, vid3, 1)
+    df.eval_algo = "ParallelEvaluation"
+
+    return df, (vid1, vid2, vid3)
+
+
+def test_parallel_evaluation():
+    """ Independent branches are evaluated concurrently """
+    import threading
+
+    ev1 = threading.Event()
+    ev2 = threading.Event()
+
+    def f1():
+        ev1.set()
+        ev2.wait(5)
+        return int(ev2.is_set())
+
+    def f2():
+        ev2.set()
+        ev1.wait(5)
+        return int(ev1.is_set())
+
+    from openalea.core.algo.dataflow_evaluation import ParallelEvaluation
+
+    df, (vid1, vid2, vid) = parallel_dataflow(f1, f2)
+    algo = ParallelEvaluation(df, nb_workers=2)
+    algo.eval(vid)
+    assert df.node(vid).get_output(0) == 2
+
+    # lazy: nothing has changed, nothing is reevaluated
+    ev1.clear()
+    ev2.clear()
+    df.eval_as_expression(vid)
+    assert not ev1.is_set()
+
+
+def test_parallel_evaluation_block():
+    from openalea.core.algo.dataflow_evaluation import ParallelEvaluation
+
+    calls = []
+
+    def f1():
+        calls.append(1)
+        return 1
+
+    df, (vid1, vid2, vid) = parallel_dataflow(f1, lambda: 2)
+    algo = ParallelEvaluation(df, nb_workers=2)
+    algo.eval()
+    assert df.node(vid).get_output(0) == 3
+    assert calls == [1]
+
+    df.node(vid1).block = True
+    df.node(vid1).modified = True
+    algo.eval()
+    assert calls == [1]
+
+
+def test_parallel_evaluation_exception():
+    from openalea.core.algo.dataflow_evaluation import (ParallelEvaluation,
+                                                        EvaluationException)
+
+    def f1():
+        raise ValueError()
+
+    df, (vid1, vid2, vid) = parallel_dataflow(f1, lambda: 2)
+    algo = ParallelEvaluation(df)
+    try:
+        algo.eval(vid)
+        assert False
+    except EvaluationException, e:
+        assert e.vid == vid1
+        assert isinstance(e.exception, ValueError)
+
+
+def test_process_evaluation():
+    """ Side effect free nodes are evaluated in worker processes """
+    import os
+    from openalea.core import Package
+    from openalea.core.node import Factory
+    from openalea.core.pkgmanager import PackageManager
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.algo import dataflow_evaluation as algo
+
+    pkg = Package("test_process_evaluation", {})
+    pkg.add_factory(Factory(name="getpid", nodemodule="os",
+                            nodeclass="getpid", inputs=(),
+                            outputs=(dict(name="pid"),),
+                            side_effect_free=True))
+    pkg.add_factory(Factory(name="abs", nodemodule="__builtin__",
+                            nodeclass="abs",
+                            inputs=(dict(name="x"),),
+                            outputs=(dict(name="y"),)))
+    PackageManager().add_package(pkg)
+
+    df = CompositeNode()
+    pid = df.add_node(pkg["getpid"].instantiate())
+    absid = df.add_node(pkg["abs"].instantiate())
+    df.connect(pid, 0, absid, 0)
+    df.eval_algo = "ProcessEvaluation"
+
+    assert df.node(pid).side_effect_free
+    assert not df.node(absid).side_effect_free
+
+    algo.close_process_pool()
+    try:
+        df.eval_as_expression(absid)
+        worker_pid = df.node(absid).get_output(0)
+        assert worker_pid != os.getpid()
+        assert df.node(pid).get_output(0) == worker_pid
+        assert not df.node(pid).modified
+
+        # the pool is created again with the requested size
+        pool = algo.get_process_pool(1)
+        assert algo.get_process_pool(1) is pool
+        df.get_eval_algo().nb_workers = 2
+        df.node(pid).modified = True
+        df.eval_as_expression(absid)
+        assert algo._process_pool is not pool
+        assert algo._process_pool._processes == 2
+    finally:
+        algo.close_process_pool()
+
+
+def test_scheduled_evaluation():
+    """ Deep dataflows do not reach the recursion limit """
+    import sys
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+
+    def incr(x):
+        return x + 1
+
+    nb = sys.getrecursionlimit() + 100
+    df = CompositeNode()
+    df.eval_algo = "ScheduledEvaluation"
+    vid = df.add_node(FuncNode((), (dict(name='out'),), lambda: 0))
+    for i in xrange(nb):
+        nvid = df.add_node(FuncNode((dict(name='x'),), (dict(name='out'),),
+                                    incr))
+        df.connect(vid, 0, nvid, 0)
+        vid = nvid
+
+    df.eval_as_expression(vid)
+    assert df.node(vid).get_output(0) == nb
+
+    algo = df.get_eval_algo()
+    schedule = algo.get_schedule([vid])
+    assert len(schedule.steps) == nb + 1
+
+    # The algorithm and its schedule are reused
+    df.eval_as_expression(vid)
+    assert df.get_eval_algo() is algo
+    assert algo.get_schedule([vid]) is schedule
+
+    # but the schedule is recompiled when the dataflow is modified
+    last = df.add_node(FuncNode((dict(name='x'),), (dict(name='out'),),
+                                incr))
+    df.connect(vid, 0, last, 0)
+    assert not schedule.is_valid()
+    df.eval_as_expression(None)
+    assert df.node(last).get_output(0) == nb + 1
+
+    # the default algorithm is also reused, not the script generation
+    df.eval_algo = None
+    assert df.get_eval_algo() is df.get_eval_algo()
+    df.eval_algo = "ToScriptEvaluation"
+    assert df.get_eval_algo() is not df.get_eval_algo()
+
+
+def test_scheduled_evaluation_order():
+    """ Same inputs and blocked nodes than PriorityEvaluation """
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+    from openalea.core.algo.dataflow_evaluation import ScheduledEvaluation
+
+    calls = []
+
+    def f1():
+        calls.append(1)
+        return 1
+
+    df = CompositeNode()
+    vid1 = df.add_node(FuncNode((), (dict(name='out'),), f1))
+    vid2 = df.add_node(FuncNode((), (dict(name='out'),), lambda: 2))
+    vid = df.add_node(FuncNode((dict(name='a'), dict(name='b')),
+                               (dict(name='out'),), lambda a, b: (a, b)))
+    df.node(vid1).get_ad_hoc_dict().set_metadata('position', [10, 0])
+    df.node(vid2).get_ad_hoc_dict().set_metadata('position', [-10, 0])
+    df.connect(vid1, 0, vid, 0)
+    df.connect(vid2, 0, vid, 0)
+    df.connect(vid2, 0, vid, 1)
+
+    algo = ScheduledEvaluation(df)
+    algo.eval()
+    assert df.node(vid).get_output(0) == ([2, 1], 2)
+    assert calls == [1]
+
+    df.node(vid1).block = True
+    df.node(vid1).modified = True
+    algo.eval()
+    assert calls == [1]
+
+
+def test_async_evaluation():
+    """ Coroutine nodes wait concurrently """
+    from nose.plugins.skip import SkipTest
+    from openalea.core.algo.dataflow_evaluation import asyncio
+    if asyncio is None:
+        raise SkipTest("asyncio is not available")
+
+    events = {}
+
+    def get_event(name):
+        if name not in events:
+            events[name] = asyncio.Event()
+        return events[name]
+
+    def wait_for(name1, name2):
+        @asyncio.coroutine
+        def func():
+            get_event(name1).set()
+            yield asyncio.From(asyncio.wait_for(get_event(name2).wait(), 5))
+            raise asyncio.Return(int(get_event(name2).is_set()))
+        return func
+
+    from openalea.core.algo.dataflow_evaluation import AsyncEvaluation
+
+    df, (vid1, vid2, vid) = parallel_dataflow(wait_for('a', 'b'),
+                                              wait_for('b', 'a'))
+    algo = AsyncEvaluation(df)
+    algo.eval(vid)
+    assert df.node(vid).get_output(0) == 2
+
+
+def test_async_evaluation_exception():
+    from nose.plugins.skip import SkipTest
+    from openalea.core.algo.dataflow_evaluation import asyncio
+    if asyncio is None:
+        raise SkipTest("asyncio is not available")
+
+    from openalea.core.algo.dataflow_evaluation import (AsyncEvaluation,
+                                                        EvaluationException)
+
+    @asyncio.coroutine
+    def f1():
+        yield asyncio.From(asyncio.sleep(0))
+        raise ValueError()
+
+    df, (vid1, vid2, vid) = parallel_dataflow(f1, lambda: 2)
+    algo = AsyncEvaluation(df)
+    try:
+        algo.eval(vid)
+        assert False
+    except EvaluationException, e:
+        assert e.vid == vid1
+        assert isinstance(e.exception, ValueError)
+
+    # synchronous nodes only
+    df, (vid1, vid2, vid) = parallel_dataflow(lambda: 1, lambda: 2)
+    AsyncEvaluation(df).eval()
+    assert df.node(vid).get_output(0) == 3
+
+
+def discrete_time_dataflow(calls, delay1, delay2, nb):
+    """ Two timers with different delays feeding a sink,
+    and a non lazy node """
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import Node, FuncNode
+
+    class Timer(Node):
+        __checkpoint_attributes__ = ('count',)
+
+        def __init__(self, name, delay):
+            Node.__init__(self, (), (dict(name='out'),))
+            self.name = name
+            self.timer_delay = delay
+            self.reset()
+
+        def reset(self):
+            self.count = 0
+
+        def eval(self):
+            self.count += 1
+            self.outputs[0] = self.count
+            calls.append((self.name, self.count))
+            if self.count < nb:
+                return self.timer_delay
+            return False
+
+    def sink(a, b, c):
+        calls.append(('sink', a, b))
+
+    def volatile():
+        calls.append(('volatile',))
+        return 0
+
+    df = CompositeNode()
+    vid1 = df.add_node(Timer('t1', delay1))
+    vid2 = df.add_node(Timer('t2', delay2))
+    vid3 = df.add_node(FuncNode((), (dict(name='out'),), volatile))
+    df.node(vid3).lazy = False
+    vid = df.add_node(FuncNode((dict(name='a'), dict(name='b'),
+                                dict(name='c')), (), sink))
+    df.connect(vid1, 0, vid, 0)
+    df.connect(vid2, 0, vid, 1)
+    df.connect(vid3, 0, vid, 2)
+    df.eval_algo = "DiscreteTimeEvaluation"
+    return df, vid
+
+
+def test_discrete_time_evaluation():
+    calls = []
+    df, vid = discrete_time_dataflow(calls, 1, 3, 4)
+    df.eval_as_expression(vid)
+
+    # t1 is evaluated each cycle, t2 every 3 cycles, the simulation
+    # stops when t1 returns no delay
+    assert calls == [('t1', 1), ('t2', 1), ('volatile',), ('sink', 1, 1),
+                     ('t1', 2), ('volatile',), ('sink', 2, 1),
+                     ('t1', 3), ('volatile',), ('sink', 3, 1),
+                     ('t1', 4), ('t2', 2), ('volatile',), ('sink', 4, 2)]
+
+
+def test_discrete_time_evaluation_max_cycles():
+    calls = []
+    df, vid = discrete_time_dataflow(calls, 1, 1, 10 ** 6)
+    df.eval_as_expression(vid)
+    assert calls.count(('volatile',)) == 1002
+
+    del calls[:]
+    df.get_eval_algo().max_cycles = 10
+    df.eval_as_expression(vid)
+    assert calls.count(('volatile',)) == 12
+
+
+def test_discrete_time_evaluation_checkpoint():
+    """ A simulation is resumed from its last checkpoint """
+    import os
+    import tempfile
+    from openalea.core.algo.dataflow_evaluation import DiscreteTimeEvaluation
+    from openalea.core.system.systemnodes import IterNode
+
+    calls = []
+    df, vid = discrete_time_dataflow(calls, 1, 3, 8)
+    DiscreteTimeEvaluation(df).eval()
+    reference = list(calls)
+    assert reference[-1] == ('sink', 8, 3)
+
+    crash = []
+
+    def sink(a, b, c):
+        if a == 5 and not crash:
+            crash.append(a)
+            raise RuntimeError('crash')
+        calls.append(('sink', a, b))
+    df.actor(vid).func = sink
+
+    fd, filename = tempfile.mkstemp(suffix='.ckpt')
+    os.close(fd)
+    os.remove(filename)
+    try:
+        del calls[:]
+        df.reset()
+        algo = DiscreteTimeEvaluation(df)
+        algo.set_checkpoint(filename, interval=2)
+        try:
+            algo.eval()
+            assert False
+        except Exception:
+            pass
+        assert os.path.exists(filename)
+
+        # a new process
+        del calls[:]
+        df.reset()
+        algo = DiscreteTimeEvaluation(df)
+        algo.set_checkpoint(filename, interval=2)
+        algo.eval(resume=True)
+        assert calls == reference[reference.index(('t1', 5)):]
+        # the checkpoint of a finished simulation is removed
+        assert not os.path.exists(filename)
+
+        # also when it is run step by step
+        del calls[:]
+        df.reset()
+        algo = DiscreteTimeEvaluation(df)
+        algo.set_checkpoint(filename, interval=1)
+        for i in range(7):
+            algo.eval(step=True)
+            assert os.path.exists(filename)
+        algo.eval(step=True)
+        assert not os.path.exists(filename)
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    # annotations have no state
+    from openalea.core.system.systemnodes import AnnotationNode
+    aid = df.add_node(AnnotationNode())
+    state = df.checkpoint_state()
+    assert aid not in state['nodes'] and vid in state['nodes']
+    df.restore_checkpoint_state(state)
+
+    # iterators are saved by position
+    node = IterNode((dict(name='seq'),), (dict(name='out'),))
+    node.set_input(0, range(5))
+    node.eval()
+    node.eval()
+    state = node.checkpoint_state()
+    node = IterNode((dict(name='seq'),), (dict(name='out'),))
+    node.restore_checkpoint_state(state)
+    assert node.get_output(0) == 1
+    node.eval()
+    assert node.get_output(0) == 2
+
+
+def lambda_dataflow(calls):
+    """ map(lambda x, y: x - y + cst, seq) """
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+    from openalea.core.interface import IFunction
+    from openalea.core.system.systemnodes import LambdaVar
+
+    def cst():
+        calls.append('cst')
+        return 10
+
+    def sub(x, y, c):
+        calls.append('sub')
+        return x - y + c
+
+    def apply(f, seq):
+        return [f(*args) for args in seq]
+
+    df = CompositeNode()
+    x = df.add_node(LambdaVar((), (dict(name='x'),)))
+    y = df.add_node(LambdaVar((), (dict(name='y'),)))
+    cid = df.add_node(FuncNode((), (dict(name='out'),), cst))
+    subid = df.add_node(FuncNode((dict(name='x'), dict(name='y'),
+                                  dict(name='c')), (dict(name='out'),), sub))
+    seq = df.add_node(FuncNode((), (dict(name='out'),),
+                               lambda: [(1, 2), (5, 3), (0, 0)]))
+    mapid = df.add_node(FuncNode((dict(name='f', interface=IFunction),
+                                  dict(name='seq')), (dict(name='out'),),
+                                 apply))
+    df.connect(x, 0, subid, 0)
+    df.connect(y, 0, subid, 1)
+    df.connect(cid, 0, subid, 2)
+    df.connect(subid, 0, mapid, 0)
+    df.connect(seq, 0, mapid, 1)
+    return df, subid, mapid
+
+
+def test_lambda_compilation():
+    """ SubDataflows are compiled into functions of the lambda variables """
+    from openalea.core.dataflow import SubDataflow
+
+    calls = []
+    df, subid, mapid = lambda_dataflow(calls)
+    df.eval_as_expression(mapid)
+
+    assert df.node(mapid).get_output(0) == [9, 12, 10]
+    assert calls == ['cst', 'sub', 'sub', 'sub']
+
+    subdf = df.node(mapid).get_input(0)
+    assert isinstance(subdf, SubDataflow)
+    function = subdf.get_function()
+    assert len(function.variables) == 2
+    assert [step[0] for step in function.steps] == [subid]
+
+    # the compiled function is reused
+    assert subdf(3, 1) == 12
+    assert subdf.get_function() is function
+    assert calls.count('cst') == 1
+
+    # and recompiled when the dataflow is modified
+    from openalea.core.node import FuncNode
+    df.add_node(FuncNode((), (), None))
+    assert subdf.get_function() is not function
+    assert subdf(3, 1) == 12
+
+    # the algorithm is reused by the next evaluations
+    algo = df.get_eval_algo()
+    df.node(subid).modified = True
+    df.eval_as_expression(mapid)
+    assert df.get_eval_algo() is algo
+    assert df.node(mapid).get_output(0) == [9, 12, 10]
+    assert df.node(mapid).get_input(0)(3, 1) == 12
+
+
+def test_generator_streaming():
+    """ Only the vertices downstream of the generators are reevaluated """
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+    from openalea.core.system.systemnodes import IterNode
+    from openalea.core.algo.dataflow_evaluation import GeneratorEvaluation
+
+    assert not GeneratorEvaluation(CompositeNode()).streaming
+
+    for streaming in (True, False):
+        items = []
+        df = CompositeNode()
+        seq = df.add_node(FuncNode((), (dict(name='out'),),
+                                   lambda: range(5)))
+        it = df.add_node(IterNode((dict(name='seq'),),
+                                  (dict(name='item'),)))
+        sq = df.add_node(FuncNode((dict(name='x'),), (dict(name='out'),),
+                                  lambda x: x * x))
+        acc = df.add_node(FuncNode((dict(name='x'),), (),
+                                   items.append))
+        df.node(acc).lazy = False
+        df.connect(seq, 0, it, 0)
+        df.connect(it, 0, sq, 0)
+        df.connect(sq, 0, acc, 0)
+
+        algo = GeneratorEvaluation(df, streaming=streaming)
+        evaluated = []
+
+        def eval_vertex_code(vid):
+            evaluated.append(vid)
+            return GeneratorEvaluation.eval_vertex_code(algo, vid)
+        algo.eval_vertex_code = eval_vertex_code
+
+        algo.eval()
+        assert items == [0, 1, 4, 9, 16]
+        assert evaluated.count(it) == 5
+        assert evaluated.count(seq) == (1 if streaming else 5)
+
+
+def test_provenance():
+    """ Node executions are written in the provenance database """
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    from openalea.core.algo import dataflow_evaluation as algo
+
+    dirname = tempfile.mkdtemp()
+    db_name = os.path.join(dirname, 'provenance.sq3')
+    try:
+        df, (vid1, vid2, vid) = parallel_dataflow(lambda: 1, lambda: 2)
+        df.eval_algo = "LambdaEvaluation"
+        writer = algo.enable_provenance(db_name)
+        try:
+            df.eval_as_expression(vid)
+            writer.flush()
+        finally:
+            algo.disable_provenance()
+        assert not algo.PROVENANCE
+
+        conn = sqlite3.connect(db_name)
+        cur = conn.cursor()
+        assert cur.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        cur.execute("SELECT createtime, endtime FROM CompositeNodeExec")
+        rows = cur.fetchall()
+        assert len(rows) == 1
+        assert rows[0][1] >= rows[0][0]
+        cur.execute("SELECT count(*) FROM NodeExec")
+        assert cur.fetchone()[0] == 3
+        conn.close()
+
+        # an invalid record does not stop the writer
+        writer = algo.ProvenanceWriter(db_name)
+        writer.put(('node', 'unknown', 'node', '', 0., 1.))
+        writer.flush()
+        assert writer.is_alive()
+        writer.put(('workflow', 'key', 'workflow', 0.))
+        writer.put(('node', 'key', 'node', '', 0., 1.))
+        writer.put(('workflow_end', 'key', 1.))
+        writer.close()
+        conn = sqlite3.connect(db_name)
+        assert conn.execute("SELECT count(*) FROM NodeExec").fetchone()[0] == 4
+        conn.close()
+
+        # only the invalid record of a batch is dropped
+        writer = algo.ProvenanceWriter(db_name)
+        conn = algo.db_connect(db_name)
+        writer.write_batch(conn, [('workflow', 'key', 'workflow', 0.),
+                                  ('node', 'key', 'node', '', 0., 1.),
+                                  ('node', 'unknown', 'node', '', 0., 1.),
+                                  ('node', 'key', 'node', '', 0., 1.),
+                                  ('workflow_end', 'key', 1.)])
+        conn.close()
+        writer.close()
+        conn = sqlite3.connect(db_name)
+        assert conn.execute("SELECT count(*) FROM NodeExec").fetchone()[0] == 6
+        assert conn.execute("SELECT count(*) FROM CompositeNodeExec "
+                            "WHERE endtime IS NULL").fetchone()[0] == 0
+        conn.close()
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_profiler():
+    """ Node evaluations are profiled, nested nodes under their parent """
+    import os
+    import json
+    import pstats
+    import shutil
+    import tempfile
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+    from openalea.core.algo import dataflow_profiler
+    from openalea.core.algo.dataflow_evaluation import EvaluationException
+
+    inner = CompositeNode((), (dict(name='out'),))
+    inner.set_caption('inner')
+    vid_one = inner.add_node(FuncNode((), (dict(name='out'),), lambda: 1))
+    inner.connect(vid_one, 0, inner.id_out, 0)
+
+    df, (vid1, vid2, vid) = parallel_dataflow(lambda: 2, lambda: 0)
+    df.eval_algo = "LambdaEvaluation"
+    df.set_caption('outer')
+    df.remove_vertex(vid2)
+    vid2 = df.add_node(inner)
+    df.connect(vid2, 0, vid, 1)
+
+    dirname = tempfile.mkdtemp()
+    profiler = dataflow_profiler.enable_profiler()
+    try:
+        df.eval_as_expression(vid)
+        assert df.node(vid).get_output(0) == 3
+    finally:
+        dataflow_profiler.disable_profiler()
+
+    try:
+        nodes = profiler.nodes
+        # 3 nodes in outer, the node and the output node in inner
+        assert len(nodes) == 5
+        label = ('outer', vid2, 'inner')
+        assert nodes[label].calls == 1
+        assert nodes[label].errors == 0
+        assert nodes[label].output_size > 0
+        inner_label = ('outer/inner', vid_one, '')
+        assert nodes[inner_label].callers.keys() == [label]
+        assert nodes[label].wall_time >= nodes[inner_label].wall_time
+        assert nodes[label].own_time <= nodes[label].wall_time
+
+        trace = os.path.join(dirname, 'trace.json')
+        profiler.write_chrome_trace(trace)
+        events = json.load(open(trace))['traceEvents']
+        assert len(events) == 5
+        assert all(e['ph'] == 'X' for e in events)
+
+        prof = os.path.join(dirname, 'nodes.prof')
+        profiler.dump_stats(prof)
+        stats = pstats.Stats(prof)
+        assert stats.total_calls == 5
+        assert label in stats.stats
+    finally:
+        shutil.rmtree(dirname)
+
+    def fail():
+        raise ValueError()
+
+    df, (vid1, vid2, vid) = parallel_dataflow(lambda: 2, fail)
+    df.eval_algo = "LambdaEvaluation"
+    profiler = dataflow_profiler.enable_profiler()
+    try:
+        try:
+            df.eval_as_expression(vid)
+            assert False
+        except EvaluationException:
+            pass
+    finally:
+        dataflow_profiler.disable_profiler()
+    errors = [p.errors for p in profiler.get_stats() if p.label[1] == vid2]
+    assert errors == [1]
+
+
+def test_release_outputs():
+    """ Outputs are freed once read by all their consumers """
+    import operator
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+
+    calls = []
+
+    def source():
+        calls.append(1)
+        return [1, 2, 3]
+
+    for algo_name in ("PriorityEvaluation", "ParallelEvaluation",
+                      "ScheduledEvaluation", "LambdaEvaluation"):
+        df = CompositeNode()
+        n1 = FuncNode((), (dict(name='out'),), source)
+        n2 = FuncNode((dict(name='x'),), (dict(name='out'),),
+                      lambda x: x[::-1])
+        add = FuncNode((dict(name='a'), dict(name='b')), (dict(name='out'),),
+                       operator.add)
+        vid1 = df.add_node(n1)
+        vid2 = df.add_node(n2)
+        vid3 = df.add_node(add)
+        df.connect(vid1, 0, vid2, 0)
+        df.connect(vid1, 0, vid3, 0)
+        df.connect(vid2, 0, vid3, 1)
+        df.eval_algo = algo_name
+
+        del calls[:]
+        df.eval_as_expression(vid3)
+        assert df.node(vid1).get_output(0) == [1, 2, 3]
+        assert df.node(vid3).get_output(0) == [1, 2, 3, 3, 2, 1]
+
+        df.release_outputs = True
+        n1.modified = True
+        df.eval_as_expression(vid3)
+        assert df.node(vid1).get_output(0) is None
+        assert df.node(vid2).get_output(0) is None
+        assert df.node(vid3).inputs == [None, None]
+        assert df.node(vid3).get_output(0) == [1, 2, 3, 3, 2, 1]
+
+        # released nodes are evaluated again
+        df.eval_as_expression(vid3)
+        assert df.node(vid3).get_output(0) == [1, 2, 3, 3, 2, 1]
+        assert len(calls) == 3
+
+        # blocked nodes keep their outputs
+        n1.block = True
+        df.eval_as_expression(vid3)
+        assert df.node(vid1).get_output(0) == [1, 2, 3]
+        assert df.node(vid2).get_output(0) is None
+        assert len(calls) == 4
+
+    # the ports of a composite node keep their values
+    for algo_name in ("ScheduledEvaluation", "LambdaEvaluation"):
+        cn = CompositeNode((dict(name='x'),), (dict(name='y'),))
+        vid = cn.add_node(FuncNode((dict(name='x'),), (dict(name='out'),),
+                                   lambda x: x * 2))
+        cn.connect(cn.id_in, 0, vid, 0)
+        cn.connect(vid, 0, cn.id_out, 0)
+        cn.eval_algo = algo_name
+        cn.release_outputs = True
+        cn.set_input(0, 3)
+        for i in range(2):
+            cn.eval()
+            assert cn.get_output(0) == 6
+            assert cn.get_input(0) == 3
+        # read by __out__
+        assert cn.node(vid).get_output(0) is None
+
+
+def test_parent_index():
+    """ Parents are ordered by position and the index follows the moves """
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+    from openalea.core.algo.dataflow_evaluation import (BrutEvaluation,
+                                                        ScheduledEvaluation)
+
+    df = CompositeNode()
+    vid1 = df.add_node(FuncNode((), (dict(name='out'),), lambda: 1))
+    vid2 = df.add_node(FuncNode((), (dict(name='out'),), lambda: 2))
+    vid = df.add_node(FuncNode((dict(name='a'),), (dict(name='out'),),
+                               lambda a: a))
+    df.node(vid1).get_ad_hoc_dict().set_metadata('position', [10, 0])
+    df.node(vid2).get_ad_hoc_dict().set_metadata('position', [-10, 0])
+    df.connect(vid1, 0, vid, 0)
+    df.connect(vid2, 0, vid, 0)
+
+    pid = df.in_port(vid, 0)
+    parents = df.parent_ports(pid)
+    assert [p[1] for p in parents] == [vid2, vid1]
+    assert df.parent_ports(pid) is parents
+
+    scheduled = ScheduledEvaluation(df)
+    scheduled.eval()
+    assert df.node(vid).get_output(0) == [2, 1]
+
+    # moving a parent invalidates the index and the schedules
+    df.node(vid2).get_ad_hoc_dict().set_metadata('position', [20, 0])
+    assert [p[1] for p in df.parent_ports(pid)] == [vid1, vid2]
+    scheduled.eval()
+    assert df.node(vid).get_output(0) == [1, 2]
+
+    df.disconnect(vid1, 0, vid, 0)
+    assert [p[1] for p in df.parent_ports(pid)] == [vid2]
+    BrutEvaluation(df).eval()
+    assert df.node(vid).get_output(0) == 2
+
+
+def test_critical_path_evaluation():
+    """ Vertices on the longest path are evaluated first """
+    import os
+    import tempfile
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+    from openalea.core.algo.dataflow_evaluation import CriticalPathEvaluation
+    from openalea.core.algo.node_timing import (enable_node_timing,
+                                                disable_node_timing,
+                                                NodeTiming, timing_key)
+
+    calls = []
+
+    def slow(x=None):
+        calls.append('slow')
+        return 1
+
+    def fast():
+        calls.append('fast')
+        return 1
+
+    def join(*args):
+        return len(args)
+
+    df = CompositeNode()
+    vids = [df.add_node(FuncNode((), (dict(name='out'),), fast))
+            for i in range(3)]
+    chain = df.add_node(FuncNode((), (dict(name='out'),), slow))
+    vid = df.add_node(FuncNode((dict(name='x'),), (dict(name='out'),), slow))
+    df.connect(chain, 0, vid, 0)
+    end = df.add_node(FuncNode([dict(name='x%d' % i) for i in range(4)],
+                               (dict(name='out'),), join))
+    for i, v in enumerate(vids + [vid]):
+        df.connect(v, 0, end, i)
+
+    fd, db_name = tempfile.mkstemp(suffix='.sq3')
+    os.close(fd)
+    try:
+        timing = enable_node_timing(db_name)
+        key = timing_key(df.node(chain))
+        timing.update(key, 1.)
+        timing.update(timing_key(df.node(vids[0])), 0.01)
+
+        algo = CriticalPathEvaluation(df, nb_workers=1)
+        algo.eval()
+        assert calls[:2] == ['slow', 'slow']
+        assert df.node(end).get_output(0) == 4
+
+        # the statistics are stored
+        disable_node_timing()
+        runtime, size, count = NodeTiming(db_name).get(key)
+        assert count == 3
+        assert runtime < 1.
+    finally:
+        disable_node_timing()
+        os.remove(db_name)
+
+
+def test_node_timing_skipped_nodes():
+    """ Only the runs of the node functions are recorded """
+    import os
+    import tempfile
+    from openalea.core.compositenode import CompositeNode
+    from openalea.core.node import FuncNode
+    from openalea.core.algo.node_timing import (enable_node_timing,
+                                                disable_node_timing,
+                                                timing_key)
+
+    calls = []
+
+    def compute(x):
+        calls.append(x)
+        return x
+
+    df = CompositeNode()
+    vid = df.add_node(FuncNode((dict(name='x', value=1),),
+                               (dict(name='out'),), compute))
+    node = df.node(vid)
+    node.lazy = True
+    node.set_input(0, 1)
+
+    fd, db_name = tempfile.mkstemp(suffix='.sq3')
+    os.close(fd)
+    try:
+        timing = enable_node_timing(db_name)
+        df.eval_as_expression()
+        # lazy node not modified: the function is not called
+        df.eval_as_expression()
+        df.eval_as_expression()
+        assert len(calls) == 1
+        assert timing.get(timing_key(node))[2] == 1
+
+        node.set_input(0, 2)
+        df.eval_as_expression()
+        assert timing.get(timing_key(node))[2] == 2
+    finally:
+        disable_node_timing()
+        os.remove(db_name)
+
+
+def test_parallel_evaluation_headless():
+    """ The workers use the headless context of the evaluation """
+    from openalea.core.observer import AbstractListener
+    from openalea.core.node import headless
+
+    class Listener(AbstractListener):
+        def __init__(self):
+            AbstractListener.__init__(self)
+            self.events = []
+
+        def notify(self, sender, event=None):
+            self.events.append(event)
+
+    df, (vid1, vid2, vid) = parallel_dataflow(lambda: 1, lambda: 2)
+    listener = Listener()
+    listener.initialise(df.node(vid1))
+    with headless():
+        df.eval_as_expression(vid)
+        assert listener.events == []
+    assert df.node(vid).get_output(0) == 3
+    assert [event[0] for event in listener.events] == \
+           ['notifications_coalesced']
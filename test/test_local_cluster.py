@@ -0,0 +1,141 @@
+"""Local cluster tests"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import os
+
+from nose.tools import assert_raises
+
+from openalea.core import Package
+from openalea.core.node import Factory, FuncNode
+from openalea.core.pkgmanager import PackageManager
+from openalea.core.compositenode import CompositeNode
+from openalea.core.algo import local_cluster
+
+
+def get_package():
+    pkg = Package("test_local_cluster", {})
+    pkg.add_factory(Factory(name="abs", nodemodule="__builtin__",
+                            nodeclass="abs",
+                            inputs=(dict(name="x"),),
+                            outputs=(dict(name="y"),)))
+    pkg.add_factory(Factory(name="add", nodemodule="operator",
+                            nodeclass="add",
+                            inputs=(dict(name="a"), dict(name="b")),
+                            outputs=(dict(name="y"),)))
+    pkg.add_factory(Factory(name="getpid", nodemodule="os",
+                            nodeclass="getpid", inputs=(),
+                            outputs=(dict(name="pid"),)))
+    PackageManager().add_package(pkg)
+    return pkg
+
+
+def test_local_cluster():
+    get_package()
+    cluster = local_cluster.LocalCluster(2)
+    try:
+        items = range(-50, 50)
+        assert cluster.map(('test_local_cluster', 'abs'), items) == \
+            [abs(i) for i in items]
+        assert cluster.reduce('test_local_cluster:add', items) == \
+            sum(items)
+        assert cluster.reduce('test_local_cluster:add',
+                              [[i] for i in range(5)]) == range(5)
+
+        pids = cluster.map('test_local_cluster:getpid', [()] * 8)
+        assert os.getpid() not in pids
+        assert 1 <= len(set(pids)) <= 2
+
+        assert_raises(local_cluster.ClusterException,
+                      cluster.map, 'test_local_cluster:abs', ['a'])
+        # workers are still running
+        assert cluster.map('test_local_cluster:abs', [-1]) == [1]
+
+        # dead workers are replaced
+        process = cluster._workers[0][0]
+        process.terminate()
+        process.join()
+        pids = cluster.map('test_local_cluster:getpid', [()] * 8)
+        assert process.pid not in pids
+        assert len(cluster._workers) == 2
+
+        # items which can not be sent
+        assert_raises(local_cluster.ClusterException,
+                      cluster.map, ('test_local_cluster', 'abs'),
+                      [lambda: 1, 2])
+        assert cluster.map('test_local_cluster:abs', [-1, -2]) == [1, 2]
+        assert len(cluster._workers) == 2
+    finally:
+        cluster.close()
+
+
+def test_local_cluster_resize():
+    get_package()
+    local_cluster.close_cluster()
+    try:
+        cluster = local_cluster.get_cluster(2)
+        assert cluster.map('test_local_cluster:abs', [-1] * 8) == [1] * 8
+        assert len(cluster._workers) == 2
+
+        assert local_cluster.get_cluster() is cluster
+        assert local_cluster.get_cluster(1) is cluster
+        assert cluster.nb_workers == 1 and len(cluster._workers) == 1
+        pids = cluster.map('test_local_cluster:getpid', [()] * 8)
+        assert len(set(pids)) == 1
+
+        local_cluster.get_cluster(3)
+        cluster.map('test_local_cluster:getpid', [()] * 8)
+        assert len(cluster._workers) == 3
+    finally:
+        local_cluster.close_cluster()
+
+
+def test_local_cluster_concurrent_runs():
+    """ Several threads share the workers """
+    from threading import Thread
+
+    get_package()
+    cluster = local_cluster.LocalCluster(2)
+    results = []
+
+    def run(i):
+        items = range(-i * 10, i * 10)
+        results.append(cluster.map('test_local_cluster:abs', items) ==
+                       [abs(x) for x in items])
+
+    try:
+        threads = [Thread(target=run, args=(i,)) for i in range(1, 5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [True] * 4
+        assert len(cluster._workers) == 2
+    finally:
+        cluster.close()
+
+
+def test_cluster_evaluation():
+    pkg = get_package()
+    df = CompositeNode()
+    data = df.add_node(FuncNode((), (dict(name='out'),),
+                                lambda: range(-5, 5)))
+    func = df.add_node(pkg["abs"].instantiate())
+    mapid = df.add_node(local_cluster.MapOperator())
+    add = df.add_node(pkg["add"].instantiate())
+    reduceid = df.add_node(local_cluster.ReduceOperator())
+    df.connect(func, 0, mapid, 0)
+    df.connect(data, 0, mapid, 1)
+    df.connect(add, 0, reduceid, 0)
+    df.connect(mapid, 0, reduceid, 1)
+    df.eval_algo = "ClusterEvaluation"
+
+    local_cluster.close_cluster()
+    local_cluster.get_cluster(2)
+    try:
+        df.eval_as_expression()
+        assert df.node(mapid).get_output(0) == [abs(i) for i in range(-5, 5)]
+        assert df.node(reduceid).get_output(0) == 25
+    finally:
+        local_cluster.close_cluster()
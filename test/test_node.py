@@ -154,3 +154,125 @@ def test_node_output():
     n2.eval()
     assert n1.get_output('y') == 1
     assert n2.get_output('y') == [1, 2]
+
+
+def test_change_detection():
+    """ Lazy nodes detect input changes with the port detector """
+    from openalea.core import change_detection
+
+    class Data(object):
+        version = 0
+
+    inputs = (dict(name='x'), dict(name='y', change_detector='identity'),
+              dict(name='z', change_detector='version'))
+    n = FuncNode(inputs, (dict(name='out'),), lambda x, y, z: None)
+    n.eval()
+
+    # scalars are compared with their types
+    n.set_input(0, 1)
+    assert n.modified
+    n.eval()
+    n.set_input(0, 1)
+    assert not n.modified
+    n.set_input(0, 1.)
+    assert n.modified
+    n.eval()
+
+    # identity
+    l = [1]
+    n.set_input(1, l)
+    assert n.modified
+    n.eval()
+    l.append(2)
+    n.set_input(1, l)
+    assert not n.modified
+    n.set_input(1, [1, 2])
+    assert n.modified
+    n.eval()
+
+    # version counter
+    d = Data()
+    n.set_input(2, d)
+    n.eval()
+    n.set_input(2, d)
+    assert not n.modified
+    d.version += 1
+    n.set_input(2, d)
+    assert n.modified
+    n.eval()
+
+    # incomparable values are changed
+    class Incomparable(object):
+        def __cmp__(self, other):
+            raise ValueError()
+    n.set_input(0, Incomparable())
+    n.eval()
+    n.set_input(0, Incomparable())
+    assert n.modified
+
+    if change_detection.numpy is None:
+        return
+    import numpy
+
+    a = numpy.arange(10)
+    n.set_input(0, a)
+    assert n.modified
+    n.eval()
+    n.set_input(0, numpy.arange(10))
+    assert not n.modified
+    # modification in place
+    a = n.get_input(0)
+    a[0] = 5
+    n.set_input(0, a)
+    assert n.modified
+
+
+def test_headless():
+    """ Notifications are coalesced in headless mode """
+    from openalea.core.observer import AbstractListener
+    from openalea.core.node import headless, is_headless
+
+    class Listener(AbstractListener):
+        def __init__(self):
+            AbstractListener.__init__(self)
+            self.events = []
+
+        def notify(self, sender, event=None):
+            self.events.append(event)
+
+    n = FuncNode((dict(name='x'),), (dict(name='y'),), abs)
+    listener = Listener()
+    listener.initialise(n)
+
+    with headless():
+        assert is_headless()
+        for i in range(5):
+            with headless():
+                n.set_input(0, -i)
+                n.eval()
+        assert listener.events == []
+    assert not is_headless()
+    assert n.get_output(0) == 4
+
+    assert len(listener.events) == 1
+    name, events = listener.events[0]
+    assert name == 'notifications_coalesced'
+    assert events == [('input_modified', 0), ('start_eval',), ('stop_eval',)]
+
+    # without summary
+    del listener.events[:]
+    with headless(summary=False):
+        n.set_input(0, 3)
+    assert listener.events == []
+    n.set_input(0, 2)
+    assert listener.events == [('input_modified', 0)]
+
+    # the other threads still notify
+    from threading import Thread
+    del listener.events[:]
+    with headless():
+        t = Thread(target=n.set_input, args=(0, 1))
+        t.start()
+        t.join()
+        assert listener.events == [('input_modified', 0)]
+        assert is_headless()
@@ -0,0 +1,136 @@
+"""Node cache tests"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import shutil
+import tempfile
+
+from openalea.core import Package
+from openalea.core.node import Factory, FuncNode
+from openalea.core.compositenode import CompositeNode
+from openalea.core.algo import node_cache
+
+
+def get_package(side_effect_free=True):
+    pkg = Package("test_node_cache", {'version': '1.0'})
+    pkg.add_factory(Factory(name="abs", nodemodule="__builtin__",
+                            nodeclass="abs",
+                            inputs=(dict(name="x"),),
+                            outputs=(dict(name="y"),),
+                            side_effect_free=side_effect_free))
+    return pkg
+
+
+def test_node_cache():
+    dirname = tempfile.mkdtemp()
+    try:
+        pkg = get_package()
+        node = pkg["abs"].instantiate()
+        cache = node_cache.NodeCache(dirname)
+
+        call = cache.cached_call(node)
+        assert call([-2]) == 2
+        assert call([-2]) == 2
+        assert call([-3]) == 3
+        stats = cache.get_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert stats['entries'] == 2
+
+        # persistent between sessions
+        cache = node_cache.NodeCache(dirname)
+        call = cache.cached_call(pkg["abs"].instantiate())
+        assert call([-3]) == 3
+        assert cache.hits == 1
+
+        # key depends on package version
+        pkg.metainfo['version'] = '1.1'
+        assert call([-3]) == 3
+        assert cache.misses == 1
+
+        # non cacheable nodes
+        node = get_package(False)["abs"].instantiate()
+        assert cache.cached_call(node) is None
+        assert cache.cached_call(FuncNode((), (), abs)) is None
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_node_cache_eviction():
+    dirname = tempfile.mkdtemp()
+    try:
+        cache = node_cache.NodeCache(dirname)
+        cache.set('a', range(10))
+        size = cache.get_stats()['size']
+        cache.max_size = 2 * size
+
+        cache.set('b', range(10))
+        assert cache.get('a')[0]
+        cache._entries['a'][1] += 10
+        cache.set('c', range(10))
+
+        # b is the least recently used
+        assert not cache.get('b')[0]
+        assert cache.get('a') == (True, range(10))
+        assert cache.get('c')[0]
+
+        cache.clear()
+        assert cache.get_stats()['entries'] == 0
+        assert not cache.get('a')[0]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_node_cache_write_error():
+    """ Entries are replaced, failed writes leave no file """
+    import os
+
+    dirname = tempfile.mkdtemp()
+    write = os.write
+
+    def full_disk(fd, data):
+        raise OSError(28, 'No space left on device')
+
+    try:
+        cache = node_cache.NodeCache(dirname)
+        cache.set('a', range(10))
+        cache.set('a', range(5))
+        assert cache.get('a') == (True, range(5))
+        files = os.listdir(dirname)
+
+        os.write = full_disk
+        try:
+            cache.set('b', range(10))
+        finally:
+            os.write = write
+        assert not cache.get('b')[0]
+        assert os.listdir(dirname) == files
+    finally:
+        os.write = write
+        shutil.rmtree(dirname)
+
+
+def test_node_cache_evaluation():
+    dirname = tempfile.mkdtemp()
+    node_cache.enable_node_cache(dirname)
+    try:
+        pkg = get_package()
+        df = CompositeNode()
+        vid = df.add_node(pkg["abs"].instantiate())
+        df.node(vid).set_input(0, -4)
+        df.eval_as_expression(vid)
+        assert df.node(vid).get_output(0) == 4
+
+        df = CompositeNode()
+        vid = df.add_node(pkg["abs"].instantiate())
+        df.node(vid).set_input(0, -4)
+        df.eval_as_expression(vid)
+        assert df.node(vid).get_output(0) == 4
+
+        stats = node_cache.get_node_cache().get_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+    finally:
+        node_cache.disable_node_cache()
+        shutil.rmtree(dirname)
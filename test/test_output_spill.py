@@ -0,0 +1,125 @@
+"""Output spill tests"""
+
+__license__ = "Cecill-C"
+__revision__ = " $Id$ "
+
+import os
+import mmap
+import shutil
+import tempfile
+
+from nose import SkipTest
+
+from openalea.core.dataflow import DataFlow
+from openalea.core.dataflow_state import DataflowState
+from openalea.core.compositenode import CompositeNode
+from openalea.core.node import FuncNode
+from openalea.core.algo import output_spill
+
+
+def test_output_spill():
+    dirname = tempfile.mkdtemp()
+    try:
+        spill = output_spill.OutputSpill(dirname, threshold=10, budget=25)
+
+        small = bytearray('a' * 5)
+        assert spill.store(small, 0) == (small, 0)
+        assert spill.store('b' * 100, 0)[0] == 'b' * 100
+
+        # kept in memory while it fits in the budget
+        data = bytearray('c' * 20)
+        value, resident = spill.store(data, 0)
+        assert value is data
+        assert resident == 20
+
+        value, resident = spill.store(data, resident)
+        assert isinstance(value, mmap.mmap)
+        assert resident == 20
+        assert value[:] == 'c' * 20
+        assert spill.nb_spilled == 1
+        # file removed, data freed with the view
+        assert os.listdir(dirname) == []
+
+        # copy on write
+        value[0] = 'd'
+        assert spill.store(value, 100)[0] is value
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_output_spill_numpy():
+    if output_spill.numpy is None:
+        raise SkipTest("numpy is not installed")
+    import numpy
+
+    dirname = tempfile.mkdtemp()
+    try:
+        spill = output_spill.OutputSpill(dirname, threshold=1000)
+        data = numpy.arange(1000, dtype=float).reshape(10, 100)
+        value = spill.spill(data)
+        assert isinstance(value, numpy.memmap)
+        assert value.shape == (10, 100)
+        assert (value == data).all()
+
+        value[0, 0] = -1
+        assert (spill.spill(data) == data).all()
+        # already spilled, object arrays can not be mapped
+        assert spill.store(value)[0] is value
+        objs = numpy.array([None] * 1000)
+        assert spill.store(objs)[0] is objs
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_output_spill_evaluation():
+    dirname = tempfile.mkdtemp()
+    output_spill.enable_spill(dirname, threshold=10)
+    try:
+        df = CompositeNode()
+        n1 = FuncNode((), (dict(name='out'),), lambda: bytearray('a' * 20))
+        n2 = FuncNode((dict(name='x'),), (dict(name='out'),),
+                      lambda x: x[:2])
+        vid1 = df.add_node(n1)
+        vid2 = df.add_node(n2)
+        df.connect(vid1, 0, vid2, 0)
+        df.eval_as_expression(vid2)
+        assert isinstance(n1.get_output(0), mmap.mmap)
+        assert n2.get_output(0) == 'aa'
+
+        df = DataFlow()
+        vid = df.add_vertex()
+        pid = df.add_out_port(vid, "out")
+        dfs = DataflowState(df)
+        dfs.set_data(pid, bytearray('b' * 20))
+        assert isinstance(dfs.get_data(pid), mmap.mmap)
+    finally:
+        output_spill.disable_spill()
+        shutil.rmtree(dirname)
+
+
+def test_output_spill_budget():
+    """ Replaced values are not counted in the budget """
+    dirname = tempfile.mkdtemp()
+    output_spill.enable_spill(dirname, threshold=10, budget=25)
+    try:
+        df = DataFlow()
+        vid = df.add_vertex()
+        pid = df.add_out_port(vid, "out")
+        dfs = DataflowState(df)
+        for i in range(3):
+            data = bytearray('b' * 20)
+            dfs.set_data(pid, data)
+            assert dfs.get_data(pid) is data
+
+        df = CompositeNode()
+        n1 = FuncNode((), (dict(name='out'),), lambda: bytearray('a' * 20))
+        vid1 = df.add_node(n1)
+        df.eval_as_expression(vid1)
+        algo = df.get_eval_algo()
+        for i in range(3):
+            # outputs of a skipped node counted again
+            algo.spill_outputs(n1)
+            assert isinstance(n1.get_output(0), bytearray)
+    finally:
+        output_spill.disable_spill()
+        shutil.rmtree(dirname)
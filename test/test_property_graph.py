@@ -76,3 +76,131 @@ def test_propertygraph():
     assert len(g.vertex_property("vtest"))==2
     assert len(g.edge_property("etest"))==1
     assert len(g.edge_property(1))==1
+
+
+def test_id_generator():
+    """Test the reuse of the ids"""
+    import cPickle
+    from openalea.core.graph.id_generator import IdGenerator
+
+    gen = IdGenerator()
+    assert [gen.get_id() for i in range(3)] == [0, 1, 2]
+    assert gen.get_id(10) == 10
+    assert gen.get_id(5) == 5
+    try:
+        gen.get_id(5)
+        assert False
+    except IndexError:
+        pass
+    assert set(gen.get_id() for i in range(6)) == set([3, 4, 6, 7, 8, 9])
+    assert gen.get_id() == 11
+
+    gen.release_id(4)
+    gen.release_id(7)
+    assert gen.get_id() == 7
+    assert gen.get_id() == 4
+    gen.release_id(2)
+    try:
+        gen.release_id(2)
+        assert False
+    except IndexError:
+        pass
+    assert gen.get_id(2) == 2
+
+    # generators pickled with the list of free ids
+    old = IdGenerator.__new__(IdGenerator)
+    old.__setstate__(dict(_id_max=4, _id_list=[1, 3]))
+    assert old.get_id() == 3
+    old = cPickle.loads(cPickle.dumps(old))
+    assert old.get_id(1) == 1
+    assert old.get_id() == 4
+
+
+def test_array_graph():
+    """Test the graph stored in arrays"""
+    import cPickle
+    from openalea.core.graph.graph import Graph
+    from openalea.core.graph.array_graph import ArrayGraph, ArrayPropertyGraph
+    from openalea.core.graph.interface.graph import InvalidVertex, InvalidEdge
+
+    g = ArrayGraph()
+    vids = [g.add_vertex() for i in range(4)]
+    assert g.add_vertex(10) == 10
+    eids = [g.add_edge((vids[0], vids[1])),
+            g.add_edge((vids[0], vids[2])),
+            g.add_edge((vids[1], vids[2])),
+            g.add_edge((vids[2], 10)),
+            g.add_edge((vids[2], 10))]
+
+    assert g.nb_vertices() == len(g) == 5
+    assert set(g.vertices()) == set(vids + [10])
+    assert 10 in g and 7 not in g and None not in g
+    assert g.nb_edges() == 5
+    assert g.source(eids[2]) == vids[1] and g.target(eids[2]) == vids[2]
+    assert set(g.in_edges(vids[2])) == set(eids[1:3])
+    assert set(g.out_edges(vids[2])) == set(eids[3:])
+    assert set(g.out_neighbors(vids[2])) == set([10])
+    assert set(g.neighbors(vids[2])) == set([vids[0], vids[1], 10])
+    assert g.nb_edges(vids[2]) == 4
+    assert g.nb_in_neighbors(10) == 1
+
+    g.remove_edge(eids[1])
+    assert set(g.in_edges(vids[2])) == set([eids[2]])
+    assert not g.has_edge(eids[1])
+    try:
+        g.source(eids[1])
+        assert False
+    except InvalidEdge:
+        pass
+
+    g.remove_vertex(vids[2])
+    assert g.nb_edges() == 1
+    assert list(g.out_edges(vids[0])) == [eids[0]]
+    assert g.nb_in_edges(10) == 0
+    try:
+        g.in_edges(vids[2])
+        assert False
+    except InvalidVertex:
+        pass
+    assert g.add_vertex() == vids[2]
+
+    # same topology as Graph
+    g2 = Graph(g)
+    g3 = ArrayGraph(g2)
+    assert g3.nb_vertices() == g.nb_vertices()
+    assert g3.nb_edges() == g.nb_edges()
+    g3 = cPickle.loads(cPickle.dumps(g3))
+    assert g3.nb_edges() == 1
+
+    # loop
+    g.add_edge((vids[3], vids[3]))
+    assert list(g.out_neighbors(vids[3])) == [vids[3]]
+    g.remove_vertex(vids[3])
+    assert vids[3] not in g
+    assert g.nb_edges() == 1
+
+    g.clear_edges()
+    assert g.nb_edges() == 0 and g.nb_out_edges(vids[0]) == 0
+    g.clear()
+    assert g.nb_vertices() == 0 and list(g.vertices()) == []
+
+    pg = ArrayPropertyGraph()
+    vid1 = pg.add_vertex()
+    vid2 = pg.add_vertex()
+    eid = pg.add_edge((vid1, vid2))
+    pg.add_vertex_property("vtest")
+    pg.add_edge_property("etest")
+    pg.vertex_property("vtest")[vid2] = 1
+    pg.edge_property("etest")[eid] = 2
+    pg2 = ArrayPropertyGraph(pg)
+    assert pg2.edge_property("etest").values() == [2]
+    pg.remove_vertex(vid2)
+    assert len(pg.vertex_property("vtest")) == 0
+    assert len(pg.edge_property("etest")) == 0
+    assert pg.nb_edges() == 0
+
+    eid = pg.add_edge((vid1, vid1))
+    pg.edge_property("etest")[eid] = 3
+    pg.remove_vertex(vid1)
+    assert pg.nb_vertices() == 0 and pg.nb_edges() == 0
+    assert len(pg.edge_property("etest")) == 0